@@ -0,0 +1,80 @@
+import os
+import shutil
+import threading
+import time
+from typing import BinaryIO
+
+
+class LocalS3Bucket:
+    """
+    Stand-in for `prefect_aws.S3Bucket` storing objects in a local directory (with the S3 key as relative path).
+
+    Implements the methods used by the scraping utils. Optionally simulates the latency and bandwidth of uploads,
+    so that benchmarks can show whether uploads keep up with processing.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        upload_latency_seconds: float = 0.0,
+        upload_bytes_per_second: float | None = None,
+    ):
+        self.root_dir = root_dir
+        self.upload_latency_seconds = upload_latency_seconds
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"LocalS3Bucket({self.root_dir!r})"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def upload_from_path(self, from_path: str, to_path: str) -> str:
+        start = time.perf_counter()
+        size = os.path.getsize(from_path)
+        delay = self.upload_latency_seconds
+        if self.upload_bytes_per_second:
+            delay += size / self.upload_bytes_per_second
+        time.sleep(delay)
+        target = self._path(to_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(from_path, target)
+        with self._lock:
+            self.uploaded_bytes += size
+            self.upload_seconds += time.perf_counter() - start
+        return to_path
+
+    def list_objects(self, folder: str = "") -> list[dict]:
+        objects = []
+        for dir_path, _, file_names in os.walk(self.root_dir):
+            for file_name in file_names:
+                key = os.path.relpath(os.path.join(dir_path, file_name), self.root_dir)
+                if key.startswith(folder):
+                    objects.append(
+                        {
+                            "Key": key,
+                            "Size": os.path.getsize(os.path.join(dir_path, file_name)),
+                        }
+                    )
+        return sorted(objects, key=lambda obj: obj["Key"])
+
+    def download_object_to_path(self, from_path: str, to_path: str) -> str:
+        shutil.copyfile(self._path(from_path), to_path)
+        return to_path
+
+    def download_object_to_file_object(
+        self, from_path: str, to_file_object: BinaryIO
+    ) -> BinaryIO:
+        with open(self._path(from_path), "rb") as f:
+            shutil.copyfileobj(f, to_file_object)
+        return to_file_object
+
+    def move_object(self, from_path: str, to_path: str) -> str:
+        target = self._path(to_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self._path(from_path), target)
+        return to_path
@@ -0,0 +1,278 @@
+"""
+Benchmarks `process_and_upload_data` with synthetic processing functions (see `benchmarks.scenarios`).
+
+Runs against a local S3 stand-in (see `benchmarks.local_s3`) without a Prefect API: tasks are called as plain functions and
+the public IP and blocks are stubbed. Every scenario runs in a separate process (so peak RSS is measured per scenario).
+Results are written to `benchmarks/results/<timestamp>_<git commit>.json`, so runs can be compared over time.
+
+Usage (from the project root):
+    python -m benchmarks.run [--scenario NAME ...] [--compare benchmarks/results/<previous run>.json]
+"""
+
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Any, Callable
+from unittest import mock
+
+from benchmarks.local_s3 import LocalS3Bucket
+from benchmarks.scenarios import DEFAULT_SCENARIOS, Scenario, make_processing_fn
+from utils.date import dt_to_fs_compatible_str
+from utils.execution import is_async_callable
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+STAGES = ["fetch", "serialize", "write", "compress", "upload"]
+
+
+class StageTimer:
+    """
+    Accumulates the time spent in each stage of the pipeline (summed across threads, so stages running concurrently
+    can add up to more than the wall time).
+    """
+
+    def __init__(self):
+        self.seconds: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def timed(self, stage: str, fn: Callable) -> Callable:
+        if is_async_callable(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.add(stage, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    def patch_method(self, stack: ExitStack, cls: type, name: str, stage: str):
+        stack.enter_context(
+            mock.patch.object(cls, name, self.timed(stage, getattr(cls, name)))
+        )
+
+
+class _TimedCompressor:
+    def __init__(self, cctx, timer: StageTimer):
+        self._cctx = cctx
+        self._timer = timer
+
+    def compress(self, data) -> bytes:
+        start = time.perf_counter()
+        try:
+            return self._cctx.compress(data)
+        finally:
+            self._timer.add("compress", time.perf_counter() - start)
+
+
+def _instrument(stack: ExitStack, timer: StageTimer, bucket: LocalS3Bucket):
+    """
+    Stubs the Prefect runtime (tasks are called as plain functions, blocks and the public IP are replaced)
+    and wraps the functions of each stage with timers.
+    """
+    from utils import scraping
+    from utils.output_writer import GroupCommitWriter
+    from utils.serialization import TimestampedRecordEncoder
+
+    stack.enter_context(
+        mock.patch.object(scraping, "get_public_ip", lambda: "127.0.0.1")
+    )
+    stack.enter_context(
+        mock.patch.object(scraping, "load_block", lambda block_type, name: bucket)
+    )
+    for task_name in ["_process_inputs_and_write_outputs", "_compress_and_upload_file"]:
+        stack.enter_context(
+            mock.patch.object(scraping, task_name, getattr(scraping, task_name).fn)
+        )
+    timer.patch_method(stack, TimestampedRecordEncoder, "encode_lines", "serialize")
+    timer.patch_method(stack, GroupCommitWriter, "write", "write")
+    timer.patch_method(stack, GroupCommitWriter, "commit", "write")
+    timer.patch_method(stack, LocalS3Bucket, "upload_from_path", "upload")
+
+    writer_init = GroupCommitWriter.__init__
+
+    def init_with_timed_compressor(self, *args, **kwargs):
+        writer_init(self, *args, **kwargs)
+        self._cctxs = {
+            name: _TimedCompressor(cctx, timer) for name, cctx in self._cctxs.items()
+        }
+
+    stack.enter_context(
+        mock.patch.object(GroupCommitWriter, "__init__", init_with_timed_compressor)
+    )
+
+
+def run_scenario(scenario: Scenario) -> dict[str, Any]:
+    """
+    Runs a single scenario (meant to be called in a fresh process) and returns its results.
+    """
+    from utils import scraping
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp_dir, ExitStack() as stack:
+        bucket = LocalS3Bucket(
+            os.path.join(tmp_dir, "s3"),
+            upload_bytes_per_second=scenario.upload_bytes_per_second,
+        )
+        _instrument(stack, timer, bucket)
+        stack.enter_context(
+            mock.patch.object(scraping, "DATA_DIR", os.path.join(tmp_dir, "data"))
+        )
+        processing_fn = timer.timed("fetch", make_processing_fn(scenario))
+        # progress and upload messages would dominate the output otherwise
+        with open(os.devnull, "w") as devnull:
+            stdout = sys.stdout
+            sys.stdout = devnull
+            start = time.perf_counter()
+            try:
+                summary = scraping.process_and_upload_data(
+                    inputs=list(range(scenario.items)),
+                    processing_fn=processing_fn,
+                    outputs_s3_prefix="benchmark/outputs",
+                    failures_s3_prefix="benchmark/failures",
+                    flow_run_id=f"benchmark-{scenario.name}",
+                    max_in_flight=scenario.max_in_flight,
+                    concurrency=scenario.concurrency,
+                    chunking=scenario.chunking,
+                    encoder=scenario.encoder,
+                    retry=scenario.retry,
+                )
+            finally:
+                wall_seconds = time.perf_counter() - start
+                sys.stdout = stdout
+
+    # compression happens within commits, but is reported separately
+    timer.seconds["write"] -= timer.seconds["compress"]
+    # ru_maxrss is in KiB on Linux, but in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_bytes = max_rss if sys.platform == "darwin" else max_rss * 1024
+    return {
+        "scenario": scenario.model_dump(mode="json"),
+        "wall_seconds": wall_seconds,
+        "items": summary["items"],
+        "items_per_second": summary["items"] / wall_seconds,
+        "output_mb_per_second": summary["bytes_out"] / 1024**2 / wall_seconds,
+        "uploaded_mb": bucket.uploaded_bytes / 1024**2,
+        "peak_rss_bytes": peak_rss_bytes,
+        "outcomes": summary["outcomes"],
+        "latency_seconds": summary["latency_seconds"],
+        "stage_seconds": {stage: timer.seconds.get(stage, 0.0) for stage in STAGES},
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(result: dict, previous: dict | None):
+    stages = ", ".join(
+        f"{stage} {seconds:.2f}s" for stage, seconds in result["stage_seconds"].items()
+    )
+    comparison = ""
+    if previous:
+        change = result["items_per_second"] / previous["items_per_second"] - 1
+        comparison = f" ({change:+.1%} vs. previous)"
+    print(
+        f"{result['scenario']['name']}: {result['items_per_second']:.0f} items/s{comparison}, "
+        f"{result['output_mb_per_second']:.1f} MB/s, peak RSS {result['peak_rss_bytes'] / 1024**2:.0f} MiB, "
+        f"wall {result['wall_seconds']:.2f}s [{stages}]"
+    )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="Name of a scenario to run (can be repeated). Runs all scenarios by default.",
+    )
+    parser.add_argument(
+        "--compare", help="Results of a previous run to compare throughput with."
+    )
+    parser.add_argument("--output", help="Where to write the results to.")
+    args = parser.parse_args()
+
+    scenarios = DEFAULT_SCENARIOS
+    if args.scenario:
+        scenarios = [s for s in DEFAULT_SCENARIOS if s.name in args.scenario]
+        unknown = set(args.scenario) - {s.name for s in scenarios}
+        if unknown:
+            parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    previous_results = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous_results = {
+                r["scenario"]["name"]: r for r in json.load(f)["results"]
+            }
+
+    started_at = datetime.now(timezone.utc)
+    commit = _git_commit()
+    results = []
+    for scenario in scenarios:
+        # a fresh process per scenario, so that peak RSS (and caches) don't carry over between scenarios
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            result = executor.submit(run_scenario, scenario).result()
+        _print_result(result, previous_results.get(scenario.name))
+        results.append(result)
+
+    output_path = args.output or os.path.join(
+        RESULTS_DIR, f"{dt_to_fs_compatible_str(started_at)}_{commit or 'unknown'}.json"
+    )
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(
+            {
+                "started_at": started_at.isoformat(),
+                "git_commit": commit,
+                "python": sys.version,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
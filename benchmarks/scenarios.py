@@ -0,0 +1,148 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable
+from pydantic import BaseModel
+
+from utils.chunk_uploads import ChunkingConfig
+from utils.execution import ConcurrencyMode
+from utils.retry import RetryConfig
+from utils.serialization import RecordEncoderName
+
+
+class Scenario(BaseModel):
+    """
+    A benchmark scenario: a synthetic processing function (with a latency profile, payload size and failure rate)
+    and the options `process_and_upload_data` is called with.
+    """
+
+    name: str
+    items: int = 5_000
+
+    latency_ms: float = 0.0
+    """
+    Median latency of a call of the processing function (simulated with `sleep`, i.e. like I/O).
+    """
+
+    latency_sigma: float = 0.0
+    """
+    Sigma of the log-normal distribution latencies are drawn from (0 for constant latencies, ~1 for a heavy tail).
+    """
+
+    payload_bytes: int = 1024
+    """
+    Approximate size of a JSON-serialized result.
+    """
+
+    failure_rate: float = 0.0
+    """
+    Probability that a call raises a (transient) `ConnectionError`.
+    """
+
+    async_fn: bool = False
+    max_in_flight: int = 1
+    concurrency: ConcurrencyMode = "threads"
+    encoder: RecordEncoderName = "json"
+    chunking: ChunkingConfig | None = None
+    retry: RetryConfig = RetryConfig(max_attempts=1)
+
+    upload_bytes_per_second: float | None = None
+    """
+    Simulated bandwidth of uploads to the local S3 stand-in (unlimited if None).
+    """
+
+    seed: int = 42
+
+
+def _make_payloads(scenario: Scenario, count: int = 64) -> list[dict]:
+    """
+    Creates a pool of results of roughly `payload_bytes` each, with the compressibility of typical API responses
+    (repeated keys, hex IDs, numbers).
+    """
+    rng = random.Random(scenario.seed)
+    payloads = []
+    for i in range(count):
+        entries = []
+        size = 0
+        while size < scenario.payload_bytes:
+            entry = {
+                "id": f"{rng.getrandbits(128):032x}",
+                "name": f"entity-{rng.randrange(10**6)}",
+                "value": rng.random(),
+            }
+            entries.append(entry)
+            size += 90
+        payloads.append({"payload_id": i, "entries": entries})
+    return payloads
+
+
+def make_processing_fn(scenario: Scenario) -> Callable[[int], Any]:
+    """
+    Returns the synthetic processing function of a scenario. Latencies and failures are drawn from an RNG seeded per input,
+    so they don't depend on the order (or concurrency) in which inputs are processed.
+    """
+    payloads = _make_payloads(scenario)
+
+    def draw(input_el: int) -> tuple[float, bool]:
+        rng = random.Random(scenario.seed * 1_000_003 + input_el)
+        latency = scenario.latency_ms / 1000
+        if scenario.latency_sigma:
+            latency *= rng.lognormvariate(0, scenario.latency_sigma)
+        return latency, rng.random() < scenario.failure_rate
+
+    if scenario.async_fn:
+
+        async def fetch_async(input_el: int):
+            latency, fail = draw(input_el)
+            if latency:
+                await asyncio.sleep(latency)
+            if fail:
+                raise ConnectionError(f"Simulated failure for input {input_el}")
+            return payloads[input_el % len(payloads)]
+
+        return fetch_async
+
+    def fetch(input_el: int):
+        latency, fail = draw(input_el)
+        if latency:
+            time.sleep(latency)
+        if fail:
+            raise ConnectionError(f"Simulated failure for input {input_el}")
+        return payloads[input_el % len(payloads)]
+
+    return fetch
+
+
+DEFAULT_SCENARIOS = [
+    Scenario(name="cpu-small-payloads", items=50_000, payload_bytes=256),
+    Scenario(name="cpu-large-payloads", items=5_000, payload_bytes=64 * 1024),
+    Scenario(
+        name="cpu-small-payloads-orjson",
+        items=50_000,
+        payload_bytes=256,
+        encoder="orjson",
+    ),
+    Scenario(
+        name="io-heavy-tail-threads",
+        items=2_000,
+        latency_ms=20,
+        latency_sigma=1.0,
+        max_in_flight=32,
+    ),
+    Scenario(
+        name="io-heavy-tail-asyncio",
+        items=2_000,
+        latency_ms=20,
+        latency_sigma=1.0,
+        max_in_flight=32,
+        async_fn=True,
+    ),
+    Scenario(name="failures-10pct", items=20_000, failure_rate=0.1),
+    Scenario(
+        name="chunked-slow-uploads",
+        items=20_000,
+        payload_bytes=8 * 1024,
+        chunking=ChunkingConfig(max_chunk_bytes=4 * 1024**2, max_local_bytes=None),
+        upload_bytes_per_second=20 * 1024**2,
+    ),
+]
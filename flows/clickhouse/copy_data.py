@@ -1,7 +1,7 @@
 from prefect import flow
-from prefect.blocks.system import Secret
 from pydantic import BaseModel
 
+from utils.bootstrap import load_block, load_secret, run_concurrently
 from utils.databases.clickhouse import (
     ClickHouseCredentials,
     create_client,
@@ -31,15 +31,16 @@ def copy_data_flow(
         use_observed_at=use_observed_at,
     )
 
-    etl_creds: ClickHouseCredentials = ClickHouseCredentials.load("clickhouse-etl-config")  # type: ignore
-    etl_client = create_client(etl_creds)
-    etl_native_port = 9000  # Default native port for ClickHouse
-
     # NOTE: need to use public IP of the ETL ClickHouse server for SELECT ... FROM remote(...) sql query
     # as it is executed from ClickHouse on Kubernetes which doesn't have access to the private IP of the ETL server which is stored in the secret)
-    ch_etl_public_ip: str = Secret.load("clickhouse-etl-public-ip").get()  # type: ignore
+    etl_creds, ch_etl_public_ip, k8s_creds = run_concurrently(
+        lambda: load_block(ClickHouseCredentials, "clickhouse-etl-config"),
+        lambda: load_secret("clickhouse-etl-public-ip"),
+        lambda: load_block(ClickHouseCredentials, "clickhouse-k8s-config"),
+    )
+    etl_client = create_client(etl_creds)
+    etl_native_port = 9000  # Default native port for ClickHouse
 
-    k8s_creds: ClickHouseCredentials = ClickHouseCredentials.load("clickhouse-k8s-config")  # type: ignore
     k8s_client = create_client(k8s_creds)
 
     etl_tbl_or_view = params.etl_tbl_or_view
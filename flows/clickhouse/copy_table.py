@@ -1,8 +1,8 @@
 from typing import Literal
 from prefect import flow
-from prefect.blocks.system import Secret
 from pydantic import BaseModel
 
+from utils.bootstrap import load_block, load_secret, run_concurrently
 from utils.flow_deployment import create_image_config
 from utils.databases.clickhouse import (
     ClickHouseCredentials,
@@ -115,14 +115,16 @@ def copy_table_flow(
     view_name: str | None = None,
     has_observed_at: bool = False,
 ):
-    etl_creds: ClickHouseCredentials = ClickHouseCredentials.load("clickhouse-etl-config")  # type: ignore
+    etl_creds, ch_etl_public_ip, k8s_creds = run_concurrently(
+        lambda: load_block(ClickHouseCredentials, "clickhouse-etl-config"),
+        lambda: load_secret("clickhouse-etl-public-ip"),
+        lambda: load_block(ClickHouseCredentials, "clickhouse-k8s-config"),
+    )
     # NOTE: need to use public IP of the ETL ClickHouse server for this task
     # (copy sql query is executed from ClickHouse on Kubernetes which doesn't have access to the private IP of the ETL server which is stored in the secret)
-    ch_etl_public_ip = Secret.load("clickhouse-etl-public-ip")
-    etl_creds.host = ch_etl_public_ip.get()  # type: ignore
+    etl_creds.host = ch_etl_public_ip
     etl_client = create_client(etl_creds)
 
-    k8s_creds: ClickHouseCredentials = ClickHouseCredentials.load("clickhouse-k8s-config")  # type: ignore
     k8s_client = create_client(k8s_creds)
 
     print(f"Copying table: {table_name}")
@@ -1,7 +1,8 @@
 from prefect import flow
 from prefect_shell import ShellOperation
 from prefect_aws import S3Bucket
-from typing import cast
+
+from utils.bootstrap import load_block, run_concurrently
 
 
 class S3BackupMetadata:
@@ -25,8 +26,10 @@ class S3BackupMetadata:
 def rclone_remote_backup(
     source_prefix: str, target_prefix: str | None = None, excludes: list[str] = []
 ):
-    source_bucket = cast(S3Bucket, S3Bucket.load("s3-bucket"))
-    target_bucket = cast(S3Bucket, S3Bucket.load("s3-backup-bucket"))
+    source_bucket, target_bucket = run_concurrently(
+        lambda: load_block(S3Bucket, "s3-bucket"),
+        lambda: load_block(S3Bucket, "s3-backup-bucket"),
+    )
     excludes_str = " ".join([f"--exclude {exclude}" for exclude in excludes])
     rclone_command = f"rclone copy rds-eu-central-1:{source_bucket.bucket_name}/{source_prefix} b2-backup:{target_bucket.bucket_name}/{source_prefix if target_prefix is None else target_prefix} {excludes_str} --progress"
     ShellOperation(commands=[rclone_command]).run()
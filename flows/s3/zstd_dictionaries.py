@@ -0,0 +1,51 @@
+from prefect import flow
+from prefect_aws import S3Bucket
+import zstandard as zstd
+
+from utils.bootstrap import load_block
+from utils.zstd import DEFAULT_DICTIONARY_SIZE, ZstdDictionaryStore
+
+
+def _compressed_size(
+    samples: list[bytes], dictionary: zstd.ZstdCompressionDict | None = None
+) -> int:
+    cctx = zstd.ZstdCompressor(level=3, dict_data=dictionary)
+    return sum(len(cctx.compress(s)) for s in samples)
+
+
+@flow(name="train-zstd-dictionaries", log_prints=True)
+def train_zstd_dictionaries(
+    s3_prefixes: list[str],
+    dict_size: int = DEFAULT_DICTIONARY_SIZE,
+    max_files: int = 20,
+    max_samples: int = 20_000,
+):
+    """
+    Trains a new version of the zstd dictionary for each of the given S3 prefixes (one per API endpoint),
+    on records sampled from the latest files under it.
+
+    Scraping runs with `zstd_dictionaries=True` pick up the new versions automatically, files compressed with older versions
+    stay readable (as dictionaries are never deleted).
+    """
+    store = ZstdDictionaryStore(load_block(S3Bucket, "s3-bucket"))
+    for s3_prefix in s3_prefixes:
+        samples = store.sample_records(s3_prefix, max_files, max_samples)
+        # every 10th sample is held out to check how much the dictionary actually helps
+        held_out = samples[::10]
+        training = [s for i, s in enumerate(samples) if i % 10]
+        try:
+            dictionary = store.train(s3_prefix, training, dict_size)
+        except zstd.ZstdError as e:
+            print(f"Could not train a dictionary for {s3_prefix}: {e}")
+            continue
+        ratio_without = sum(len(s) for s in held_out) / _compressed_size(held_out)
+        ratio_with = sum(len(s) for s in held_out) / _compressed_size(
+            held_out, dictionary
+        )
+        print(
+            f"Compression ratio of single records under {s3_prefix}: {ratio_without:.2f} without, {ratio_with:.2f} with dictionary"
+        )
+
+
+if __name__ == "__main__":
+    train_zstd_dictionaries.serve()
@@ -1,11 +1,36 @@
 from prefect import flow, task
-from utils.scraping import process_and_upload_data
+from utils.scraping import process_and_upload_data, replay_failed_inputs
 from prefect.runtime import flow_run
 
-from utils.apis.soundcharts import SoundChartsCredentials, create_client
+from utils.apis.soundcharts import (
+    SoundChartsCredentials,
+    create_client,
+    create_rate_limiter,
+    get_quota_remaining,
+)
 from utils.flow_deployment import create_image_config
+from utils.change_capture import ChangeCaptureConfig
+from utils.circuit_breaker import CircuitBreakerConfig
+from utils.rate_limiting import rate_limited
+from utils.response_cache import ResponseCache
+from utils.sharding import fan_out
+from utils.tail_latency import TailLatencyConfig
+from utils.work_queue import WorkQueue
 
-sc = create_client(SoundChartsCredentials.load("soundcharts-creds"))  # type: ignore
+creds: SoundChartsCredentials = SoundChartsCredentials.load("soundcharts-creds")  # type: ignore
+sc = create_client(creds)
+get_artist_metadata = rate_limited(create_rate_limiter(creds), get_quota_remaining)(
+    sc.artist.get_artist_metadata
+)
+
+OUTPUTS_S3_PREFIX = "soundcharts/raw-api-data-by-endpoint-and-version/artist/v2.9"
+FAILURES_S3_PREFIX = "soundcharts/failed-inputs-by-endpoint-and-version/artist/v2.9"
+WORK_QUEUE_NAME = "sc-artists"
+CHANGE_CAPTURE = ChangeCaptureConfig(
+    index_s3_key="soundcharts/cdc-fingerprints-by-endpoint-and-version/artist/v2.9/fingerprints.idx",
+    unchanged_s3_prefix="soundcharts/unchanged-inputs-by-endpoint-and-version/artist/v2.9",
+    volatile_keys={"quota_remaining"},
+)
 
 
 @task(name="sc-artist")
@@ -13,12 +38,52 @@ def fetch_artist_metadata(artist_uuid: str):
     """
     Fetches metadata for a single artist using their UUID.
     """
-    metadata = sc.artist.get_artist_metadata(artist_uuid)
+    metadata = get_artist_metadata(artist_uuid)
     return metadata
 
 
+def create_response_cache(ttl_hours: float | None) -> ResponseCache | None:
+    """
+    Returns a response cache if `ttl_hours` is set. Opt-in only: cache hits are written with the current `observed_at`,
+    so with a cache, the data of an observation may be up to `ttl_hours` older than its timestamp.
+    """
+    if ttl_hours is None:
+        return None
+    return ResponseCache("soundcharts/artist/v2.9", ttl_seconds=ttl_hours * 3600)
+
+
+def create_tail_latency_config(
+    deadline_seconds: float | None, hedge_requests: bool
+) -> TailLatencyConfig:
+    return TailLatencyConfig(
+        deadline_seconds=deadline_seconds,
+        hedge_percentile=95 if hedge_requests else None,
+        # hedged requests count against the API quota, so only the really slow ones are worth it
+        min_hedge_delay_seconds=2.0,
+    )
+
+
 @flow(name="sc-artists", log_prints=True)
-def fetch_metadata_for_artists(artist_uuids: list[str]):
+def fetch_metadata_for_artists(
+    artist_uuids: list[str],
+    max_in_flight: int = 1,
+    cache_ttl_hours: float | None = None,
+    skip_unchanged: bool = False,
+    deadline_seconds: float | None = None,
+    hedge_requests: bool = False,
+    upload_failures: bool = False,
+    circuit_breaker: CircuitBreakerConfig | None = None,
+):
+    """
+    Fetches metadata for the given artists. If `skip_unchanged` is set, metadata is only written for artists whose metadata
+    changed since it was last fetched (with `skip_unchanged` set).
+
+    Requests taking longer than `deadline_seconds` are retried. If `hedge_requests` is set, a duplicate request is sent
+    for requests that take longer than 95% of the requests so far (the first response wins).
+
+    If `upload_failures` is set, failed inputs are uploaded to `FAILURES_S3_PREFIX` (from where `sc-artists-replay-failures`
+    picks them up). If `circuit_breaker` is set, requests are paused while most of them fail (see `utils.circuit_breaker`).
+    """
     flow_run_id = flow_run.get_id()
     if not flow_run_id:
         raise ValueError(
@@ -28,7 +93,90 @@ def fetch_metadata_for_artists(artist_uuids: list[str]):
         inputs=artist_uuids,
         processing_fn=fetch_artist_metadata,
         flow_run_id=flow_run_id,
-        outputs_s3_prefix="soundcharts/raw-api-data-by-endpoint-and-version/artist/v2.9",
+        outputs_s3_prefix=OUTPUTS_S3_PREFIX,
+        failures_s3_prefix=FAILURES_S3_PREFIX if upload_failures else None,
+        max_in_flight=max_in_flight,
+        encoder="orjson",
+        response_cache=create_response_cache(cache_ttl_hours),
+        change_capture=CHANGE_CAPTURE if skip_unchanged else None,
+        tail_latency=create_tail_latency_config(deadline_seconds, hedge_requests),
+        circuit_breaker=circuit_breaker,
+    )
+
+
+@flow(name="sc-artists-enqueue", log_prints=True)
+def enqueue_artists(artist_uuids: list[str]):
+    """
+    Adds artists to the work queue consumed by `sc-artists-from-queue` runs.
+    """
+    queue = WorkQueue(WORK_QUEUE_NAME)
+    added = queue.enqueue(artist_uuids)
+    print(
+        f"Added {added} of {len(artist_uuids)} artists to the work queue: {queue.counts()}"
+    )
+
+
+@flow(name="sc-artists-from-queue", log_prints=True)
+def fetch_metadata_for_queued_artists(
+    max_in_flight: int = 1,
+    cache_ttl_hours: float | None = None,
+    deadline_seconds: float | None = None,
+    hedge_requests: bool = False,
+    upload_failures: bool = False,
+    circuit_breaker: CircuitBreakerConfig | None = None,
+):
+    """
+    Fetches metadata for artists from the work queue until it is drained. Any number of runs can consume the queue concurrently
+    (as long as they share the queue's database, see `utils.work_queue`).
+
+    The other parameters work like for `sc-artists`.
+    """
+    process_and_upload_data(
+        inputs=WorkQueue(WORK_QUEUE_NAME),
+        processing_fn=fetch_artist_metadata,
+        outputs_s3_prefix=OUTPUTS_S3_PREFIX,
+        failures_s3_prefix=FAILURES_S3_PREFIX if upload_failures else None,
+        max_in_flight=max_in_flight,
+        encoder="orjson",
+        response_cache=create_response_cache(cache_ttl_hours),
+        tail_latency=create_tail_latency_config(deadline_seconds, hedge_requests),
+        circuit_breaker=circuit_breaker,
+    )
+
+
+@flow(name="sc-artists-replay-failures", log_prints=True)
+def replay_failed_artists(max_in_flight: int = 1, only_transient: bool = True):
+    """
+    Re-fetches metadata for all artists whose fetching failed in previous runs of `sc-artists` (with `upload_failures` set).
+    """
+    replay_failed_inputs(
+        processing_fn=fetch_artist_metadata,
+        outputs_s3_prefix=OUTPUTS_S3_PREFIX,
+        failures_s3_prefix=FAILURES_S3_PREFIX,
+        only_transient=only_transient,
+        max_in_flight=max_in_flight,
+        encoder="orjson",
+    )
+
+
+@flow(name="sc-artists-fan-out", log_prints=True)
+def fan_out_metadata_for_artists(
+    artist_uuids: list[str],
+    num_shards: int = 4,
+    max_in_flight: int = 1,
+    cache_ttl_hours: float | None = None,
+):
+    """
+    Splits `artist_uuids` into `num_shards` runs of the `sc-artists` deployment, which can be picked up by different workers.
+
+    All runs share the same SoundCharts rate limit only if they share the rate limiter's database (see `utils.rate_limiting`).
+    """
+    return fan_out(
+        "sc-artists/api",
+        inputs=artist_uuids,
+        inputs_parameter="artist_uuids",
+        num_shards=num_shards,
+        parameters={"max_in_flight": max_in_flight, "cache_ttl_hours": cache_ttl_hours},
     )
 
 
@@ -39,3 +187,23 @@ if __name__ == "__main__":
         work_pool_name="Docker",
         image=create_image_config("sc-artists", "v1.1"),
     )
+    replay_failed_artists.deploy(
+        "api",
+        work_pool_name="Docker",
+        image=create_image_config("sc-artists", "v1.1"),
+    )
+    enqueue_artists.deploy(
+        "api",
+        work_pool_name="Docker",
+        image=create_image_config("sc-artists", "v1.1"),
+    )
+    fetch_metadata_for_queued_artists.deploy(
+        "api",
+        work_pool_name="Docker",
+        image=create_image_config("sc-artists", "v1.1"),
+    )
+    fan_out_metadata_for_artists.deploy(
+        "api",
+        work_pool_name="Docker",
+        image=create_image_config("sc-artists", "v1.1"),
+    )
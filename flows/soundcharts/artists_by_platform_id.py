@@ -1,11 +1,23 @@
+from functools import partial
 from prefect import flow, task
 from prefect.runtime import flow_run
 
 from utils.scraping import process_and_upload_data
-from utils.apis.soundcharts import SoundChartsCredentials, create_client
+from utils.apis.soundcharts import (
+    SoundChartsCredentials,
+    create_client,
+    create_rate_limiter,
+    get_quota_remaining,
+)
 from utils.flow_deployment import create_image_config
+from utils.rate_limiting import rate_limited
+from utils.response_cache import ResponseCache
 
-sc = create_client(SoundChartsCredentials.load("soundcharts-creds"))  # type: ignore
+creds: SoundChartsCredentials = SoundChartsCredentials.load("soundcharts-creds")  # type: ignore
+sc = create_client(creds)
+get_artist_by_platform_id = rate_limited(
+    create_rate_limiter(creds), get_quota_remaining
+)(sc.artist.get_artist_by_platform_id)
 
 
 @task(name="sc-artist-by-platform-id")
@@ -13,7 +25,7 @@ def fetch_soundchart_artist_by_platform_id(platform: str, identifier: str | int)
     """
     Fetches metadata for a single artist using an ID from another platform.
     """
-    metadata = sc.artist.get_artist_by_platform_id(platform, identifier)
+    metadata = get_artist_by_platform_id(platform, identifier)
     if metadata == {}:
         return None
     metadata["input"] = {
@@ -24,7 +36,12 @@ def fetch_soundchart_artist_by_platform_id(platform: str, identifier: str | int)
 
 
 @flow(name="sc-artists-by-platform-id", log_prints=True)
-def fetch_artists_by_platform_ids(platform: str, identifiers: list[str | int]):
+def fetch_artists_by_platform_ids(
+    platform: str,
+    identifiers: list[str | int],
+    max_in_flight: int = 1,
+    cache_ttl_hours: float | None = None,
+):
     flow_run_id = flow_run.get_id()
     if not flow_run_id:
         raise ValueError(
@@ -33,11 +50,20 @@ def fetch_artists_by_platform_ids(platform: str, identifiers: list[str | int]):
 
     process_and_upload_data(
         inputs=identifiers,
-        processing_fn=lambda identifier: fetch_soundchart_artist_by_platform_id(
-            platform=platform, identifier=identifier
-        ),
+        processing_fn=partial(fetch_soundchart_artist_by_platform_id, platform),
         flow_run_id=flow_run_id,
         outputs_s3_prefix=f"soundcharts/raw-api-data-by-endpoint-and-version/artist/by-platform/{platform}/v2.9",
+        max_in_flight=max_in_flight,
+        encoder="orjson",
+        response_cache=(
+            ResponseCache(
+                # results depend on the platform, which isn't part of the inputs
+                f"soundcharts/artist/by-platform/{platform}/v2.9",
+                ttl_seconds=cache_ttl_hours * 3600,
+            )
+            if cache_ttl_hours is not None
+            else None
+        ),
     )
 
 
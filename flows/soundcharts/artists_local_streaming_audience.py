@@ -1,13 +1,24 @@
+from functools import partial
 from typing import Literal
 from prefect import flow, task
 from utils.scraping import process_and_upload_data
 from prefect.runtime import flow_run
 from datetime import date
 
-from utils.apis.soundcharts import SoundChartsCredentials, create_client
+from utils.apis.soundcharts import (
+    SoundChartsCredentials,
+    create_client,
+    create_rate_limiter,
+    get_quota_remaining,
+)
 from utils.flow_deployment import create_image_config
+from utils.rate_limiting import rate_limited
 
-sc = create_client(SoundChartsCredentials.load("soundcharts-creds"))  # type: ignore
+creds: SoundChartsCredentials = SoundChartsCredentials.load("soundcharts-creds")  # type: ignore
+sc = create_client(creds)
+get_local_streaming_audience = rate_limited(
+    create_rate_limiter(creds), get_quota_remaining
+)(sc.artist.get_local_streaming_audience)
 
 # TODO: update as we figure out the shape of returned data
 type SupportedPlatform = Literal["spotify", "youtube"]
@@ -23,7 +34,7 @@ def fetch_artist_local_streaming_audience(
     API docs: https://doc.api.soundcharts.com/documentation/reference/artist/get-local-streaming-audience
     """
     try:
-        metadata = sc.artist.get_local_streaming_audience(
+        metadata = get_local_streaming_audience(
             artist_uuid,
             platform=platform,
             start_date=start_date.isoformat(),
@@ -42,6 +53,7 @@ def fetch_local_streaming_audience_for_artists(
     start_date: date,
     end_date: date,
     platform: SupportedPlatform = "spotify",
+    max_in_flight: int = 1,
 ):
     flow_run_id = flow_run.get_id()
     if not flow_run_id:
@@ -50,11 +62,16 @@ def fetch_local_streaming_audience_for_artists(
         )
     process_and_upload_data(
         inputs=artist_uuids,
-        processing_fn=lambda uuid: fetch_artist_local_streaming_audience(
-            uuid, platform=platform, start_date=start_date, end_date=end_date
+        processing_fn=partial(
+            fetch_artist_local_streaming_audience,
+            platform=platform,
+            start_date=start_date,
+            end_date=end_date,
         ),
         flow_run_id=flow_run_id,
         outputs_s3_prefix=f"soundcharts/raw-api-data-by-endpoint-and-version/artist/streaming/{platform}/v2",
+        max_in_flight=max_in_flight,
+        encoder="orjson",
     )
 
 
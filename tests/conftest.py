@@ -0,0 +1,62 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from soundcharts import api_util
+
+
+@pytest.fixture
+def soundcharts_api(monkeypatch):
+    """
+    Points the (pinned) SoundCharts client at a local server answering every request with `server.status`,
+    so tests see the exceptions the client actually raises. Returns the server (`server.status` can be changed at any time).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'{"errors": [{"message": "simulated"}]}'
+            self.send_response(self.server.status)  # type: ignore
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    server.status = 200  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(api_util, "BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(api_util, "HEADERS", {})
+    monkeypatch.setattr(api_util, "CLIENT_ID", None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def unreachable_soundcharts_api(monkeypatch):
+    """
+    Points the SoundCharts client at a port nothing listens on (like during a network outage).
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    monkeypatch.setattr(api_util, "BASE_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(api_util, "HEADERS", {})
+    monkeypatch.setattr(api_util, "CLIENT_ID", None)
+
+
+def call_soundcharts(endpoint: str = "/api/v2.9/artist/x"):
+    """
+    Calls the SoundCharts client without retry delays.
+    """
+    return api_util.request_wrapper(endpoint, max_retries=1, retry_delay=0, timeout=5)
+
+
+def soundcharts_error(endpoint: str = "/api/v2.9/artist/x") -> Exception:
+    with pytest.raises(Exception) as exc_info:
+        call_soundcharts(endpoint)
+    return exc_info.value  # type: ignore
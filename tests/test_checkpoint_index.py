@@ -0,0 +1,84 @@
+import random
+
+from utils.checkpoint_index import (
+    CheckpointIndex,
+    KeyedTable,
+    checkpoint_key,
+    encode_checkpoint_key,
+)
+
+
+def test_put_get_and_replace():
+    table = KeyedTable(value_columns=2)
+    assert table.put(5, 1, 2)
+    assert not table.put(5, 3, 4)
+    assert len(table) == 1
+    assert (table.get(5), table.get(5, column=1)) == (3, 4)
+    assert table.get(6) is None
+    assert 5 in table and 6 not in table
+
+
+def test_colliding_keys_are_probed():
+    table = KeyedTable(capacity=4, value_columns=1)
+    size = len(table._keys)
+    # same low bits, so all keys hash to the same slot
+    keys = [7 + n * size for n in range(4)]
+    for n, key in enumerate(keys):
+        table.put(key, n)
+    assert [table.get(key) for key in keys] == [0, 1, 2, 3]
+    assert 7 + 4 * size not in table
+
+
+def test_probing_wraps_around_the_end_of_the_table():
+    table = KeyedTable(capacity=4)
+    size = len(table._keys)
+    last_slot = size - 1
+    table.put(last_slot)
+    table.put(last_slot + size)
+    assert last_slot in table and last_slot + size in table
+    assert table._keys[0] == last_slot + size
+
+
+def test_growth_keeps_all_keys_and_values():
+    table = KeyedTable(capacity=2, value_columns=2)
+    initial_size = len(table._keys)
+    rng = random.Random(0)
+    entries = {rng.getrandbits(64) or 1: (i, 2 * i) for i in range(10_000)}
+    for key, values in entries.items():
+        table.put(key, *values)
+    assert len(table._keys) > initial_size
+    assert len(table) == len(entries)
+    assert len(table) <= 0.7 * len(table._keys)
+    for key, (a, b) in entries.items():
+        assert (table.get(key), table.get(key, column=1)) == (a, b)
+    assert sorted(table.items()) == sorted((k, *v) for k, v in entries.items())
+
+
+def test_growth_with_colliding_keys():
+    table = KeyedTable(capacity=2)
+    size = len(table._keys)
+    # collide in the initial table, spread out once it grows
+    keys = [3 + n * size for n in range(100)]
+    for key in keys:
+        table.put(key)
+    assert len(table) == 100
+    assert all(key in table for key in keys)
+
+
+def test_checkpoint_index_from_file_ignores_trailing_partial_key(tmp_path):
+    keys = [checkpoint_key(f"input-{i}") for i in range(1000)]
+    path = tmp_path / "processed_inputs.bin"
+    path.write_bytes(
+        b"".join(encode_checkpoint_key(k) for k in keys) + encode_checkpoint_key(1)[:3]
+    )
+    index = CheckpointIndex.from_file(str(path), chunk_size=100)
+    assert len(index) == 1000
+    assert all(key in index for key in keys)
+    assert len(CheckpointIndex.from_file(str(tmp_path / "missing.bin"))) == 0
+
+
+def test_checkpoint_key_is_independent_of_dict_order():
+    assert checkpoint_key({"a": 1, "b": 2}) == checkpoint_key({"b": 2, "a": 1})
+    assert checkpoint_key({"a": 1}) != checkpoint_key({"a": 2})
+    # documented: the type isn't part of the key
+    assert checkpoint_key(1) == checkpoint_key("1")
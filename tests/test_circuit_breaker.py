@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+
+from tests.conftest import call_soundcharts
+from utils.circuit_breaker import (
+    CircuitBreaker,
+    CircuitBreakerConfig,
+    CircuitOpenError,
+)
+from utils.rate_limiting import QuotaExhaustedError
+from utils.retry import is_transient_error
+
+CONFIG = CircuitBreakerConfig(
+    window_size=4, min_calls=4, open_seconds=0.05, probes_to_close=2
+)
+
+
+def fail_times(breaker: CircuitBreaker, fn, n: int):
+    for _ in range(n):
+        with pytest.raises(Exception):
+            breaker.guarded(fn)("x")
+
+
+def test_soundcharts_outage_trips_breaker(unreachable_soundcharts_api):
+    breaker = CircuitBreaker(CONFIG, is_failure=is_transient_error)
+    fail_times(breaker, lambda _: call_soundcharts(), 4)
+    assert breaker.state == "open"
+
+
+def test_soundcharts_server_errors_trip_breaker(soundcharts_api):
+    soundcharts_api.status = 503
+    breaker = CircuitBreaker(CONFIG, is_failure=is_transient_error)
+    fail_times(breaker, lambda _: call_soundcharts(), 4)
+    assert breaker.state == "open"
+
+
+def test_permanent_errors_dont_trip_breaker(soundcharts_api):
+    soundcharts_api.status = 400
+    breaker = CircuitBreaker(CONFIG, is_failure=is_transient_error)
+    fail_times(breaker, lambda _: call_soundcharts(), 8)
+    assert breaker.state == "closed"
+
+
+def test_recovers_through_half_open_probes(soundcharts_api):
+    soundcharts_api.status = 503
+    breaker = CircuitBreaker(CONFIG, is_failure=is_transient_error)
+    guarded = breaker.guarded(lambda _: call_soundcharts())
+    fail_times(breaker, lambda _: call_soundcharts(), 4)
+    assert breaker.state == "open"
+
+    soundcharts_api.status = 200
+    started = time.monotonic()
+    guarded("x")  # waits for the circuit to become half-open, then probes
+    assert time.monotonic() - started >= CONFIG.open_seconds * 0.9
+    assert breaker.state == "half_open"
+    guarded("x")
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_for_longer():
+    breaker = CircuitBreaker(CONFIG, is_failure=lambda e: True)
+
+    def failing(_):
+        raise TimeoutError()
+
+    fail_times(breaker, failing, 4)
+    assert breaker.state == "open"
+    fail_times(breaker, failing, 1)
+    assert breaker.state == "open"
+    assert breaker._open_seconds == 2 * CONFIG.open_seconds
+
+
+def test_gives_up_after_max_pause():
+    config = CONFIG.model_copy(update={"max_pause_seconds": 0.1})
+    breaker = CircuitBreaker(config, is_failure=lambda e: True)
+
+    def failing(_):
+        raise TimeoutError()
+
+    fail_times(breaker, failing, 4)
+    with pytest.raises(CircuitOpenError):
+        for _ in range(20):
+            try:
+                breaker.guarded(failing)("x")
+            except TimeoutError:
+                pass
+
+
+def test_quota_exhaustion_gives_up_immediately():
+    breaker = CircuitBreaker(CONFIG, is_failure=is_transient_error)
+    calls = []
+
+    def fn(input_el):
+        calls.append(input_el)
+        raise QuotaExhaustedError("quota used up")
+
+    with pytest.raises(CircuitOpenError):
+        breaker.guarded(fn)("a")
+    with pytest.raises(CircuitOpenError):
+        breaker.guarded(fn)("b")
+    assert calls == ["a"]
+
+
+def test_async_calls_are_guarded(unreachable_soundcharts_api):
+    breaker = CircuitBreaker(CONFIG, is_failure=is_transient_error)
+
+    async def fetch(_):
+        return await asyncio.to_thread(call_soundcharts)
+
+    guarded = breaker.guarded(fetch)
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            asyncio.run(guarded("x"))
+    assert breaker.state == "open"
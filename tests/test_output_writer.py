@@ -0,0 +1,86 @@
+import os
+
+import zstandard as zstd
+
+from utils.output_writer import (
+    DurabilityConfig,
+    GroupCommitWriter,
+    truncate_to_last_commit,
+)
+
+
+def read_zst(path: str) -> bytes:
+    with open(path, "rb") as f:
+        with zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True) as r:
+            return r.read()
+
+
+def open_writer(data_dir: str, **kwargs) -> GroupCommitWriter:
+    return GroupCommitWriter(
+        data_dir,
+        ["outputs.jsonl.zst", "processed.bin"],
+        compressed_files=["outputs.jsonl.zst"],
+        **kwargs,
+    )
+
+
+def test_reopening_discards_writes_after_last_commit(tmp_path):
+    writer = open_writer(str(tmp_path))
+    writer.write("outputs.jsonl.zst", b'{"a": 1}\n')
+    writer.write("processed.bin", b"12345678")
+    writer.commit()
+    writer.state["cursor"] = 1
+    writer.commit()
+    # crash while writing the next commit: some of its data made it to disk, the commit state didn't
+    with open(writer.path("outputs.jsonl.zst"), "ab") as f:
+        f.write(zstd.ZstdCompressor().compress(b'{"a": 2}\n')[:5])
+    with open(writer.path("processed.bin"), "ab") as f:
+        f.write(b"87654321")
+
+    with open_writer(str(tmp_path)) as reopened:
+        assert os.path.getsize(reopened.path("processed.bin")) == 8
+        assert read_zst(reopened.path("outputs.jsonl.zst")) == b'{"a": 1}\n'
+        assert reopened.state == {"cursor": 1}
+        reopened.write("outputs.jsonl.zst", b'{"a": 3}\n')
+    assert read_zst(writer.path("outputs.jsonl.zst")) == b'{"a": 1}\n{"a": 3}\n'
+
+
+def test_uncommitted_writes_are_only_buffered(tmp_path):
+    writer = open_writer(str(tmp_path), config=DurabilityConfig(max_items=2))
+    writer.write("processed.bin", b"12345678")
+    assert not writer.end_item()
+    assert os.path.getsize(writer.path("processed.bin")) == 0
+    writer.write("processed.bin", b"87654321")
+    assert writer.end_item()
+    assert writer.committed_size("processed.bin") == 16
+
+
+def test_on_commit_callbacks(tmp_path):
+    writer = open_writer(str(tmp_path))
+    commits = []
+    writer.on_commit.append(
+        lambda: commits.append(writer.committed_size("processed.bin"))
+    )
+    writer.write("processed.bin", b"12345678")
+    writer.commit()
+    assert commits == [8]
+
+
+def test_rotate_starts_a_new_file(tmp_path):
+    writer = open_writer(str(tmp_path))
+    writer.write("outputs.jsonl.zst", b"first\n")
+    target = str(tmp_path / "sealed.jsonl.zst")
+    writer.rotate("outputs.jsonl.zst", target)
+    writer.write("outputs.jsonl.zst", b"second\n")
+    writer.close()
+    assert read_zst(target) == b"first\n"
+    assert read_zst(writer.path("outputs.jsonl.zst")) == b"second\n"
+    # the commit state refers to the new file, so reopening doesn't truncate it
+    truncate_to_last_commit(str(tmp_path), ["outputs.jsonl.zst"])
+    assert read_zst(writer.path("outputs.jsonl.zst")) == b"second\n"
+
+
+def test_truncate_without_commit_state_does_nothing(tmp_path):
+    (tmp_path / "outputs.jsonl.zst").write_bytes(b"data")
+    truncate_to_last_commit(str(tmp_path), ["outputs.jsonl.zst"])
+    assert (tmp_path / "outputs.jsonl.zst").read_bytes() == b"data"
@@ -0,0 +1,98 @@
+import pytest
+import requests
+
+from tests.conftest import soundcharts_error
+from utils.rate_limiting import QuotaExhaustedError
+from utils.retry import (
+    RetryConfig,
+    is_replayable_error,
+    is_transient_error,
+    with_retries,
+)
+
+
+def test_soundcharts_connection_errors_are_transient(unreachable_soundcharts_api):
+    error = soundcharts_error()
+    # the client wraps the connection error, without any status code in the message
+    assert isinstance(error, RuntimeError)
+    assert str(error).startswith("Maximum retry attempts reached")
+    assert error.__cause__ is not None
+    assert is_transient_error(error)
+    assert is_replayable_error(error)
+
+
+@pytest.mark.parametrize("status", [502, 503, 504])
+def test_soundcharts_exhausted_server_error_retries_are_transient(
+    soundcharts_api, status
+):
+    soundcharts_api.status = status
+    error = soundcharts_error()
+    assert str(error).startswith("Unhandled error or maximum retries exceeded")
+    assert is_transient_error(error)
+
+
+def test_soundcharts_http_500_is_transient(soundcharts_api):
+    soundcharts_api.status = 500
+    assert is_transient_error(soundcharts_error())
+
+
+def test_soundcharts_client_errors_are_permanent(soundcharts_api):
+    soundcharts_api.status = 400
+    assert not is_transient_error(soundcharts_error())
+
+
+def test_cause_chain_is_followed():
+    try:
+        try:
+            raise requests.exceptions.ConnectionError("connection reset")
+        except requests.exceptions.ConnectionError as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as e:
+        assert is_transient_error(e)
+
+
+def test_implicit_context_is_followed_unless_suppressed():
+    try:
+        try:
+            raise TimeoutError()
+        except TimeoutError:
+            raise RuntimeError("while handling")
+    except RuntimeError as e:
+        assert is_transient_error(e)
+    try:
+        try:
+            raise TimeoutError()
+        except TimeoutError:
+            raise RuntimeError("suppressed") from None
+    except RuntimeError as e:
+        assert not is_transient_error(e)
+
+
+def test_status_of_outer_error_wins_over_cause():
+    try:
+        try:
+            raise TimeoutError()
+        except TimeoutError as e:
+            raise RuntimeError("404 Not Found: https://example.com") from e
+    except RuntimeError as e:
+        assert not is_transient_error(e)
+
+
+def test_quota_exhaustion_is_replayable_but_not_retried():
+    error = QuotaExhaustedError("quota used up")
+    assert not is_transient_error(error)
+    assert is_replayable_error(error)
+
+
+def test_with_retries_retries_wrapped_soundcharts_errors(unreachable_soundcharts_api):
+    calls = []
+
+    def fetch(input_el):
+        calls.append(input_el)
+        if len(calls) < 3:
+            raise soundcharts_error()
+        return {"ok": input_el}
+
+    config = RetryConfig(max_attempts=3, base_delay_seconds=0)
+    assert with_retries(fetch, config)("a") == {"ok": "a"}
+    assert len(calls) == 3
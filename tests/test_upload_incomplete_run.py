@@ -0,0 +1,62 @@
+import os
+from datetime import datetime, timezone
+
+from upload_output_for_incomplete_data_fetching_run import (
+    later_timestamp,
+    upload_sealed_chunks,
+)
+from utils.chunk_uploads import RollingChunks
+
+
+class RecordingBucket:
+    def __init__(self):
+        self.uploaded_keys: list[str] = []
+
+    def upload_from_path(self, path: str, to_path: str):
+        self.uploaded_keys.append(to_path)
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_later_timestamp():
+    assert later_timestamp(utc(2025, 1, 1, 0, 0, 0, 500), None) == utc(2025, 1, 1)
+    assert later_timestamp(utc(2025, 1, 1, 0, 0, 2), utc(2025, 1, 1, 0, 0, 1)) == utc(
+        2025, 1, 1, 0, 0, 2
+    )
+    # equal after truncating to seconds
+    assert later_timestamp(
+        utc(2025, 1, 1, 0, 0, 1, 999), utc(2025, 1, 1, 0, 0, 1)
+    ) == utc(2025, 1, 1, 0, 0, 2)
+
+
+def test_sealed_chunks_are_uploaded_after_existing_files_in_order(tmp_path):
+    sealed_dir = tmp_path / RollingChunks.SEALED_DIR / "outputs.jsonl.zst"
+    os.makedirs(sealed_dir)
+    chunk_names = [
+        "2025-01-01_00-00-00_1.2.3.4_run_00003.jsonl.zst",
+        "2025-01-01_00-00-00_1.2.3.4_run_00004.jsonl.zst",
+        "2025-01-01_00-10-00_1.2.3.4_run_00005.jsonl.zst",
+    ]
+    for name in chunk_names:
+        (sealed_dir / name).touch()
+    bucket = RecordingBucket()
+
+    last = upload_sealed_chunks(
+        bucket,  # type: ignore
+        str(tmp_path),
+        "outputs.jsonl.zst",
+        "prefix",
+        "day",
+        after=utc(2025, 1, 1, 0, 5),
+    )
+
+    assert bucket.uploaded_keys == [
+        "prefix/dt=2025-01-01/2025-01-01_00-05-01_1.2.3.4_run_00003.jsonl.zst",
+        "prefix/dt=2025-01-01/2025-01-01_00-05-02_1.2.3.4_run_00004.jsonl.zst",
+        "prefix/dt=2025-01-01/2025-01-01_00-10-00_1.2.3.4_run_00005.jsonl.zst",
+    ]
+    assert bucket.uploaded_keys == sorted(bucket.uploaded_keys)
+    assert last == utc(2025, 1, 1, 0, 10)
+    assert not os.listdir(sealed_dir)
@@ -0,0 +1,78 @@
+import time
+
+from utils.work_queue import LeaseHeartbeat, WorkQueue
+
+
+def make_queue(tmp_path, visibility_timeout_seconds: float = 600.0) -> WorkQueue:
+    return WorkQueue(
+        "test",
+        visibility_timeout_seconds=visibility_timeout_seconds,
+        db_path=str(tmp_path / "queue.sqlite3"),
+    )
+
+
+def test_enqueue_skips_duplicates(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.enqueue(["a", "b", {"id": 1}]) == 3
+    assert queue.enqueue(["a", {"id": 1}, "c"]) == 1
+    assert queue.counts() == {"pending": 4}
+
+
+def test_leased_items_are_invisible_to_other_workers(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue(["a", "b", "c"])
+    first = queue.lease("worker-1", 2)
+    second = queue.lease("worker-2", 2)
+    assert len(first) == 2 and len(second) == 1
+    assert {input_el for _, input_el in first + second} == {"a", "b", "c"}
+    assert queue.lease("worker-3", 2) == []
+
+
+def test_expired_leases_are_leased_again(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout_seconds=0.1)
+    queue.enqueue(["a", "b"])
+    leased = queue.lease("crashed-worker", 2)
+    assert queue.lease("worker", 2) == []
+    time.sleep(0.15)
+    assert queue.lease("worker", 2) == leased
+
+
+def test_acked_items_are_never_leased_again(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout_seconds=0.1)
+    queue.enqueue(["a", "b"])
+    (key, _), (_, other) = queue.lease("worker", 2)
+    queue.ack([key])
+    time.sleep(0.15)
+    assert [input_el for _, input_el in queue.lease("worker-2", 2)] == [other]
+    assert queue.counts() == {"acked": 1, "leased": 1}
+
+
+def test_release_makes_items_available_again(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue(["a", "b"])
+    leased = queue.lease("worker", 2)
+    queue.release("worker")
+    assert queue.lease("worker-2", 2) == leased
+
+
+def test_iter_leased_releases_leases_of_previous_attempt(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue(["a", "b"])
+    queue.lease("flow-run", 1)
+    assert sorted(input_el for _, input_el in queue.iter_leased("flow-run")) == [
+        "a",
+        "b",
+    ]
+
+
+def test_heartbeat_keeps_leases_alive(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout_seconds=0.3)
+    queue.enqueue(["a"])
+    with LeaseHeartbeat(queue, "worker"):
+        leased = queue.lease("worker", 1)
+        # several visibility timeouts without any commit
+        time.sleep(1.0)
+        assert queue.lease("worker-2", 1) == []
+    # once the heartbeat stops, the lease expires as usual
+    time.sleep(0.4)
+    assert queue.lease("worker-2", 1) == leased
@@ -10,9 +10,21 @@ from argparse import ArgumentParser
 
 from prefect_aws import S3Bucket
 
-from utils.zstd import compress_file
+from utils.date import (
+    PartitionGranularity,
+    dt_to_fs_compatible_str,
+    fs_compatible_str_to_datetime,
+    hive_partition_path,
+)
+from utils.chunk_uploads import RollingChunks
+from utils.output_writer import truncate_to_last_commit
 from utils.public_ip import get_public_ip
-from utils.scraping import DATA_DIR
+from utils.scraping import DATA_DIR, FAILED_INPUTS_FILE, PROCESSED_OUTPUTS_FILE
+
+TIMESTAMP_LENGTH = len("2025-01-31_13-59-59")
+"""
+Length of the timestamp at the start of the names of uploaded files (see `utils.date.dt_to_fs_compatible_str`).
+"""
 
 
 def docker_copy(container_id: str, source_path: str, target_path: str) -> None:
@@ -69,7 +81,77 @@ def size_bytes_human_readable(size: int) -> str:
     return f"{out:.2f} PB"
 
 
-def upload_incompletely_fetched_data(container_id: str, s3_prefix: str):
+def partitioned_s3_key(
+    s3_prefix: str, file_name: str, partitioning: PartitionGranularity | None
+) -> str:
+    """
+    Returns the S3 key of a file under `s3_prefix`, in the Hive-style partition of the timestamp at the start of its name (if partitioned).
+    """
+    if partitioning is not None:
+        partition = hive_partition_path(
+            fs_compatible_str_to_datetime(file_name), partitioning
+        )
+        s3_prefix = f"{s3_prefix}/{partition}"
+    return f"{s3_prefix}/{file_name}"
+
+
+def list_sealed_chunks(flow_run_dir: str, file_name: str) -> list[str]:
+    """
+    Returns the names of chunks of a file that were sealed (with rolling chunks enabled) but not uploaded yet.
+    """
+    sealed_dir = os.path.join(flow_run_dir, RollingChunks.SEALED_DIR, file_name)
+    if not os.path.isdir(sealed_dir):
+        return []
+    # names starting with a dot are leftovers of conversions that didn't finish
+    return sorted(name for name in os.listdir(sealed_dir) if not name.startswith("."))
+
+
+def later_timestamp(timestamp: datetime, after: datetime | None) -> datetime:
+    """
+    Returns `timestamp` (truncated to seconds), or `after` + 1 second if it isn't later than `after`.
+
+    The import is only triggered for files with names that are lexicographically larger than those of existing files,
+    and file names start with their timestamp.
+    """
+    timestamp = timestamp.replace(microsecond=0)
+    if after is not None and timestamp <= after:
+        return after + timedelta(seconds=1)
+    return timestamp
+
+
+def upload_sealed_chunks(
+    bucket: S3Bucket,
+    flow_run_dir: str,
+    file_name: str,
+    s3_prefix: str,
+    partitioning: PartitionGranularity | None,
+    after: datetime | None = None,
+) -> datetime | None:
+    """
+    Uploads the sealed chunks of a file under their sealed names (which are the S3 file names they would have been uploaded with).
+
+    Chunks whose timestamp isn't later than `after` (or than the previous chunk) are uploaded with a later one (see `later_timestamp`),
+    so that their names are lexicographically larger than those of existing files and keep the order in which the chunks were sealed.
+    Returns the timestamp of the last uploaded chunk (or `after` if there are none).
+    """
+    sealed_dir = os.path.join(flow_run_dir, RollingChunks.SEALED_DIR, file_name)
+    for chunk_name in list_sealed_chunks(flow_run_dir, file_name):
+        chunk_path = os.path.join(sealed_dir, chunk_name)
+        after = later_timestamp(fs_compatible_str_to_datetime(chunk_name), after)
+        upload_name = dt_to_fs_compatible_str(after) + chunk_name[TIMESTAMP_LENGTH:]
+        s3_key = partitioned_s3_key(s3_prefix, upload_name, partitioning)
+        bucket.upload_from_path(chunk_path, to_path=s3_key)
+        print(f"Uploaded sealed chunk {chunk_name} to {s3_key}")
+        os.remove(chunk_path)
+    return after
+
+
+def upload_incompletely_fetched_data(
+    container_id: str,
+    s3_prefix: str,
+    partitioning: PartitionGranularity | None = None,
+    failures_s3_prefix: str | None = None,
+):
     public_ip = get_public_ip()
     container_dir_path = f"/app/{DATA_DIR}/."  # /. is required to copy the _contents_ of the directory rather than the directory itself
     host_dir_path = (
@@ -85,15 +167,16 @@ def upload_incompletely_fetched_data(container_id: str, s3_prefix: str):
             f"Expected exactly one flow run subdirectory, found {len(flow_run_dirs)}: {flow_run_dirs}"
         )
     flow_run_id = flow_run_dirs[0]
-    flow_data_path = os.path.join(host_dir_path, flow_run_id, "fetched.jsonl")
+    flow_run_dir = os.path.join(host_dir_path, flow_run_id)
+    compressed_path = os.path.join(flow_run_dir, PROCESSED_OUTPUTS_FILE)
     output_last_modified = datetime.fromtimestamp(
-        os.path.getmtime(flow_data_path), tz=timezone.utc
+        os.path.getmtime(compressed_path), tz=timezone.utc
     )
 
-    # Compress the copied file
-    compressed_path = compress_file(flow_data_path, remove_input_file=True)
+    # data is already compressed while it is written, but anything after the last commit may be an incomplete zstd frame
+    truncate_to_last_commit(flow_run_dir, [PROCESSED_OUTPUTS_FILE])
     print(
-        f"Compressed data to {compressed_path} ({size_bytes_human_readable(os.path.getsize(compressed_path))})"
+        f"Found compressed data at {compressed_path} ({size_bytes_human_readable(os.path.getsize(compressed_path))})"
     )
 
     # parse timestamp from existing files under prefix
@@ -102,8 +185,21 @@ def upload_incompletely_fetched_data(container_id: str, s3_prefix: str):
     keys = [f["Key"] for f in existing_files]
     filenames = [os.path.basename(key) for key in keys]
 
-    # check if flow_run_id already exists in any of the filenames; return the confliciting filename if it does
-    conflicting_files = [f for f in existing_files if flow_run_id in f["Key"]]
+    # sealed chunks may be uploaded with a later timestamp, so they are identified by the rest of their names
+    sealed_chunk_suffixes = tuple(
+        name[TIMESTAMP_LENGTH:]
+        for name in list_sealed_chunks(flow_run_dir, PROCESSED_OUTPUTS_FILE)
+    )
+    # with rolling chunks, earlier chunks of the flow run have already been uploaded (with the flow run ID in their names),
+    # so only the complete output, a previously salvaged one or the sealed chunks themselves count as conflicts
+    conflicting_suffixes = (
+        f"{flow_run_id}.jsonl.zst",
+        f"{flow_run_id}_incomplete.jsonl.zst",
+        *sealed_chunk_suffixes,
+    )
+    conflicting_files = [
+        f for f in existing_files if f["Key"].endswith(conflicting_suffixes)
+    ]
     if conflicting_files:
         # add human-readable size to the conflicting files
         for f in conflicting_files:
@@ -114,36 +210,55 @@ def upload_incompletely_fetched_data(container_id: str, s3_prefix: str):
         )
 
     print(f"Found existing files: {filenames}")
+    largest_existing_timestamp = None
     if not keys:
-        timestamp_str = output_last_modified.strftime("%Y-%m-%d_%H-%M-%S")
-        print(
-            f"No existing files found, using last modified timestamp string in S3 key: {timestamp_str}"
-        )
+        print("No existing files found")
     else:
         print(f"{len(filenames)} existing files found in S3 under prefix {s3_prefix}.")
         lexicographically_largest_file = max(filenames)
         print(f"Lexicographically largest file: {lexicographically_largest_file}")
-        existing_timestamp = extract_timestamp_from_filename(
+        largest_existing_timestamp = extract_timestamp_from_filename(
             lexicographically_largest_file
         )
-        print(f"Extracted timestamp: {existing_timestamp}")
+        print(f"Extracted timestamp: {largest_existing_timestamp}")
 
-        if output_last_modified <= existing_timestamp:
-            # use largest existing timestamp + 1 second as timestamp_str to make it lexicographically larger
-            # if it isn't larger, import will not be triggered for file after upload
-            timestamp_str = (existing_timestamp + timedelta(seconds=1)).strftime(
-                "%Y-%m-%d_%H-%M-%S"
-            )
-            print(
-                f"Using adjusted timestamp string {timestamp_str} (largest existing + 1 second) for S3 upload to make it lexicographically larger than existing files (otherwise import won't trigger)."
-            )
-        else:
-            timestamp_str = output_last_modified.strftime("%Y-%m-%d_%H-%M-%S")
-            print(f"Using last modified timestamp string for S3 key: {timestamp_str}")
+    # chunks sealed (but not uploaded) before the run failed, see `RollingChunks.upload_leftover_chunks`
+    # like the main file, they need names lexicographically larger than the existing files (otherwise import won't trigger)
+    last_timestamp = upload_sealed_chunks(
+        bucket,
+        flow_run_dir,
+        PROCESSED_OUTPUTS_FILE,
+        s3_prefix,
+        partitioning,
+        after=largest_existing_timestamp,
+    )
+    if failures_s3_prefix is not None:
+        # failure files aren't imported (`replay_failed_inputs` reads all of them regardless of their names), so existing ones don't matter
+        upload_sealed_chunks(
+            bucket, flow_run_dir, FAILED_INPUTS_FILE, failures_s3_prefix, partitioning
+        )
+    elif list_sealed_chunks(flow_run_dir, FAILED_INPUTS_FILE):
+        print(
+            "Found sealed chunks of failed inputs, pass --failures-s3-prefix to upload them"
+        )
 
     # Upload the compressed file to S3
-    s3_key = (
-        f"{s3_prefix}/{timestamp_str}_{public_ip}_{flow_run_id}_incomplete.jsonl.zst"
+    if os.path.getsize(compressed_path) == 0:
+        # everything written so far was sealed into chunks
+        print("No data written since the last sealed chunk, nothing else to upload")
+        return
+    timestamp = later_timestamp(output_last_modified, last_timestamp)
+    timestamp_str = dt_to_fs_compatible_str(timestamp)
+    if timestamp == output_last_modified.replace(microsecond=0):
+        print(f"Using last modified timestamp string for S3 key: {timestamp_str}")
+    else:
+        print(
+            f"Using adjusted timestamp string {timestamp_str} (largest existing or last sealed chunk + 1 second) for S3 upload to make it lexicographically larger than existing files (otherwise import won't trigger)."
+        )
+    s3_key = partitioned_s3_key(
+        s3_prefix,
+        f"{timestamp_str}_{public_ip}_{flow_run_id}_incomplete.jsonl.zst",
+        partitioning,
     )
     bucket.upload_from_path(compressed_path, to_path=s3_key)
     os.remove(compressed_path)
@@ -155,9 +270,22 @@ if __name__ == "__main__":
     )
     parser.add_argument("container_id", type=str, help="Docker container ID or name")
     parser.add_argument("s3_prefix", type=str, help="S3 prefix to upload the data to")
+    parser.add_argument(
+        "--partitioning",
+        choices=["day", "hour"],
+        default=None,
+        help="Upload to a Hive-style partition under the prefix (should match the partitioning used by the flow)",
+    )
+    parser.add_argument(
+        "--failures-s3-prefix",
+        default=None,
+        help="S3 prefix to upload sealed chunks of failed inputs to (only relevant with rolling chunks)",
+    )
 
     args = parser.parse_args()
     upload_incompletely_fetched_data(
         container_id=args.container_id,
         s3_prefix=args.s3_prefix,
+        partitioning=args.partitioning,
+        failures_s3_prefix=args.failures_s3_prefix,
     )
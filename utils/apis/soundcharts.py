@@ -4,6 +4,8 @@ from prefect.blocks.core import Block
 from pydantic import SecretStr
 from soundcharts.client import SoundchartsClient
 
+from utils.rate_limiting import SharedTokenBucket
+
 
 class SoundChartsCredentials(Block):
     app_id: str
@@ -16,6 +18,27 @@ def create_client(creds: SoundChartsCredentials):
     )
 
 
+def create_rate_limiter(
+    creds: SoundChartsCredentials, max_rate: float = 10.0
+) -> SharedTokenBucket:
+    """
+    Creates a rate limiter shared by all flow runs (on the same host) using the given SoundCharts credentials.
+
+    Args:
+        max_rate: Maximum number of API calls per second across all flow runs.
+    """
+    return SharedTokenBucket(key=f"soundcharts:{creds.app_id}", max_rate=max_rate)
+
+
+def get_quota_remaining(result) -> int | None:
+    """
+    Returns the remaining API quota reported with a SoundCharts API response (if the client version includes it).
+    """
+    if isinstance(result, dict) and isinstance(result.get("quota_remaining"), int):
+        return result["quota_remaining"]
+    return None
+
+
 def store_soundcharts_credentials():
     """
     Store SoundCharts API credentials as Prefect secret.
@@ -0,0 +1,48 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from prefect.blocks.core import Block
+from prefect.blocks.system import Secret
+
+_blocks: dict[tuple[type[Block], str], Block] = {}
+_lock = threading.Lock()
+
+
+def load_block[B: Block](block_type: type[B], name: str) -> B:
+    """
+    Loads a block, caching it for the lifetime of the process. Returns a copy, so callers may modify it (e.g. the host of credentials).
+    """
+    key = (block_type, name)
+    with _lock:
+        block = _blocks.get(key)
+    if block is None:
+        # loaded outside of the lock, so that different blocks can be loaded concurrently
+        block = block_type.load(name)
+        with _lock:
+            _blocks[key] = block
+    return block.model_copy(deep=True)  # type: ignore
+
+
+def load_secret(name: str) -> str:
+    """
+    Returns the value of a `Secret` block (cached for the lifetime of the process).
+    """
+    return load_block(Secret, name).get()  # type: ignore
+
+
+def run_concurrently(*fns: Callable[[], Any]) -> list[Any]:
+    """
+    Calls all functions concurrently (on threads), returning their results in the same order. Meant for the setup at the start
+    of a flow run (loading blocks and secrets, getting the public IP), which is dominated by waiting for I/O.
+
+    Raises the first exception (in the order of `fns`) if any of the calls failed.
+    """
+    if len(fns) <= 1:
+        return [fn() for fn in fns]
+    with ThreadPoolExecutor(
+        max_workers=len(fns), thread_name_prefix="bootstrap"
+    ) as executor:
+        # copy the context so that Prefect's run context (e.g. for loading blocks from the right API) is available in the threads
+        futures = [executor.submit(contextvars.copy_context().run, fn) for fn in fns]
+        return [future.result() for future in futures]
@@ -0,0 +1,120 @@
+import json
+import os
+from array import array
+from typing import Any
+from prefect_aws import S3Bucket
+from pydantic import BaseModel
+
+from utils.checkpoint_index import KEY_SIZE, KeyedTable, hash_key
+
+_ENTRY_SIZE = 2 * KEY_SIZE
+
+
+class ChangeCaptureConfig(BaseModel):
+    """
+    Enables change data capture (CDC) for a scraping run: results are only written if they differ from the last result
+    seen for the same input (by any run sharing the same index). Unchanged results are replaced by lightweight markers.
+    """
+
+    index_s3_key: str
+    """
+    S3 key of the index holding the fingerprint of the last result seen for each input.
+    Every run loads it at the start and uploads an updated version once its outputs have been uploaded.
+
+    NOTE: runs writing to the same index concurrently (e.g. shards of a fan-out) overwrite each other's updates.
+    This is safe (lost updates only cause records to be written again by later runs), but wastes some space.
+    """
+
+    unchanged_s3_prefix: str | None = None
+    """
+    The prefix under which markers for inputs with unchanged results are uploaded (as JSONL with the input, the fingerprint and
+    a timestamp). If None, markers are not written at all.
+    """
+
+    volatile_keys: set[str] = set()
+    """
+    Names of fields (at any level of nesting) that are ignored when fingerprinting results, e.g. fields that change
+    with every request (like request IDs or the remaining API quota).
+    """
+
+
+def _without_keys(data: Any, keys: set[str]) -> Any:
+    if isinstance(data, dict):
+        return {k: _without_keys(v, keys) for k, v in data.items() if k not in keys}
+    if isinstance(data, list):
+        return [_without_keys(item, keys) for item in data]
+    return data
+
+
+def fingerprint(data: Any, volatile_keys: set[str] = set()) -> int:
+    """
+    Returns a 64-bit hash of `data` (ignoring fields listed in `volatile_keys`) that doesn't depend on the order of dict keys.
+    """
+    if volatile_keys:
+        data = _without_keys(data, volatile_keys)
+    return hash_key(
+        json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    )
+
+
+def encode_fingerprint_entry(key: int, fingerprint: int) -> bytes:
+    return key.to_bytes(KEY_SIZE, "little") + fingerprint.to_bytes(KEY_SIZE, "little")
+
+
+class FingerprintIndex(KeyedTable):
+    """
+    Maps checkpoint keys of inputs (see `utils.checkpoint_index`) to the fingerprint of their last result,
+    stored in a `KeyedTable` with one value column (16-32 bytes per entry).
+
+    Files hold concatenated (key, fingerprint) entries as written by `encode_fingerprint_entry`; later entries win.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        super().__init__(capacity, value_columns=1)
+
+    @classmethod
+    def from_files(
+        cls, file_paths: list[str], chunk_size: int = 1 << 20
+    ) -> "FingerprintIndex":
+        """
+        Loads an index from files containing concatenated entries (skipping files that don't exist).
+        """
+        existing = [fp for fp in file_paths if os.path.exists(fp)]
+        index = cls(capacity=sum(os.path.getsize(fp) for fp in existing) // _ENTRY_SIZE)
+        chunk_size -= chunk_size % _ENTRY_SIZE
+        for file_path in existing:
+            with open(file_path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    chunk = chunk[: len(chunk) - len(chunk) % _ENTRY_SIZE]
+                    entries = array("Q")
+                    entries.frombytes(chunk)
+                    for i in range(0, len(entries), 2):
+                        index.set(entries[i], entries[i + 1])
+        return index
+
+    def write(self, file_path: str):
+        entries = array("Q")
+        for key, value in self.items():
+            entries.append(key)
+            entries.append(value)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            entries.tofile(f)
+        os.replace(tmp_path, file_path)
+
+    def set(self, key: int, value: int):
+        self.put(key, value)
+
+
+def download_fingerprint_index(bucket: S3Bucket, s3_key: str, file_path: str):
+    """
+    Downloads the fingerprint index stored under `s3_key` to `file_path` (creating an empty file if it doesn't exist in S3 yet).
+    """
+    tmp_path = file_path + ".tmp"
+    if any(obj["Key"] == s3_key for obj in bucket.list_objects(s3_key)):
+        bucket.download_object_to_path(s3_key, tmp_path)
+        print(f"Downloaded fingerprint index from {s3_key}")
+    else:
+        print(f"No fingerprint index found at {s3_key}, starting with an empty one")
+        open(tmp_path, "wb").close()
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+from array import array
+from typing import Any, Iterator
+
+KEY_SIZE = 8
+"""
+Size of a checkpoint key in bytes (both in memory and in checkpoint files).
+"""
+
+_EMPTY = 0
+_MAX_LOAD_FACTOR = 0.7
+
+
+def canonical_input_key(input_el: Any) -> str:
+    """
+    Returns a stable string representation of an input.
+
+    Strings are used as they are, everything else is serialized as JSON with sorted keys,
+    so that e.g. dicts with the same items produce the same key regardless of their insertion order.
+
+    NOTE: the type of an input isn't part of its key, so e.g. `1` and `"1"` get the same key (as do `"null"` and `None`).
+    This is intended for inputs like platform identifiers that may be passed either way, and keys are persisted
+    (in checkpoints, work queues and fingerprint indexes), so changing this would make existing ones unusable.
+    Inputs that need to be told apart by their type shouldn't be mixed within the same run.
+    """
+    if isinstance(input_el, str):
+        return input_el
+    return json.dumps(input_el, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def hash_key(text: str) -> int:
+    """
+    Returns a fixed-width (64-bit) hash of a string, used both for checkpoint keys and result fingerprints.
+    """
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+    return int.from_bytes(digest, "little")
+
+
+def checkpoint_key(input_el: Any) -> int:
+    """
+    Returns the fixed-width (64-bit) hash of the canonical key of an input, as stored in checkpoint indexes.
+    """
+    # 0 marks empty slots in the hash table, so it can't be used as a key
+    return hash_key(canonical_input_key(input_el)) or 1
+
+
+def encode_checkpoint_key(key: int) -> bytes:
+    return key.to_bytes(KEY_SIZE, "little")
+
+
+class KeyedTable:
+    """
+    An open-addressing hash table keyed by checkpoint keys (see `checkpoint_key`), backed by flat arrays of 64-bit integers:
+    one for the keys and one per value column (`value_columns`, none for a plain set of keys).
+
+    Uses roughly 8-16 bytes per key and column (vs. 100+ bytes per entry of a Python set or dict), with O(1) lookups.
+    """
+
+    def __init__(self, capacity: int = 1024, value_columns: int = 0):
+        size = 1
+        while size < capacity / _MAX_LOAD_FACTOR:
+            size *= 2
+        self._keys = array("Q", bytes(size * KEY_SIZE))
+        self._columns = [
+            array("Q", bytes(size * KEY_SIZE)) for _ in range(value_columns)
+        ]
+        self._mask = size - 1
+        self._len = 0
+
+    def put(self, key: int, *values: int) -> bool:
+        """
+        Adds a key (or replaces its values if it is already present). Returns False if the key was already present.
+        """
+        i = self._find_slot(key)
+        is_new = self._keys[i] != key
+        if is_new:
+            self._keys[i] = key
+            self._len += 1
+        for column, value in zip(self._columns, values):
+            column[i] = value
+        if self._len > _MAX_LOAD_FACTOR * (self._mask + 1):
+            self._grow()
+        return is_new
+
+    def get(self, key: int, column: int = 0) -> int | None:
+        """
+        Returns a value of a key (None if the key isn't present).
+        """
+        i = self._find_slot(key)
+        return self._columns[column][i] if self._keys[i] == key else None
+
+    def items(self) -> Iterator[tuple[int, ...]]:
+        """
+        Yields (key, *values) tuples of all keys in the table (in no particular order).
+        """
+        for i, key in enumerate(self._keys):
+            if key != _EMPTY:
+                yield (key, *(column[i] for column in self._columns))
+
+    def __contains__(self, key: int) -> bool:
+        return self._keys[self._find_slot(key)] == key
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _find_slot(self, key: int) -> int:
+        # keys are already uniformly distributed hashes, so their low bits can be used as the slot index directly
+        i = key & self._mask
+        while True:
+            slot = self._keys[i]
+            if slot == _EMPTY or slot == key:
+                return i
+            i = (i + 1) & self._mask
+
+    def _grow(self):
+        # rehash straight from the old arrays (materializing the entries as tuples would take far more memory than the table itself)
+        old_keys, old_columns = self._keys, self._columns
+        size = len(old_keys) * 2
+        self._keys = array("Q", bytes(size * KEY_SIZE))
+        self._columns = [array("Q", bytes(size * KEY_SIZE)) for _ in old_columns]
+        self._mask = size - 1
+        for j, key in enumerate(old_keys):
+            if key == _EMPTY:
+                continue
+            i = self._find_slot(key)
+            self._keys[i] = key
+            for column, old_column in zip(self._columns, old_columns):
+                column[i] = old_column[j]
+
+
+class CheckpointIndex(KeyedTable):
+    """
+    A set of checkpoint keys (see `checkpoint_key`), stored in a `KeyedTable` without values (8-16 bytes per key).
+    """
+
+    @classmethod
+    def from_file(cls, file_path: str, chunk_size: int = 1 << 20) -> "CheckpointIndex":
+        """
+        Loads an index from a file containing concatenated keys (as written by `encode_checkpoint_key`).
+        """
+        file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        index = cls(capacity=file_size // KEY_SIZE)
+        if file_size == 0:
+            return index
+        chunk_size -= chunk_size % KEY_SIZE
+        with open(file_path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                # ignore a trailing partial key (which can't be there if the file was written by a GroupCommitWriter anyway)
+                chunk = chunk[: len(chunk) - len(chunk) % KEY_SIZE]
+                keys = array("Q")
+                keys.frombytes(chunk)
+                if keys.itemsize != KEY_SIZE:
+                    raise RuntimeError("array typecode 'Q' must be 8 bytes wide")
+                for key in keys:
+                    index.add(key)
+        return index
+
+    def add(self, key: int) -> bool:
+        """
+        Adds a key to the index. Returns False if it was already present.
+        """
+        return self.put(key)
@@ -0,0 +1,344 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Protocol
+from prefect_aws import S3Bucket
+from pydantic import BaseModel, model_validator
+
+from utils.date import (
+    PartitionGranularity,
+    fs_compatible_str_to_datetime,
+    hive_partition_path,
+)
+from utils.output_writer import GroupCommitWriter
+
+
+class ChunkingConfig(BaseModel):
+    """
+    Controls how output files of a scraping run are split into chunks that are uploaded while processing continues.
+
+    A chunk is sealed (and queued for upload) on the first commit after it exceeds either limit.
+    """
+
+    max_chunk_bytes: int | None = 128 * 1024**2
+    """
+    Maximum (compressed) size of a chunk in bytes.
+    """
+
+    max_chunk_age_seconds: float | None = 15 * 60
+    """
+    Maximum time in seconds a chunk is written to before it is sealed.
+    """
+
+    max_local_bytes: int | None = 1024**3
+    """
+    Hard cap on local disk usage by chunks (sealed chunks waiting for upload + chunks currently written to).
+    Processing is paused while uploads catch up if it is exceeded.
+    """
+
+    upload_attempts: int = 3
+    """
+    How often uploading a chunk is attempted before the run fails (the chunk stays on disk and is uploaded by a retried run).
+    """
+
+    @model_validator(mode="after")
+    def check_local_bytes_fit_chunk(self):
+        if self.max_local_bytes is not None and (
+            self.max_chunk_bytes is None or self.max_chunk_bytes >= self.max_local_bytes
+        ):
+            raise ValueError(
+                "max_local_bytes requires max_chunk_bytes to be set to a smaller value"
+            )
+        return self
+
+
+class ChunkConverter(Protocol):
+    """
+    Converts sealed chunks to another format before they are uploaded (e.g. `utils.parquet.ParquetConverter`).
+    """
+
+    def s3_file_name(self, file_name: str) -> str:
+        """
+        Returns the name of a converted chunk, given the name of the original one.
+        """
+        ...
+
+    def convert(self, file_path: str) -> str:
+        """
+        Converts a chunk, returning the path of the converted file. It must be in the same directory and its name must start with a dot.
+        """
+        ...
+
+
+class ChunkSink(Protocol):
+    """
+    Writes chunks to a destination other than S3 (e.g. a database), see `utils.clickhouse_sink.ClickHouseSink`.
+    """
+
+    def write_chunk(self, file_path: str, chunk_name: str):
+        """
+        Writes the records of a chunk. Must be idempotent for the same `chunk_name`, as chunks may be written again by a retried run.
+        """
+        ...
+
+
+class ChunkUploader:
+    """
+    Uploads files to S3 (and writes them to sinks) on a background thread, deleting each of them once it has been uploaded.
+
+    Keeps track of the total size of files that are queued or currently uploading, so callers can limit local disk usage.
+    Upload errors are re-raised on the calling thread by the next call to `submit`, `wait_for_staged_bytes_below` or `close`.
+    """
+
+    def __init__(self, bucket: S3Bucket, upload_attempts: int = 3):
+        self.bucket = bucket
+        self.upload_attempts = upload_attempts
+        self._queue: deque[
+            tuple[str, str | None, int, ChunkConverter | None, list[ChunkSink]]
+        ] = deque()
+        self._staged_bytes = 0
+        self._closed = False
+        self._error: Exception | None = None
+        self._cond = threading.Condition()
+        # run with a copy of the current context so that prints end up in the logs of the Prefect task run
+        ctx = contextvars.copy_context()
+        self._thread = threading.Thread(
+            target=ctx.run, args=(self._run,), name="chunk-uploader", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        file_path: str,
+        s3_key: str | None,
+        converter: ChunkConverter | None = None,
+        sinks: list[ChunkSink] | None = None,
+    ):
+        """
+        Queues a file for upload. If a converter is provided, the file is converted (on the background thread) before it is uploaded.
+        The (unconverted) file is written to all `sinks` before uploading it. If `s3_key` is None, it is only written to the sinks.
+        """
+        size = os.path.getsize(file_path)
+        with self._cond:
+            self._raise_if_failed()
+            self._queue.append((file_path, s3_key, size, converter, sinks or []))
+            self._staged_bytes += size
+            self._cond.notify_all()
+
+    def wait_for_staged_bytes_below(self, limit: int):
+        """
+        Blocks until the size of files waiting for upload is below `limit` (or no files are waiting anymore).
+        """
+        with self._cond:
+            if self._staged_bytes > limit:
+                print(
+                    f"Pausing until uploads catch up ({self._staged_bytes} bytes waiting for upload, limit: {limit})"
+                )
+            while self._staged_bytes > limit and self._staged_bytes > 0:
+                self._raise_if_failed()
+                self._cond.wait()
+            self._raise_if_failed()
+
+    def close(self):
+        """
+        Waits until all submitted files have been uploaded and stops the background thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError("Uploading a chunk failed") from self._error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue or self._error is not None:
+                    return
+                file_path, s3_key, size, converter, sinks = self._queue[0]
+            try:
+                for sink in sinks:
+                    self._attempt(
+                        f"Writing {file_path} to {type(sink).__name__}",
+                        sink.write_chunk,
+                        file_path,
+                        os.path.basename(file_path),
+                    )
+                if s3_key is not None:
+                    if converter is None:
+                        self._upload(file_path, s3_key)
+                    else:
+                        converted_path = converter.convert(file_path)
+                        self._upload(converted_path, s3_key)
+                        os.remove(converted_path)
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            os.remove(file_path)
+            with self._cond:
+                self._queue.popleft()
+                self._staged_bytes -= size
+                self._cond.notify_all()
+
+    def _upload(self, file_path: str, s3_key: str):
+        self._attempt(
+            f"Uploading {file_path}",
+            self.bucket.upload_from_path,
+            file_path,
+            to_path=s3_key,
+        )
+        print(f"File {file_path} uploaded to {s3_key} in S3 bucket {self.bucket}.")
+
+    def _attempt(self, description: str, fn: Callable[..., Any], *args, **kwargs):
+        for attempt in range(1, self.upload_attempts + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.upload_attempts:
+                    raise
+                print(
+                    f"{description} failed (attempt {attempt}/{self.upload_attempts}): {e}"
+                )
+                time.sleep(2**attempt)
+
+
+class RollingChunks:
+    """
+    Seals files written by a `GroupCommitWriter` into chunks and uploads them in the background.
+
+    Sealed chunks are moved to `<data_dir>/sealed/<file_name>/<final S3 file name>` before they are uploaded,
+    so chunks that weren't uploaded before a crash are picked up (under the same S3 key) when the run is resumed.
+    """
+
+    SEALED_DIR = "sealed"
+
+    def __init__(
+        self,
+        writer: GroupCommitWriter,
+        uploader: ChunkUploader,
+        s3_prefixes: dict[str, str | None],
+        s3_file_name: Callable[[int | None], str],
+        config: ChunkingConfig | None = None,
+        converters: dict[str, ChunkConverter] | None = None,
+        partitioning: PartitionGranularity | None = None,
+        sinks: dict[str, list[ChunkSink]] | None = None,
+    ):
+        """
+        Args:
+            writer: The writer whose files should be uploaded in chunks.
+            uploader: The uploader used for uploading sealed chunks.
+            s3_prefixes: The S3 prefix to upload chunks of each file to (files not included are never uploaded).
+                Chunks of files with a prefix of None are only written to their sinks.
+            s3_file_name: Returns the file name of a chunk in S3, given its sequence number (None if chunking is disabled).
+            config: How to split files into chunks. If None, each file is uploaded as a single chunk by `finish()`.
+            converters: Converters for chunks of some of the files (applied before uploading them).
+            partitioning: If provided, chunks are uploaded to Hive-style partitions (e.g. `<prefix>/dt=YYYY-MM-DD/<file name>`),
+                based on the timestamp at the start of their file name.
+            sinks: Sinks that chunks of some of the files are written to (before uploading them to S3).
+        """
+        self.writer = writer
+        self.uploader = uploader
+        self.s3_prefixes = s3_prefixes
+        self.s3_file_name = s3_file_name
+        self.config = config
+        self.converters = converters or {}
+        self.partitioning = partitioning
+        self.sinks = sinks or {}
+        self.uploaded_chunks = {name: 0 for name in s3_prefixes}
+        """
+        Number of chunks of each file uploaded by this attempt of the run (including leftovers of previous attempts).
+        """
+        self._chunk_started = {name: time.monotonic() for name in s3_prefixes}
+        for name in s3_prefixes:
+            os.makedirs(self._sealed_dir(name), exist_ok=True)
+
+    def upload_leftover_chunks(self):
+        """
+        Queues chunks sealed by a previous attempt of the run (that haven't been uploaded yet) for upload.
+        """
+        for name, s3_prefix in self.s3_prefixes.items():
+            for file_name in sorted(os.listdir(self._sealed_dir(name))):
+                file_path = os.path.join(self._sealed_dir(name), file_name)
+                if file_name.startswith("."):
+                    # leftover of a conversion that didn't finish
+                    os.remove(file_path)
+                    continue
+                print(f"Found chunk {file_name} from a previous attempt, uploading it")
+                self._submit(name, file_path, file_name)
+
+    def rotate_if_due(self):
+        """
+        Seals all chunks exceeding the configured limits. Should be called after commits.
+        """
+        if self.config is None:
+            return
+        for name in self.s3_prefixes:
+            size = self.writer.committed_size(name)
+            if size == 0:
+                continue
+            if (
+                self.config.max_chunk_bytes is not None
+                and size >= self.config.max_chunk_bytes
+            ) or (
+                self.config.max_chunk_age_seconds is not None
+                and time.monotonic() - self._chunk_started[name]
+                >= self.config.max_chunk_age_seconds
+            ):
+                self.seal(name)
+        if self.config.max_local_bytes is not None:
+            current_bytes = sum(
+                self.writer.committed_size(name) for name in self.s3_prefixes
+            )
+            self.uploader.wait_for_staged_bytes_below(
+                self.config.max_local_bytes - current_bytes
+            )
+
+    def seal(self, name: str):
+        chunk_seq = None
+        if self.config is not None:
+            chunk_seqs = self.writer.state.setdefault("chunk_seqs", {})
+            chunk_seq = chunk_seqs.get(name, 0)
+            chunk_seqs[name] = chunk_seq + 1
+        file_name = self.s3_file_name(chunk_seq)
+        sealed_path = os.path.join(self._sealed_dir(name), file_name)
+        self.writer.rotate(name, sealed_path)
+        self._chunk_started[name] = time.monotonic()
+        self._submit(name, sealed_path, file_name)
+
+    def finish(self):
+        """
+        Seals the remaining data of all files and waits until all chunks are uploaded.
+        """
+        self.writer.commit()
+        for name in self.s3_prefixes:
+            if self.writer.committed_size(name) > 0:
+                self.seal(name)
+        self.uploader.close()
+
+    def _submit(self, name: str, sealed_path: str, file_name: str):
+        converter = self.converters.get(name)
+        if converter is not None:
+            file_name = converter.s3_file_name(file_name)
+        s3_prefix = self.s3_prefixes[name]
+        s3_key = None
+        if s3_prefix is not None:
+            if self.partitioning is not None:
+                partition = hive_partition_path(
+                    fs_compatible_str_to_datetime(file_name), self.partitioning
+                )
+                s3_prefix = f"{s3_prefix}/{partition}"
+            s3_key = f"{s3_prefix}/{file_name}"
+        self.uploaded_chunks[name] += 1
+        self.uploader.submit(sealed_path, s3_key, converter, self.sinks.get(name))
+
+    def _sealed_dir(self, name: str) -> str:
+        return os.path.join(self.writer.data_dir, self.SEALED_DIR, name)
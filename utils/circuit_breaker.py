@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Literal
+from pydantic import BaseModel
+
+from utils.execution import wrap_sync_or_async
+from utils.metrics import RunMetrics
+from utils.rate_limiting import QuotaExhaustedError
+
+type CircuitState = Literal["closed", "open", "half_open"]
+
+_POLL_INTERVAL_SECONDS = 0.5
+"""
+How often calls waiting for a probe in the half-open state check whether they may proceed.
+"""
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised for calls made after the circuit breaker gave up waiting for the upstream service to recover
+    (or after the API quota was exhausted). Inputs whose processing failed with this error are neither written to the failures nor checkpointed.
+    """
+
+
+class CircuitBreakerConfig(BaseModel):
+    """
+    Pauses calls of a processing function while it fails for most inputs (e.g. because an upstream API is down),
+    instead of writing a failure for every remaining input.
+
+    Once the failure rate among the last `window_size` calls exceeds `failure_rate_threshold`, the circuit opens and all calls
+    wait for `open_seconds`. Then, single probe calls are let through (half-open state): once `probes_to_close` probes in a row
+    succeeded, the circuit closes and processing resumes. A failed probe opens the circuit again (for twice as long, up to
+    `max_open_seconds`). Only transient errors (see `utils.retry.is_transient_error`) count as failures.
+
+    If a call fails with a `QuotaExhaustedError`, the breaker gives up right away (as the quota won't recover within the run),
+    so the remaining inputs are left unprocessed instead of all failing.
+    """
+
+    failure_rate_threshold: float = 0.5
+    window_size: int = 50
+    """
+    Number of most recent calls the failure rate is computed from.
+    """
+
+    min_calls: int = 20
+    """
+    Minimum number of calls in the window before the circuit can open.
+    """
+
+    open_seconds: float = 60.0
+    max_open_seconds: float = 15 * 60
+    probes_to_close: int = 3
+
+    max_pause_seconds: float | None = 60 * 60
+    """
+    Total time the circuit may stay open (or half-open) before the run gives up: the remaining inputs are left unprocessed
+    (so a retry of the run picks them up) and the run fails. If None, the run waits for the upstream service indefinitely.
+    """
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker (see `CircuitBreakerConfig`) guarding calls of a processing function.
+    """
+
+    def __init__(
+        self,
+        config: CircuitBreakerConfig,
+        is_failure: Callable[[Exception], bool],
+        metrics: RunMetrics | None = None,
+    ):
+        """
+        Args:
+            is_failure: Returns whether an error raised by the processing function indicates a problem of the upstream service
+                (rather than of the input).
+        """
+        self.config = config
+        self.is_failure = is_failure
+        self.metrics = metrics
+        self.state: CircuitState = "closed"
+        self._window: deque[bool] = deque(maxlen=config.window_size)
+        self._lock = threading.Lock()
+        # incremented with every state change, so that results of calls made before a change are ignored
+        self._epoch = 0
+        self._open_seconds = config.open_seconds
+        self._open_until = 0.0
+        self._outage_started: float | None = None
+        self._probe_in_flight = False
+        self._probe_successes = 0
+        self._gave_up: str | None = None
+
+    def guarded[T](self, processing_fn: Callable[[T], Any]) -> Callable[[T], Any]:
+        """
+        Wraps a (sync or async) processing function so that calls wait while the circuit is open.
+        """
+
+        async def async_wrapper(input_el: T):
+            while True:
+                epoch, wait = self._acquire()
+                if epoch is not None:
+                    break
+                await asyncio.sleep(wait)
+            try:
+                result = await processing_fn(input_el)
+            except QuotaExhaustedError as e:
+                raise self._give_up(f"API quota exhausted ({e}), giving up") from e
+            except Exception as e:
+                self._record(epoch, ok=not self.is_failure(e))
+                raise
+            self._record(epoch, ok=True)
+            return result
+
+        def wrapper(input_el: T):
+            while True:
+                epoch, wait = self._acquire()
+                if epoch is not None:
+                    break
+                time.sleep(wait)
+            try:
+                result = processing_fn(input_el)
+            except QuotaExhaustedError as e:
+                raise self._give_up(f"API quota exhausted ({e}), giving up") from e
+            except Exception as e:
+                self._record(epoch, ok=not self.is_failure(e))
+                raise
+            self._record(epoch, ok=True)
+            return result
+
+        return wrap_sync_or_async(processing_fn, wrapper, async_wrapper)
+
+    def _acquire(self) -> tuple[int | None, float]:
+        """
+        Returns (epoch, 0) if a call may proceed, (None, seconds to wait before trying again) otherwise.
+        """
+        with self._lock:
+            if self._gave_up is not None:
+                raise CircuitOpenError(self._gave_up)
+            now = time.monotonic()
+            if self.state == "closed":
+                return self._epoch, 0.0
+            if (
+                self.config.max_pause_seconds is not None
+                and self._outage_started is not None
+                and now - self._outage_started > self.config.max_pause_seconds
+            ):
+                raise CircuitOpenError(
+                    f"Circuit breaker open for more than {self.config.max_pause_seconds} seconds, giving up"
+                )
+            if self.state == "open":
+                if now < self._open_until:
+                    return None, self._open_until - now
+                self._transition("half_open")
+                self._probe_successes = 0
+            if self._probe_in_flight:
+                return None, _POLL_INTERVAL_SECONDS
+            self._probe_in_flight = True
+            return self._epoch, 0.0
+
+    def _give_up(self, reason: str) -> CircuitOpenError:
+        """
+        Makes all further calls fail with a `CircuitOpenError`, returning one to raise for the current call.
+        """
+        with self._lock:
+            if self._gave_up is None:
+                print(f"Circuit breaker: {reason}")
+                self._gave_up = reason
+        return CircuitOpenError(reason)
+
+    def _record(self, epoch: int, ok: bool):
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            if self.state == "half_open":
+                self._probe_in_flight = False
+                if not ok:
+                    self._open_seconds = min(
+                        2 * self._open_seconds, self.config.max_open_seconds
+                    )
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.config.probes_to_close:
+                    paused = time.monotonic() - (self._outage_started or 0.0)
+                    print(
+                        f"Circuit breaker closed after {paused:.0f} seconds, resuming processing"
+                    )
+                    if self.metrics is not None:
+                        self.metrics.increment("circuit_paused_seconds", int(paused))
+                    self._window.clear()
+                    self._open_seconds = self.config.open_seconds
+                    self._outage_started = None
+                    self._transition("closed")
+                return
+            self._window.append(ok)
+            failures = self._window.count(False)
+            if (
+                len(self._window) >= self.config.min_calls
+                and failures / len(self._window) >= self.config.failure_rate_threshold
+            ):
+                print(
+                    f"Circuit breaker opened: {failures} of the last {len(self._window)} calls failed"
+                )
+                if self.metrics is not None:
+                    self.metrics.increment("circuit_opened")
+                self._outage_started = time.monotonic()
+                self._open()
+
+    def _open(self):
+        self._open_until = time.monotonic() + self._open_seconds
+        print(f"Pausing calls for {self._open_seconds:g} seconds")
+        self._transition("open")
+
+    def _transition(self, state: CircuitState):
+        self.state = state
+        self._epoch += 1
@@ -0,0 +1,121 @@
+import os
+from typing import Any, Iterator
+from pydantic import BaseModel
+
+from utils.bootstrap import load_block
+from utils.databases.clickhouse import ClickHouseCredentials, create_client
+from utils.zstd import open_stream_reader
+
+
+class ClickHouseSinkConfig(BaseModel):
+    """
+    Enables inserting the outputs of a scraping run directly into a ClickHouse table (in addition to, or instead of, uploading them to S3).
+
+    Outputs are inserted chunk by chunk as JSONEachRow, so the latency until data is queryable is bounded by the chunk age
+    (see `ChunkingConfig.max_chunk_age_seconds`). Without chunking, all outputs are inserted once all inputs have been processed.
+
+    Every insert carries a deduplication token derived from the name of the chunk and the position of the batch within it.
+    Chunks of a retried run keep their names, so inserting them again is a no-op for tables with deduplication enabled
+    (always the case for Replicated*MergeTree, requires the `non_replicated_deduplication_window` setting otherwise).
+    """
+
+    table: str
+    """
+    The table to insert into (optionally qualified with the database, e.g. `raw.soundcharts_artists`).
+    Its columns need to match the fields of the records (including the timestamp added by the scraping utils).
+    """
+
+    credentials_block: str = "clickhouse-etl-config"
+    """
+    Name of the `ClickHouseCredentials` block used for connecting to ClickHouse.
+    """
+
+    max_batch_bytes: int = 16 * 1024**2
+    """
+    Maximum (uncompressed) size of the records sent with a single insert.
+    """
+
+    async_insert: bool = True
+    """
+    Whether to use asynchronous inserts, letting the server buffer small batches into larger parts.
+    Inserts still wait until the data has been written, so no data is lost if the run crashes afterwards.
+    """
+
+    settings: dict[str, Any] = {}
+    """
+    Additional settings sent with every insert (overriding the defaults of the sink).
+    """
+
+
+class ClickHouseSink:
+    """
+    Inserts zstd-compressed JSONL files (as written by the scraping utils) into a ClickHouse table.
+
+    Not thread-safe, meant to be used from the thread uploading chunks (see `utils.chunk_uploads.ChunkUploader`).
+    """
+
+    def __init__(self, config: ClickHouseSinkConfig):
+        self.config = config
+        # loading the credentials (and connecting) right away makes runs with misconfigured sinks fail before processing anything
+        self._client = create_client(
+            load_block(ClickHouseCredentials, config.credentials_block)
+        )
+        self.inserted_rows = 0
+
+    def write_chunk(self, file_path: str, chunk_name: str):
+        """
+        Inserts all records of a chunk, using `chunk_name` (which must be unique across runs) for deduplication tokens.
+        """
+        rows = 0
+        for batch_seq, batch in enumerate(self._iter_batches(file_path)):
+            summary = self._client.raw_insert(
+                self.config.table,
+                insert_block=batch,
+                fmt="JSONEachRow",
+                settings=self._insert_settings(f"{chunk_name}:{batch_seq}"),
+            )
+            rows += summary.written_rows
+        self.inserted_rows += rows
+        print(
+            f"File {file_path} inserted into ClickHouse table {self.config.table} ({rows} rows written)."
+        )
+
+    def _insert_settings(self, deduplication_token: str) -> dict[str, Any]:
+        settings: dict[str, Any] = {
+            "insert_deduplicate": 1,
+            "insert_deduplication_token": deduplication_token,
+            # timestamps are written as ISO 8601 strings with time zone offsets
+            "date_time_input_format": "best_effort",
+        }
+        if self.config.async_insert:
+            settings.update(
+                async_insert=1, wait_for_async_insert=1, async_insert_deduplicate=1
+            )
+        return {**settings, **self.config.settings}
+
+    def _iter_batches(self, file_path: str) -> Iterator[bytes]:
+        """
+        Yields the (decompressed) lines of a file in batches of at most `max_batch_bytes` (unless a single line is larger).
+        Batches only depend on the contents of the file, so their deduplication tokens are stable across attempts.
+        """
+        if os.path.getsize(file_path) == 0:
+            return
+        batch = bytearray()
+        with open(file_path, "rb") as f:
+            reader = open_stream_reader(f)
+            pending = b""
+            while chunk := reader.read(1024**2):
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if (
+                        batch
+                        and len(batch) + len(line) + 1 > self.config.max_batch_bytes
+                    ):
+                        yield bytes(batch)
+                        batch.clear()
+                    batch += line + b"\n"
+            if pending:
+                batch += pending + b"\n"
+        if batch:
+            yield bytes(batch)
@@ -1,6 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import re
-from typing import List
+from typing import List, Literal
+
+type PartitionGranularity = Literal["day", "hour"]
 
 
 def date_isoformat(dt: datetime) -> str:
@@ -14,6 +16,57 @@ def dt_to_fs_compatible_str(dt: datetime):
     return dt.strftime("%Y-%m-%d_%H-%M-%S")
 
 
+def fs_compatible_str_to_datetime(s: str) -> datetime:
+    """
+    Parses a (UTC) timestamp in the format produced by `dt_to_fs_compatible_str` at the start of `s` (e.g. a file name).
+    """
+    return datetime.strptime(s[:19], "%Y-%m-%d_%H-%M-%S").replace(tzinfo=timezone.utc)
+
+
+def hive_partition_path(dt: datetime, granularity: PartitionGranularity = "day") -> str:
+    """
+    Returns the Hive-style partition path for a datetime, e.g. "dt=2025-01-31" or "dt=2025-01-31/hour=13".
+    """
+    path = f"dt={date_isoformat(dt)}"
+    if granularity == "hour":
+        path += f"/hour={dt.hour:02d}"
+    return path
+
+
+def hive_partition_to_datetime(file_path: str) -> datetime:
+    """
+    Extracts the start of the Hive-style partition (see `hive_partition_path`) from a file path (e.g. an S3 key), returning a (UTC) datetime object.
+    Raises an exception if the path contains no partition.
+    """
+    match = re.search(r"dt=(\d{4}-\d{2}-\d{2})(?:/hour=(\d{2}))?", file_path)
+    if not match:
+        raise Exception(f"Could not extract partition from file path: {file_path}")
+    dt = datetime.strptime(match.group(1), "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    if match.group(2):
+        dt = dt.replace(hour=int(match.group(2)))
+    return dt
+
+
+def generate_hive_partition_paths_between(
+    start: datetime, end: datetime, granularity: PartitionGranularity = "day"
+) -> List[str]:
+    """
+    Returns the paths of all partitions overlapping the time range from `start` to `end` (both inclusive),
+    e.g. for listing only the relevant S3 prefixes or building globs for ClickHouse's `s3()` table function.
+    """
+    if start > end:
+        raise ValueError("Start date must be before end date.")
+    step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    current = start.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        current = current.replace(hour=0)
+    paths: List[str] = []
+    while current <= end:
+        paths.append(hive_partition_path(current, granularity))
+        current += step
+    return paths
+
+
 def generate_daily_datetimes_between(start: datetime, end: datetime) -> List[datetime]:
     if start > end:
         raise ValueError("Start date must be before end date.")
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Literal
+from prefect import Task
+
+type ConcurrencyMode = Literal["threads", "asyncio"]
+
+type ItemExecutionMode = Literal["plain", "task"]
+"""
+"plain" calls the functions wrapped by Prefect tasks directly, "task" creates a Prefect task run for every call.
+"""
+
+type ProcessingResult[T] = tuple[T, Any, Exception | None]
+"""
+(input, output, exception) - `output` is None if processing the input raised `exception`.
+"""
+
+
+def is_async_callable(fn: Callable) -> bool:
+    """
+    Returns True if calling `fn` returns an awaitable (coroutine functions and async Prefect tasks).
+    """
+    return inspect.iscoroutinefunction(fn) or bool(getattr(fn, "isasync", False))
+
+
+def wrap_sync_or_async(
+    processing_fn: Callable, wrapper: Callable, async_wrapper: Callable
+) -> Callable:
+    """
+    Returns `async_wrapper` if `processing_fn` is async (see `is_async_callable`), `wrapper` otherwise,
+    with the name and docstring of `processing_fn`.
+    """
+    chosen = async_wrapper if is_async_callable(processing_fn) else wrapper
+    # don't copy the attributes of e.g. Prefect tasks to the wrapper
+    return functools.wraps(processing_fn, updated=())(chosen)
+
+
+def as_plain_callable(fn: Callable) -> Callable:
+    """
+    Returns the function wrapped by a Prefect task (also if the task is wrapped in a `functools.partial`), or `fn` itself otherwise.
+
+    Calling it doesn't create a task run, which avoids the per-call overhead of Prefect's orchestration (API calls, state tracking).
+    NOTE: task features like retries, caching or timeouts don't apply to plain calls.
+    """
+    if isinstance(fn, functools.partial):
+        return functools.partial(as_plain_callable(fn.func), *fn.args, **fn.keywords)
+    if isinstance(fn, Task):
+        return fn.fn
+    return fn
+
+
+def iter_results[T](
+    inputs: Iterable[T],
+    processing_fn: Callable[[T], Any],
+    max_in_flight: int = 1,
+    concurrency: ConcurrencyMode = "threads",
+) -> Iterator[ProcessingResult[T]]:
+    """
+    Calls `processing_fn` for every input, keeping at most `max_in_flight` calls running at the same time.
+
+    Results are yielded in completion order (which is the input order if `max_in_flight == 1`) from the thread
+    consuming the iterator, so whoever consumes them (e.g. the code writing outputs and checkpoints) stays the single writer.
+    Exceptions raised by `processing_fn` are yielded instead of being raised.
+
+    Args:
+        inputs: The inputs to process. Only consumed as fast as processing slots become available.
+        processing_fn: The function to call for each input. May be async, in which case the asyncio variant is always used.
+        max_in_flight: Maximum number of concurrent calls of `processing_fn`.
+        concurrency: "threads" runs calls on a thread pool, "asyncio" runs them on an event loop (sync functions are offloaded to threads).
+    """
+    if max_in_flight < 1:
+        raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+    if concurrency == "asyncio" or is_async_callable(processing_fn):
+        yield from _iter_results_asyncio(inputs, processing_fn, max_in_flight)
+    elif max_in_flight == 1:
+        yield from _iter_results_sequential(inputs, processing_fn)
+    else:
+        yield from _iter_results_threaded(inputs, processing_fn, max_in_flight)
+
+
+def _iter_results_sequential[T](
+    inputs: Iterable[T], processing_fn: Callable[[T], Any]
+) -> Iterator[ProcessingResult[T]]:
+    for input_el in inputs:
+        try:
+            output = processing_fn(input_el)
+        except Exception as e:
+            yield input_el, None, e
+            continue
+        yield input_el, output, None
+
+
+def _iter_results_threaded[T](
+    inputs: Iterable[T], processing_fn: Callable[[T], Any], max_in_flight: int
+) -> Iterator[ProcessingResult[T]]:
+    inputs_iter = iter(inputs)
+    pending: dict[Future, T] = {}
+    executor = ThreadPoolExecutor(
+        max_workers=max_in_flight, thread_name_prefix="processing_fn"
+    )
+
+    def submit_next() -> None:
+        for input_el in inputs_iter:
+            # copy the context so that Prefect's run context (required for calling tasks) is available in the worker thread
+            ctx = contextvars.copy_context()
+            pending[executor.submit(ctx.run, processing_fn, input_el)] = input_el
+            return
+
+    try:
+        for _ in range(max_in_flight):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                input_el = pending.pop(future)
+                submit_next()
+                e = future.exception()
+                if e is None:
+                    yield input_el, future.result(), None
+                elif isinstance(e, Exception):
+                    yield input_el, None, e
+                else:
+                    raise e
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _iter_results_asyncio[T](
+    inputs: Iterable[T], processing_fn: Callable[[T], Any], max_in_flight: int
+) -> Iterator[ProcessingResult[T]]:
+    inputs_iter = iter(inputs)
+    call_async = is_async_callable(processing_fn)
+    loop = asyncio.new_event_loop()
+    # sync functions are offloaded to the default executor, so it needs enough threads to keep max_in_flight calls running
+    loop.set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="processing_fn"
+        )
+    )
+    pending: dict[asyncio.Task, T] = {}
+
+    async def call(input_el: T):
+        if call_async:
+            return await processing_fn(input_el)
+        return await asyncio.to_thread(processing_fn, input_el)
+
+    def submit_next() -> None:
+        for input_el in inputs_iter:
+            pending[loop.create_task(call(input_el))] = input_el
+            return
+
+    try:
+        for _ in range(max_in_flight):
+            submit_next()
+        while pending:
+            done, _ = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            )
+            for task in done:
+                input_el = pending.pop(task)
+                submit_next()
+                e = task.exception()
+                if e is None:
+                    yield input_el, task.result(), None
+                elif isinstance(e, Exception):
+                    yield input_el, None, e
+                else:
+                    raise e
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
@@ -0,0 +1,116 @@
+import ast
+import io
+import json
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Iterator
+from prefect_aws import S3Bucket
+
+from utils.zstd import open_stream_reader
+
+
+def encode_failure_record(input_el: Any, error: Exception, transient: bool) -> bytes:
+    """
+    Encodes a failed input as a line of JSON, together with the error that caused the failure.
+
+    `transient` records whether the error is likely to go away when retrying later (see `utils.retry.is_replayable_error`),
+    so that replays can skip permanent failures.
+    """
+    record = {
+        "input": input_el,
+        "error": str(error),
+        "error_type": type(error).__name__,
+        "transient": transient,
+        "failed_at": datetime.now(timezone.utc).isoformat(),
+    }
+    # inputs that aren't JSON-serializable are stored as strings, so the record itself is never lost
+    return (json.dumps(record, default=str) + "\n").encode("utf-8")
+
+
+def parse_failure_record(line: str) -> dict:
+    """
+    Parses a line of a failures file, returning a dict with (at least) the key "input".
+
+    Also handles the legacy format, where dict and list inputs were written as JSON as they were
+    and anything else as the repr of `{"input": str(input)}` (no error details are available for those).
+    """
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return ast.literal_eval(line)
+    if isinstance(record, dict) and "error_type" in record:
+        return record
+    return {"input": record}
+
+
+def iter_failure_records(
+    bucket: S3Bucket, failures_s3_prefix: str
+) -> Iterator[tuple[str, dict]]:
+    """
+    Streams the records of all failure files stored under `failures_s3_prefix`, yielding (S3 key, record) tuples.
+
+    Files are downloaded (and decompressed) one at a time, so memory usage doesn't depend on the size of the files.
+    """
+    prefix = failures_s3_prefix.rstrip("/") + "/"
+    keys = sorted(
+        obj["Key"]
+        for obj in bucket.list_objects(prefix)
+        # listing is by prefix, so it may include "sibling" prefixes (e.g. "<prefix>-replayed/...")
+        if obj["Key"].startswith(prefix)
+    )
+    print(f"Found {len(keys)} failure files under {prefix}")
+    for key in keys:
+        with tempfile.TemporaryFile() as f:
+            bucket.download_object_to_file_object(key, f)
+            f.seek(0)
+            reader = open_stream_reader(f)
+            for line in io.TextIOWrapper(reader, encoding="utf-8"):
+                if line.strip():
+                    yield key, parse_failure_record(line)
+
+
+class FailedInputSource:
+    """
+    Streams the inputs of all failure files stored under `failures_s3_prefix` (see `iter_failure_records`), e.g. for replaying them
+    (implements `utils.input_sources.InputSource`).
+
+    After an iteration, `completed_keys` holds the keys of the files whose inputs have all been yielded
+    (or skipped), so callers know which files can be archived once the inputs have been processed.
+    """
+
+    def __init__(
+        self, bucket: S3Bucket, failures_s3_prefix: str, only_transient: bool = True
+    ):
+        self.bucket = bucket
+        self.failures_s3_prefix = failures_s3_prefix
+        self.only_transient = only_transient
+        self.completed_keys: list[str] = []
+        self.skipped = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        self.completed_keys = []
+        self.skipped = 0
+        current_key = None
+        for key, record in iter_failure_records(self.bucket, self.failures_s3_prefix):
+            if key != current_key:
+                # all records of the previous file have been yielded
+                if current_key is not None:
+                    self.completed_keys.append(current_key)
+                current_key = key
+            if self.only_transient and not _is_replayable_record(record):
+                self.skipped += 1
+                continue
+            yield record["input"]
+        if current_key is not None:
+            self.completed_keys.append(current_key)
+
+    def __repr__(self) -> str:
+        return f"FailedInputSource({self.failures_s3_prefix!r})"
+
+
+def _is_replayable_record(record: dict) -> bool:
+    # records written before quota exhaustion was considered replayable are marked as permanent failures
+    return (
+        record.get("transient") is not False
+        or record.get("error_type") == "QuotaExhaustedError"
+    )
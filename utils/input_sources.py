@@ -0,0 +1,153 @@
+import json
+from typing import Any, BinaryIO, Iterator, Literal, Protocol
+from prefect_aws import S3Bucket
+
+from utils.bootstrap import load_block
+from utils.databases.clickhouse import ClickHouseCredentials, create_client
+from utils.zstd import open_stream_reader
+
+type LineFormat = Literal["jsonl", "lines"]
+"""
+"jsonl" parses every line as JSON, "lines" yields every line as a string (e.g. for plain lists of IDs).
+"""
+
+_READ_SIZE = 1024**2
+
+
+class InputSource[T](Protocol):
+    """
+    A source that inputs for `process_and_upload_data` are pulled from lazily (in batches), instead of materializing them in a list.
+
+    Sources only hold the information needed to fetch the inputs (not the inputs themselves), so they are cheap to pass to Prefect tasks.
+    Every iteration starts from the beginning, so a source can be consumed again by a retried run.
+    """
+
+    def __iter__(self) -> Iterator[T]:
+        """
+        Yields all inputs of the source (from the beginning).
+        """
+        ...
+
+
+def _iter_lines(reader: BinaryIO, line_format: LineFormat) -> Iterator[Any]:
+    pending = b""
+    while chunk := reader.read(_READ_SIZE):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield from _parse_line(line, line_format)
+    yield from _parse_line(pending, line_format)
+
+
+def _parse_line(line: bytes, line_format: LineFormat) -> Iterator[Any]:
+    line = line.strip()
+    if not line:
+        return
+    if line_format == "jsonl":
+        yield json.loads(line)
+    else:
+        yield line.decode("utf-8")
+
+
+def _open_reader(file_obj: BinaryIO, compressed: bool) -> BinaryIO:
+    if compressed:
+        return open_stream_reader(file_obj)  # type: ignore
+    return file_obj
+
+
+class LocalFileSource:
+    """
+    Reads inputs from a local file with one input per line (zstd-compressed if the name ends with `.zst`).
+    """
+
+    def __init__(self, file_path: str, line_format: LineFormat = "jsonl"):
+        self.file_path = file_path
+        self.line_format = line_format
+
+    def __iter__(self) -> Iterator[Any]:
+        with open(self.file_path, "rb") as f:
+            reader = _open_reader(f, compressed=self.file_path.endswith(".zst"))
+            yield from _iter_lines(reader, self.line_format)
+
+    def __repr__(self) -> str:
+        return f"LocalFileSource({self.file_path!r})"
+
+
+class S3JsonlSource:
+    """
+    Streams inputs from all files under an S3 prefix (in lexicographic order of their keys), with one input per line.
+    Files with names ending in `.zst` are decompressed on the fly. Files are never downloaded to disk as a whole.
+    """
+
+    def __init__(
+        self,
+        s3_prefix: str,
+        line_format: LineFormat = "jsonl",
+        bucket_block: str = "s3-bucket",
+    ):
+        self.s3_prefix = s3_prefix
+        self.line_format = line_format
+        self.bucket_block = bucket_block
+
+    def __iter__(self) -> Iterator[Any]:
+        bucket = load_block(S3Bucket, self.bucket_block)
+        client = bucket.credentials.get_s3_client()
+        prefix = self.s3_prefix.rstrip("/") + "/"
+        keys = sorted(
+            obj["Key"]
+            for obj in bucket.list_objects(prefix)
+            # listing is by prefix, so it may include "sibling" prefixes (e.g. "<prefix>-replayed/...")
+            if obj["Key"].startswith(prefix)
+        )
+        print(f"Streaming inputs from {len(keys)} files under {prefix}")
+        for key in keys:
+            body = client.get_object(Bucket=bucket.bucket_name, Key=key)["Body"]
+            try:
+                reader = _open_reader(body, compressed=key.endswith(".zst"))
+                yield from _iter_lines(reader, self.line_format)
+            finally:
+                body.close()
+
+    def __repr__(self) -> str:
+        return f"S3JsonlSource({self.s3_prefix!r})"
+
+
+class ClickHouseQuerySource:
+    """
+    Streams the rows of a ClickHouse query, fetching `batch_size` rows at a time (while earlier ones are processed).
+
+    Rows of single-column results are yielded as plain values (e.g. IDs), others as dicts keyed by column name.
+    """
+
+    def __init__(
+        self,
+        query: str,
+        parameters: dict[str, Any] | None = None,
+        credentials_block: str = "clickhouse-etl-config",
+        batch_size: int = 10_000,
+    ):
+        self.query = query
+        self.parameters = parameters
+        self.credentials_block = credentials_block
+        self.batch_size = batch_size
+
+    def __iter__(self) -> Iterator[Any]:
+        client = create_client(ClickHouseCredentials.load(self.credentials_block))
+        try:
+            with client.query_row_block_stream(
+                self.query,
+                parameters=self.parameters,
+                settings={"max_block_size": self.batch_size},
+            ) as stream:
+                column_names = stream.source.column_names
+                for block in stream:
+                    for row in block:
+                        if len(column_names) == 1:
+                            yield row[0]
+                        else:
+                            yield dict(zip(column_names, row))
+        finally:
+            client.close()
+
+    def __repr__(self) -> str:
+        return f"ClickHouseQuerySource({self.query!r})"
@@ -0,0 +1,230 @@
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable
+from uuid import UUID
+from prefect.artifacts import create_progress_artifact, update_progress_artifact
+from prefect.context import FlowRunContext, TaskRunContext
+
+from utils.execution import wrap_sync_or_async
+
+
+class LatencyHistogram:
+    """
+    A histogram of latencies with logarithmically sized buckets, so percentiles are accurate to `relative_precision`
+    (regardless of whether latencies are in the range of milliseconds or minutes) with constant memory usage.
+    """
+
+    def __init__(self, relative_precision: float = 0.02, min_latency: float = 1e-6):
+        self._base = 1 + relative_precision
+        self._min_latency = min_latency
+        self._buckets: Counter[int] = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, latency: float):
+        bucket = math.ceil(
+            math.log(max(latency, self._min_latency) / self._min_latency, self._base)
+        )
+        self._buckets[bucket] += 1
+        self.count += 1
+        self.total += latency
+        self.min = min(self.min, latency)
+        self.max = max(self.max, latency)
+
+    def percentile(self, p: float) -> float | None:
+        """
+        Returns the (upper bound of the bucket of the) latency below which `p` percent of the recorded latencies fall.
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(self.max, self._min_latency * self._base**bucket)
+        return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "p99.9": self.percentile(99.9),
+            "max": self.max,
+        }
+
+
+class RunMetrics:
+    """
+    Collects metrics about the processing of inputs in a scraping run: per-input latency, bytes produced,
+    errors by exception type and throughput over time, plus arbitrary counters (e.g. cache hits).
+
+    Latencies are recorded by the wrapper returned by `timed` (from whichever thread runs the processing function),
+    everything else by the code writing the results. All methods are thread-safe.
+    """
+
+    def __init__(self, timeline_interval_seconds: float = 60.0):
+        self.started_at = datetime.now(timezone.utc)
+        self.timeline_interval_seconds = timeline_interval_seconds
+        self.latency = LatencyHistogram()
+        self.outcomes: Counter[str] = Counter()
+        self.errors_by_type: Counter[str] = Counter()
+        self.counters: Counter[str] = Counter()
+        self.bytes_out = 0
+        self._timeline: Counter[int] = Counter()
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def timed[T](self, processing_fn: Callable[[T], Any]) -> Callable[[T], Any]:
+        """
+        Wraps a (sync or async) processing function so that the latency of each call is recorded.
+        """
+
+        async def async_wrapper(input_el: T):
+            start = time.perf_counter()
+            try:
+                return await processing_fn(input_el)
+            finally:
+                self.record_latency(time.perf_counter() - start)
+
+        def wrapper(input_el: T):
+            start = time.perf_counter()
+            try:
+                return processing_fn(input_el)
+            finally:
+                self.record_latency(time.perf_counter() - start)
+
+        return wrap_sync_or_async(processing_fn, wrapper, async_wrapper)
+
+    def record_latency(self, latency: float):
+        with self._lock:
+            self.latency.record(latency)
+
+    def record_result(
+        self,
+        outcome: str,
+        bytes_out: int = 0,
+        error: BaseException | None = None,
+    ):
+        """
+        Records the outcome of processing an input (e.g. "succeeded", "empty" or "failed").
+        """
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.bytes_out += bytes_out
+            if error is not None:
+                self.errors_by_type[type(error).__name__] += 1
+            interval = int(
+                (time.monotonic() - self._start) // self.timeline_interval_seconds
+            )
+            self._timeline[interval] += 1
+
+    def outcomes_so_far(self) -> tuple[dict[str, int], float]:
+        """
+        Returns the number of inputs per outcome and the time elapsed since metrics collection started.
+        """
+        with self._lock:
+            return dict(self.outcomes), time.monotonic() - self._start
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def summary(self) -> dict:
+        """
+        Returns a JSON-serializable summary of all metrics collected so far.
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._start
+            items = sum(self.outcomes.values())
+            failed = self.outcomes.get("failed", 0)
+            last_interval = int(elapsed // self.timeline_interval_seconds)
+            return {
+                "started_at": self.started_at.isoformat(),
+                "ended_at": datetime.now(timezone.utc).isoformat(),
+                "elapsed_seconds": elapsed,
+                "items": items,
+                "items_per_second": items / elapsed if elapsed else None,
+                "outcomes": dict(self.outcomes),
+                "error_rate": failed / items if items else None,
+                "errors_by_type": dict(self.errors_by_type),
+                "bytes_out": self.bytes_out,
+                "latency_seconds": self.latency.summary(),
+                "throughput_timeline": [
+                    {
+                        "offset_seconds": i * self.timeline_interval_seconds,
+                        "items": self._timeline.get(i, 0),
+                        "items_per_second": self._timeline.get(i, 0)
+                        / self.timeline_interval_seconds,
+                    }
+                    for i in range(last_interval + 1)
+                ],
+                "counters": dict(self.counters),
+            }
+
+
+class ProgressReporter:
+    """
+    Periodically prints aggregated progress (and updates a Prefect progress artifact, if the total number of inputs is known).
+    """
+
+    def __init__(
+        self,
+        metrics: RunMetrics,
+        total: int | None = None,
+        interval_seconds: float = 30.0,
+    ):
+        self.metrics = metrics
+        self.total = total
+        self.interval_seconds = interval_seconds
+        self._last_report = time.monotonic()
+        self._artifact_id: UUID | None = None
+        self._artifact_failed = False
+
+    def maybe_report(self):
+        """
+        Reports progress if `interval_seconds` have passed since the last report. Cheap enough to be called after every item.
+        """
+        if time.monotonic() - self._last_report >= self.interval_seconds:
+            self.report()
+
+    def report(self):
+        self._last_report = time.monotonic()
+        outcomes, elapsed = self.metrics.outcomes_so_far()
+        processed = sum(outcomes.values())
+        rate = processed / elapsed if elapsed else 0.0
+        if self.total:
+            progress = (
+                f"{processed}/{self.total} inputs ({100 * processed / self.total:.1f}%)"
+            )
+        else:
+            progress = f"{processed} inputs"
+        print(f"Progress: {progress}, {outcomes}, {rate:.1f} inputs/s")
+        if self.total:
+            self._update_artifact(100 * processed / self.total)
+
+    def _update_artifact(self, percent: float):
+        if self._artifact_failed or not (FlowRunContext.get() or TaskRunContext.get()):
+            return
+        try:
+            if self._artifact_id is None:
+                self._artifact_id = create_progress_artifact(
+                    percent, description="Processed inputs"
+                )
+            else:
+                update_progress_artifact(self._artifact_id, percent)
+        except Exception as e:
+            # e.g. when running outside of a flow run, progress is still printed
+            print(f"Could not report progress to Prefect: {e}")
+            self._artifact_failed = True
@@ -0,0 +1,185 @@
+import json
+import os
+import time
+from typing import Callable, Iterable
+import zstandard as zstd
+from pydantic import BaseModel
+
+
+class DurabilityConfig(BaseModel):
+    """
+    Controls how often buffered writes are committed to disk by a `GroupCommitWriter`.
+
+    A commit happens as soon as either limit is reached, so a crash loses at most the items processed since the last commit.
+    """
+
+    max_items: int = 1000
+    """
+    Maximum number of processed items (i.e. inputs, regardless of how many records each of them produced) per commit.
+    """
+
+    max_interval_ms: int = 1000
+    """
+    Maximum time (in milliseconds) between two commits. Checked whenever an item is processed.
+    """
+
+    fsync: bool = False
+    """
+    Whether to fsync files on every commit. Without it, committed data survives crashes of the process, but not of the machine.
+    """
+
+
+def truncate_to_last_commit(data_dir: str, file_names: list[str]):
+    """
+    Truncates the given files in a directory written by a `GroupCommitWriter` to their sizes at the last commit.
+    Does nothing if the directory contains no commit state.
+    """
+    commit_state_fp = os.path.join(data_dir, GroupCommitWriter.COMMIT_STATE_FILE)
+    if not os.path.exists(commit_state_fp):
+        return
+    with open(commit_state_fp, "r") as f:
+        committed_sizes: dict[str, int] = json.load(f)["file_sizes"]
+    for name in file_names:
+        fp = os.path.join(data_dir, name)
+        committed_size = committed_sizes.get(name, 0)
+        if os.path.exists(fp) and os.path.getsize(fp) > committed_size:
+            print(
+                f"Discarding {os.path.getsize(fp) - committed_size} uncommitted bytes from {fp}"
+            )
+            os.truncate(fp, committed_size)
+
+
+class GroupCommitWriter:
+    """
+    Appends to a fixed set of files in a directory, committing buffered data for all of them together.
+
+    Writes are buffered in memory and written with a single `write()` per file on commit. Files listed in `compressed_files`
+    are compressed on the fly: the data buffered for each commit is written as one self-contained zstd frame, so the
+    file is always a valid (multi-frame) .zst file up to the last commit. Files listed in `dictionaries` are compressed with the
+    given zstd dictionary (whose ID is recorded in every frame). After the data files have been
+    flushed, their sizes are recorded in a commit state file (replaced atomically). When a writer is opened on a directory
+    that already contains files (e.g. after a crash), everything beyond the last committed sizes is truncated, so the files
+    never disagree with each other (e.g. outputs are never missing for inputs that are already marked as processed).
+
+    `state` can hold arbitrary JSON-serializable data that is persisted with every commit (and restored when the writer is reopened).
+    Callbacks in `on_commit` are called after every commit (e.g. for acknowledging items that are now durable).
+    """
+
+    COMMIT_STATE_FILE = "commit_state.json"
+
+    def __init__(
+        self,
+        data_dir: str,
+        file_names: list[str],
+        config: DurabilityConfig | None = None,
+        compressed_files: Iterable[str] = (),
+        compression_level: int = 3,
+        dictionaries: dict[str, zstd.ZstdCompressionDict | None] | None = None,
+    ):
+        self.data_dir = data_dir
+        self.config = config or DurabilityConfig()
+        dictionaries = dictionaries or {}
+        # NOTE: frames appended to a file that already contains data must use the dictionary the file was started with
+        self._cctxs = {
+            name: zstd.ZstdCompressor(
+                level=compression_level, dict_data=dictionaries.get(name)
+            )
+            for name in compressed_files
+        }
+
+        self._commit_state_fp = os.path.join(data_dir, self.COMMIT_STATE_FILE)
+        truncate_to_last_commit(data_dir, file_names)
+        self.state: dict = {}
+        if os.path.exists(self._commit_state_fp):
+            with open(self._commit_state_fp, "r") as f:
+                self.state = json.load(f)["state"]
+        self._files = {
+            name: open(self.path(name), "ab", buffering=0) for name in file_names
+        }
+        self._buffers = {name: bytearray() for name in file_names}
+        self._items_since_commit = 0
+        self._last_commit = time.monotonic()
+        self.on_commit: list[Callable[[], None]] = []
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.data_dir, file_name)
+
+    def committed_size(self, file_name: str) -> int:
+        """
+        Returns the size of the given file as of the last commit.
+        """
+        return self._files[file_name].tell()
+
+    def write(self, file_name: str, data: bytes):
+        """
+        Buffers `data` to be appended to the given file on the next commit.
+        """
+        self._buffers[file_name] += data
+
+    def end_item(self) -> bool:
+        """
+        Marks the end of all writes related to one item and commits if the durability window has been exceeded.
+        Returns True if a commit happened.
+        """
+        self._items_since_commit += 1
+        return self.commit_if_due()
+
+    def commit_if_due(self) -> bool:
+        if self._items_since_commit >= self.config.max_items or (
+            self._items_since_commit > 0
+            and (time.monotonic() - self._last_commit) * 1000
+            >= self.config.max_interval_ms
+        ):
+            self.commit()
+            return True
+        return False
+
+    def commit(self):
+        """
+        Writes all buffered data to the files and records their new sizes in the commit state file.
+        """
+        for name, buffer in self._buffers.items():
+            if buffer:
+                if name in self._cctxs:
+                    self._files[name].write(self._cctxs[name].compress(buffer))
+                else:
+                    self._files[name].write(buffer)
+                buffer.clear()
+            if self.config.fsync:
+                os.fsync(self._files[name].fileno())
+        self._write_commit_state()
+        self._items_since_commit = 0
+        self._last_commit = time.monotonic()
+        for callback in self.on_commit:
+            callback()
+
+    def rotate(self, file_name: str, target_path: str):
+        """
+        Commits, moves the given file to `target_path` and continues writing to a new, empty file.
+        """
+        self.commit()
+        self._files[file_name].close()
+        os.replace(self.path(file_name), target_path)
+        self._files[file_name] = open(self.path(file_name), "ab", buffering=0)
+        self._write_commit_state()
+
+    def close(self):
+        self.commit()
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_commit_state(self):
+        file_sizes = {name: f.tell() for name, f in self._files.items()}
+        tmp_fp = self._commit_state_fp + ".tmp"
+        with open(tmp_fp, "w") as f:
+            json.dump({"file_sizes": file_sizes, "state": self.state}, f)
+            if self.config.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_fp, self._commit_state_fp)
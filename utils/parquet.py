@@ -0,0 +1,74 @@
+import os
+from typing import Any, Literal
+import polars as pl
+from pydantic import BaseModel
+
+from utils.zstd import decompress_file
+
+
+class ParquetConfig(BaseModel):
+    """
+    Controls the conversion of JSONL output chunks to Parquet before they are uploaded.
+
+    Without a declared `record_schema`, it is inferred from all records of a chunk, so chunks may end up with different schemas
+    (e.g. if a field is null in all records of one chunk). Declaring the schema is recommended for data that is read
+    across many files (e.g. with ClickHouse's `s3()` table function).
+    """
+
+    record_schema: dict[str, Any] | None = None
+    """
+    Polars schema of the records (e.g. `{"uuid": pl.String, "observed_at": pl.String}`). Fields not included are dropped.
+    """
+
+    schema_overrides: dict[str, Any] | None = None
+    """
+    Polars data types of some fields, overriding the inferred ones (the types of other fields are still inferred).
+    """
+
+    compression: Literal["zstd", "snappy", "lz4", "gzip", "uncompressed"] = "zstd"
+    compression_level: int | None = None
+    row_group_size: int | None = None
+
+
+class ParquetConverter:
+    """
+    Converts zstd-compressed JSONL files (as written by the scraping utils) to Parquet.
+    """
+
+    file_extension = ".parquet"
+
+    def __init__(self, config: ParquetConfig | None = None):
+        self.config = config or ParquetConfig()
+
+    def s3_file_name(self, file_name: str) -> str:
+        """
+        Returns the name of a converted file, given the name of the original one.
+        """
+        return (
+            file_name.removesuffix(".zst").removesuffix(".jsonl") + self.file_extension
+        )
+
+    def convert(self, file_path: str) -> str:
+        """
+        Converts a file, returning the path of the Parquet file (next to the original one, with a leading dot).
+        """
+        directory, file_name = os.path.split(file_path)
+        jsonl_path = os.path.join(directory, f".{file_name}.jsonl")
+        parquet_path = os.path.join(directory, f".{self.s3_file_name(file_name)}")
+        decompress_file(file_path, jsonl_path)
+        try:
+            # streaming, so memory usage is bounded by the size of a batch of records rather than the size of the file
+            pl.scan_ndjson(
+                jsonl_path,
+                schema=self.config.record_schema,
+                schema_overrides=self.config.schema_overrides,
+                infer_schema_length=None,
+            ).sink_parquet(
+                parquet_path,
+                compression=self.config.compression,
+                compression_level=self.config.compression_level,
+                row_group_size=self.config.row_group_size,
+            )
+        finally:
+            os.remove(jsonl_path)
+        return parquet_path
@@ -1,3 +1,8 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 
 
@@ -35,33 +40,82 @@ def get_public_ip_from_icanhazip() -> str:
     return response.text.strip()
 
 
-def get_public_ip() -> str:
-    """
-    Gets the public IP address of the host machine. Tries multiple services until one works.
-    """
-    try:
-        return get_public_ip_from_ifconfig()
-    except Exception:
-        pass
+PUBLIC_IP_CACHE_PATH = os.environ.get("PUBLIC_IP_CACHE_PATH", "./tmp/public_ip.json")
+"""
+Location of the file caching the public IP address across processes (e.g. flow runs executed one after another on the same host).
+"""
 
-    try:
-        return get_public_ip_from_icanhazip()
-    except Exception:
-        pass
+PUBLIC_IP_CACHE_TTL_SECONDS = 60 * 60
 
-    try:
-        return get_public_ip_from_ipinfo()
-    except Exception:
-        pass
+_PUBLIC_IP_SERVICES = [
+    get_public_ip_from_ifconfig,
+    get_public_ip_from_icanhazip,
+    get_public_ip_from_ipinfo,
+    get_public_ip_from_ipify,
+]
 
+_cached_public_ip: str | None = None
+_lock = threading.Lock()
+
+
+def _read_cached_public_ip(max_age_seconds: float) -> str | None:
     try:
-        return get_public_ip_from_ipify()
-    except Exception:
-        pass
+        with open(PUBLIC_IP_CACHE_PATH) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get("resolved_at", 0) > max_age_seconds:
+        return None
+    return cached.get("ip")
 
+
+def _write_cached_public_ip(ip: str):
+    try:
+        if os.path.dirname(PUBLIC_IP_CACHE_PATH):
+            os.makedirs(os.path.dirname(PUBLIC_IP_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{PUBLIC_IP_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"ip": ip, "resolved_at": time.time()}, f)
+        os.replace(tmp_path, PUBLIC_IP_CACHE_PATH)
+    except OSError as e:
+        # the cache is only an optimization
+        print(f"Could not cache public IP address: {e}")
+
+
+def _race_public_ip_services() -> str:
+    """
+    Queries all services at the same time, returning the first IP address received.
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=len(_PUBLIC_IP_SERVICES), thread_name_prefix="public-ip"
+    )
+    futures = [executor.submit(service) for service in _PUBLIC_IP_SERVICES]
+    try:
+        for future in as_completed(futures):
+            if future.exception() is None:
+                return future.result()
+    finally:
+        # don't wait for slower services
+        executor.shutdown(wait=False, cancel_futures=True)
     raise Exception("Could not get public IP address from any service.")
 
 
+def get_public_ip(max_age_seconds: float = PUBLIC_IP_CACHE_TTL_SECONDS) -> str:
+    """
+    Gets the public IP address of the host machine. Queries multiple services concurrently and uses the first response.
+
+    The result is cached for the lifetime of the process and on disk (see `PUBLIC_IP_CACHE_PATH`) for `max_age_seconds`.
+    """
+    global _cached_public_ip
+    with _lock:
+        if _cached_public_ip is None:
+            _cached_public_ip = _read_cached_public_ip(max_age_seconds)
+            if _cached_public_ip is None:
+                _cached_public_ip = _race_public_ip_services()
+                _write_cached_public_ip(_cached_public_ip)
+        return _cached_public_ip
+
+
 if __name__ == "__main__":
     ips = [
         ("ifconfig", get_public_ip_from_ifconfig()),
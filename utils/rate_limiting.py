@@ -0,0 +1,215 @@
+import functools
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Callable
+
+from utils.sqlite import ThreadLocalConnections
+
+RATE_LIMITER_DB_PATH = os.environ.get(
+    "RATE_LIMITER_DB_PATH", "./tmp/rate_limits.sqlite3"
+)
+"""
+Default location of the SQLite database holding the state of shared rate limiters.
+Flow runs in different containers only share limits if this path points to the same (mounted) host directory for all of them.
+"""
+
+
+class QuotaExhaustedError(Exception):
+    """
+    Raised when acquiring a token from a rate limiter whose API quota is (almost) used up.
+    """
+
+
+def get_http_status(e: BaseException) -> int | None:
+    """
+    Tries to extract the HTTP status code from an exception raised by an API client.
+
+    Checks common attributes (`status`, `status_code`, `response.status_code`) before falling back to parsing
+    the message (e.g. the SoundCharts client raises `RuntimeError("429 Error: ...")` or `RuntimeError("HTTP 500: ...")`).
+    """
+    for candidate in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "status"):
+            status = getattr(candidate, attr, None)
+            if isinstance(status, int):
+                return status
+    match = re.match(r"^(?:HTTP )?(\d{3})\b", str(e))
+    return int(match.group(1)) if match else None
+
+
+class SharedTokenBucket:
+    """
+    A token bucket rate limiter whose state lives in a SQLite database, so that it is shared by all processes
+    (and threads) using the same `key` and database file - e.g. all flow runs using the same API credentials.
+
+    The rate adapts to the API's responses: it is halved whenever the API reports throttling (HTTP 429), after which
+    calls are blocked for `retry_after` seconds, and then recovers linearly to `max_rate` over `recovery_seconds`.
+    If the API reports its remaining quota, acquiring fails with a `QuotaExhaustedError` once it drops to `quota_reserve`.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        max_rate: float,
+        burst: float | None = None,
+        min_rate: float | None = None,
+        recovery_seconds: float = 60.0,
+        quota_reserve: int = 0,
+        quota_ttl_seconds: float = 3600.0,
+        db_path: str = RATE_LIMITER_DB_PATH,
+    ):
+        """
+        Args:
+            key: Identifies the shared limit (e.g. the API and credentials it applies to).
+            max_rate: Maximum number of calls per second (across all processes).
+            burst: Maximum number of tokens that can be accumulated (defaults to `max_rate`, i.e. one second worth of calls).
+            min_rate: Lower bound for the rate when backing off after throttling (defaults to 1/10 of `max_rate`).
+            recovery_seconds: Time it takes for the rate to recover from `min_rate` to `max_rate`.
+            quota_reserve: Number of calls of the API's quota that should never be used.
+            quota_ttl_seconds: Time after which a reported quota is ignored (so that calls resume once the quota has been reset).
+            db_path: Path of the SQLite database holding the shared state.
+        """
+        self.key = key
+        self.max_rate = max_rate
+        self.burst = burst or max_rate
+        self.min_rate = min_rate or max_rate / 10
+        self.recovery_seconds = recovery_seconds
+        self.quota_reserve = quota_reserve
+        self.quota_ttl_seconds = quota_ttl_seconds
+        self.db_path = db_path
+        self._connections = ThreadLocalConnections(db_path)
+        with self._connections.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    rate REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL,
+                    quota_remaining INTEGER,
+                    quota_reported_at REAL
+                )
+                """)
+            conn.execute(
+                "INSERT OR IGNORE INTO token_buckets VALUES (?, ?, ?, ?, 0, NULL, NULL)",
+                (key, self.burst, max_rate, time.time()),
+            )
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Blocks until `tokens` tokens are available and consumes them.
+        """
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+
+    def report_throttled(self, retry_after: float | None = None):
+        """
+        Backs off after the API responded with HTTP 429 (or similar).
+        """
+        with self._connections.transaction() as conn:
+            now = time.time()
+            _, rate, blocked_until, _ = self._load(conn, now)
+            rate = max(self.min_rate, rate / 2)
+            blocked_until = max(
+                blocked_until, now + (retry_after if retry_after else 1 / rate)
+            )
+            self._save(conn, now, 0.0, rate, blocked_until)
+        print(
+            f"Rate limiter {self.key}: throttled by API, reduced rate to {rate:.2f} calls/s"
+        )
+
+    def report_quota_remaining(self, quota_remaining: int):
+        with self._connections.transaction() as conn:
+            conn.execute(
+                "UPDATE token_buckets SET quota_remaining = ?, quota_reported_at = ? WHERE key = ?",
+                (quota_remaining, time.time(), self.key),
+            )
+
+    def _try_acquire(self, tokens: float) -> float:
+        """
+        Consumes `tokens` if available and returns 0, otherwise returns the time to wait before trying again.
+        """
+        with self._connections.transaction() as conn:
+            now = time.time()
+            available, rate, blocked_until, quota_remaining = self._load(conn, now)
+            if quota_remaining is not None and quota_remaining <= self.quota_reserve:
+                raise QuotaExhaustedError(
+                    f"API quota for {self.key} exhausted ({quota_remaining} calls remaining, reserve: {self.quota_reserve})"
+                )
+            if blocked_until > now:
+                wait = blocked_until - now
+            elif available >= tokens:
+                available -= tokens
+                wait = 0.0
+            else:
+                wait = (tokens - available) / rate
+            self._save(conn, now, available, rate, blocked_until)
+        return wait
+
+    def _load(
+        self, conn: sqlite3.Connection, now: float
+    ) -> tuple[float, float, float, int | None]:
+        tokens, rate, updated_at, blocked_until, quota_remaining, quota_reported_at = (
+            conn.execute(
+                "SELECT tokens, rate, updated_at, blocked_until, quota_remaining, quota_reported_at FROM token_buckets WHERE key = ?",
+                (self.key,),
+            ).fetchone()
+        )
+        if (
+            quota_reported_at is not None
+            and now - quota_reported_at > self.quota_ttl_seconds
+        ):
+            quota_remaining = None
+        elapsed = max(0.0, now - updated_at)
+        rate = min(
+            self.max_rate,
+            rate + (self.max_rate - self.min_rate) * elapsed / self.recovery_seconds,
+        )
+        tokens = min(self.burst, tokens + elapsed * rate)
+        return tokens, rate, blocked_until, quota_remaining
+
+    def _save(
+        self,
+        conn: sqlite3.Connection,
+        now: float,
+        tokens: float,
+        rate: float,
+        blocked_until: float,
+    ):
+        conn.execute(
+            "UPDATE token_buckets SET tokens = ?, rate = ?, updated_at = ?, blocked_until = ? WHERE key = ?",
+            (tokens, rate, now, blocked_until, self.key),
+        )
+
+
+def rate_limited(
+    limiter: SharedTokenBucket,
+    get_quota_remaining: Callable[[Any], int | None] | None = None,
+):
+    """
+    Decorator acquiring a token from `limiter` before every call of the decorated function.
+
+    Exceptions with HTTP status 429 are reported to the limiter (and re-raised).
+    If `get_quota_remaining` is provided, it is called with each result to report the API's remaining quota.
+    """
+
+    def decorator[**P, R](fn: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(fn)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            limiter.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if get_http_status(e) == 429:
+                    limiter.report_throttled()
+                raise
+            if get_quota_remaining is not None:
+                quota_remaining = get_quota_remaining(result)
+                if quota_remaining is not None:
+                    limiter.report_quota_remaining(quota_remaining)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable
+import zstandard as zstd
+
+from utils.checkpoint_index import canonical_input_key
+from utils.execution import wrap_sync_or_async
+from utils.metrics import RunMetrics
+from utils.sqlite import ThreadLocalConnections
+
+RESPONSE_CACHE_DB_PATH = os.environ.get(
+    "RESPONSE_CACHE_DB_PATH", "./tmp/response_cache.sqlite3"
+)
+"""
+Default location of the SQLite database holding cached responses.
+Flow runs in different containers only share cached responses if this path points to the same (mounted) host directory for all of them.
+"""
+
+_EVICTION_CHECK_INTERVAL = 100
+"""
+Number of writes between checks of the cache's total size.
+"""
+
+
+class ResponseCache:
+    """
+    Caches results of a processing function (e.g. API responses) on disk, keyed by the hash of `namespace` and the input.
+
+    Entries expire after `ttl_seconds`. All caches using the same database share `max_bytes`: once their entries (compressed)
+    exceed it, the least recently used ones are evicted. Results must be JSON-serializable, errors are never cached.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl_seconds: float,
+        max_bytes: int = 10 * 1024**3,
+        db_path: str = RESPONSE_CACHE_DB_PATH,
+        compression_level: int = 3,
+    ):
+        """
+        Args:
+            namespace: Identifies what is cached (e.g. an API endpoint and any parameters not included in the inputs).
+            ttl_seconds: Time after which cached results are considered stale.
+            max_bytes: Maximum total size of all entries in the database.
+            db_path: Path of the SQLite database holding cached results.
+        """
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._connections = ThreadLocalConnections(db_path)
+        self._compression_level = compression_level
+        self._writes = 0
+        with self._connections.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key BLOB PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_by_access ON responses (accessed_at)"
+            )
+
+    def key(self, input_el: Any) -> bytes:
+        return hashlib.blake2b(
+            f"{self.namespace}\n{canonical_input_key(input_el)}".encode("utf-8"),
+            digest_size=16,
+        ).digest()
+
+    def get(self, input_el: Any) -> tuple[bool, Any]:
+        """
+        Returns (True, result) if a fresh result for `input_el` is cached, (False, None) otherwise.
+        """
+        key = self.key(input_el)
+        now = time.time()
+        conn = self._connections.get()
+        row = conn.execute(
+            "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl_seconds:
+            return False, None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        # zstd contexts aren't thread-safe, so one is created per call (which is cheap)
+        return True, json.loads(zstd.ZstdDecompressor().decompress(row[0]))
+
+    def put(self, input_el: Any, result: Any):
+        value = zstd.ZstdCompressor(level=self._compression_level).compress(
+            json.dumps(result, separators=(",", ":")).encode("utf-8")
+        )
+        now = time.time()
+        with self._connections.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(input_el), self.namespace, value, len(value), now, now),
+            )
+        self._writes += 1
+        if self._writes % _EVICTION_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes expired entries of this cache, then the least recently used entries (of all caches) until the total size is below `max_bytes`.
+        """
+        with self._connections.transaction() as conn:
+            conn.execute(
+                "DELETE FROM responses WHERE namespace = ? AND created_at < ?",
+                (self.namespace, time.time() - self.ttl_seconds),
+            )
+            total_bytes = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total_bytes <= self.max_bytes:
+                return
+            # evict down to 90% of the limit, so that eviction doesn't happen again right after the next few writes
+            excess = total_bytes - int(0.9 * self.max_bytes)
+            evicted_bytes = 0
+            evicted_keys = []
+            for key, size in conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at"
+            ):
+                evicted_keys.append((key,))
+                evicted_bytes += size
+                if evicted_bytes >= excess:
+                    break
+            conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        print(
+            f"Evicted {len(evicted_keys)} entries ({evicted_bytes} bytes) from the response cache"
+        )
+
+    def cached[T](
+        self, processing_fn: Callable[[T], Any], metrics: RunMetrics | None = None
+    ) -> Callable[[T], Any]:
+        """
+        Wraps a (sync or async) processing function so that its results are served from (and stored in) the cache.
+        Hits and misses are counted in `metrics` (as "cache_hits" and "cache_misses"), if provided.
+        """
+
+        def lookup(input_el: T) -> tuple[bool, Any]:
+            hit, result = self.get(input_el)
+            if metrics is not None:
+                metrics.increment("cache_hits" if hit else "cache_misses")
+            return hit, result
+
+        async def async_wrapper(input_el: T):
+            hit, result = lookup(input_el)
+            if hit:
+                return result
+            result = await processing_fn(input_el)
+            self.put(input_el, result)
+            return result
+
+        def wrapper(input_el: T):
+            hit, result = lookup(input_el)
+            if hit:
+                return result
+            result = processing_fn(input_el)
+            self.put(input_el, result)
+            return result
+
+        return wrap_sync_or_async(processing_fn, wrapper, async_wrapper)
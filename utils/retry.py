@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Iterator
+import aiohttp
+import requests
+from pydantic import BaseModel
+
+from utils.execution import wrap_sync_or_async
+from utils.rate_limiting import QuotaExhaustedError, get_http_status
+
+TRANSIENT_EXCEPTION_TYPES: tuple[type[BaseException], ...] = (
+    TimeoutError,
+    ConnectionError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+)
+"""
+Exception types that indicate transient (network) problems, regardless of their message.
+"""
+
+TRANSIENT_ERROR_MESSAGE_PREFIXES: tuple[str, ...] = (
+    # raised by the SoundCharts client once its own retries of connection errors (chained as the cause)
+    # or of 502/503/504 responses (without any status code in the message) are used up
+    "Maximum retry attempts reached",
+    "Unhandled error or maximum retries exceeded",
+)
+"""
+Messages of (otherwise generic) errors that API clients raise for transient problems.
+"""
+
+
+class RetryConfig(BaseModel):
+    """
+    Controls in-run retries of processing functions, with exponential backoff and full jitter.
+
+    Only transient errors (see `is_transient_error`) are retried, permanent ones fail right away.
+    """
+
+    max_attempts: int = 3
+    """
+    Maximum number of calls per input (including the first one).
+    """
+
+    base_delay_seconds: float = 1.0
+    """
+    Upper bound for the delay before the first retry. Doubles with every further retry.
+    """
+
+    max_delay_seconds: float = 60.0
+
+    retry_on_status: set[int] = {408, 425, 429, 500, 502, 503, 504}
+    """
+    HTTP status codes that are considered transient.
+    """
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns a random delay before retrying after the given (1-based) attempt failed.
+        """
+        return random.uniform(
+            0,
+            min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1)),
+        )
+
+
+def is_transient_error(e: BaseException, config: RetryConfig | None = None) -> bool:
+    """
+    Returns True if an error is likely to go away when retrying (e.g. timeouts, connection errors, HTTP 429 or 5xx).
+
+    Errors that API clients raise from other errors (e.g. `RuntimeError(...) from aiohttp.ClientConnectionError(...)`)
+    are classified by the first error in the chain (of causes or contexts) that has an HTTP status or is known to be transient.
+    """
+    if isinstance(e, QuotaExhaustedError):
+        return False
+    for error in _exception_chain(e):
+        status = get_http_status(error)
+        if status is not None:
+            return status in (config or RetryConfig()).retry_on_status
+        if isinstance(error, TRANSIENT_EXCEPTION_TYPES) or str(error).startswith(
+            TRANSIENT_ERROR_MESSAGE_PREFIXES
+        ):
+            return True
+    return False
+
+
+def _exception_chain(e: BaseException) -> Iterator[BaseException]:
+    seen: set[int] = set()
+    current: BaseException | None = e
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        yield current
+        current = current.__cause__ or (
+            None if current.__suppress_context__ else current.__context__
+        )
+
+
+def is_replayable_error(e: BaseException, config: RetryConfig | None = None) -> bool:
+    """
+    Returns True if an input that failed with an error is worth replaying later: transient errors and exhausted API quotas
+    (which aren't retried within a run, as the quota only recovers after the run, but don't mean the input is invalid).
+    """
+    return isinstance(e, QuotaExhaustedError) or is_transient_error(e, config)
+
+
+def with_retries[T](
+    processing_fn: Callable[[T], Any], config: RetryConfig
+) -> Callable[[T], Any]:
+    """
+    Wraps a (sync or async) processing function so that transient errors are retried according to `config`.
+
+    If all attempts fail, the last error is raised (with a note on the number of attempts).
+    """
+
+    async def async_wrapper(input_el: T):
+        for attempt in range(1, config.max_attempts + 1):
+            try:
+                return await processing_fn(input_el)
+            except Exception as e:
+                if not _should_retry(e, attempt, config):
+                    raise
+            await asyncio.sleep(config.delay(attempt))
+
+    def wrapper(input_el: T):
+        for attempt in range(1, config.max_attempts + 1):
+            try:
+                return processing_fn(input_el)
+            except Exception as e:
+                if not _should_retry(e, attempt, config):
+                    raise
+            time.sleep(config.delay(attempt))
+
+    return wrap_sync_or_async(processing_fn, wrapper, async_wrapper)
+
+
+def _should_retry(e: Exception, attempt: int, config: RetryConfig) -> bool:
+    if not is_transient_error(e, config):
+        return False
+    if attempt >= config.max_attempts:
+        e.add_note(f"Giving up after {attempt} attempts")
+        return False
+    print(f"Transient error (attempt {attempt}/{config.max_attempts}), retrying: {e}")
+    return True
@@ -1,18 +1,83 @@
+import contextlib
+import functools
 import json
 from datetime import datetime, timezone
-from typing import Any, Callable
+from typing import Any, Callable, Iterable
 from prefect import task
+from prefect.cache_policies import NO_CACHE
 from prefect.runtime.flow_run import get_id
 from prefect_aws import S3Bucket
 import os
 import shutil
 from pydantic import BaseModel
-from contextlib import ExitStack
 
-from utils.zstd import compress_file
+from utils.bootstrap import load_block, run_concurrently
+from utils.change_capture import (
+    ChangeCaptureConfig,
+    FingerprintIndex,
+    download_fingerprint_index,
+    encode_fingerprint_entry,
+    fingerprint,
+)
+from utils.circuit_breaker import (
+    CircuitBreaker,
+    CircuitBreakerConfig,
+    CircuitOpenError,
+)
+from utils.chunk_uploads import ChunkingConfig, ChunkUploader, RollingChunks
+from utils.clickhouse_sink import ClickHouseSink, ClickHouseSinkConfig
+from utils.databases.clickhouse import ClickHouseCredentials
+from utils.checkpoint_index import (
+    CheckpointIndex,
+    checkpoint_key,
+    encode_checkpoint_key,
+)
+from utils.date import (
+    PartitionGranularity,
+    dt_to_fs_compatible_str,
+    hive_partition_path,
+)
+from utils.execution import (
+    ConcurrencyMode,
+    ItemExecutionMode,
+    as_plain_callable,
+    iter_results,
+)
+from utils.failures import FailedInputSource, encode_failure_record
+from utils.metrics import ProgressReporter, RunMetrics
+from utils.parquet import ParquetConfig, ParquetConverter
+from utils.output_writer import DurabilityConfig, GroupCommitWriter
+from utils.response_cache import ResponseCache
+from utils.retry import (
+    RetryConfig,
+    is_replayable_error,
+    is_transient_error,
+    with_retries,
+)
+from utils.work_queue import LeaseHeartbeat, WorkQueue
+from utils.telemetry import ResourceSampler, TelemetryConfig
+from utils.tail_latency import TailLatencyConfig, with_tail_latency_limits
+from utils.serialization import (
+    RecordEncoder,
+    RecordEncoderName,
+    TimestampedRecordEncoder,
+)
+from utils.zstd import ZstdDictionaryStore, compress_file, file_dictionary_id
 from utils.public_ip import get_public_ip
 
 DATA_DIR = "./tmp/prefect_task_data"
+PROCESSED_OUTPUTS_FILE = "processed_outputs.jsonl.zst"
+FAILED_INPUTS_FILE = "failed_inputs.jsonl.zst"
+PROCESSED_INPUTS_FILE = "processed_inputs.idx"
+UNCHANGED_INPUTS_FILE = "unchanged_inputs.jsonl.zst"
+FINGERPRINT_INDEX_FILE = "fingerprints.idx"
+"""
+The fingerprint index as downloaded from S3 at the start of a run (only used in CDC mode).
+"""
+FINGERPRINT_UPDATES_FILE = "fingerprint_updates.idx"
+"""
+Fingerprints of results written by the current run (only used in CDC mode), committed together with the results themselves.
+"""
 
 
 class RunMetaConfig(BaseModel):
@@ -31,81 +96,339 @@ class RunMetaConfig(BaseModel):
     The uploaded file will have the format <timestamp-of-run-start>_<public_ip>_<flow_run_id>.jsonl.zst.
     """
 
+    summary_s3_prefix: str | None = None
+    """
+    The prefix under which a summary of the run's metrics (latency percentiles, throughput, errors by type, etc.)
+    is uploaded once all inputs have been processed. Defaults to `<s3_prefix>-summaries`.
 
-def _preprocess_for_write(data, timestamp_key: str = "observed_at") -> dict | list:
-    now_str = datetime.now(timezone.utc).isoformat()
-    if isinstance(data, list):
-        return [_preprocess_for_write(item) for item in data]
-    elif isinstance(data, dict) and timestamp_key not in data:
-        data[timestamp_key] = now_str
-    else:
-        data = {
-            "data": data,
-            timestamp_key: now_str,
-        }
-    return data
+    The uploaded file will have the format <timestamp-of-run-end>_<public_ip>_<flow_run_id>.jsonl.zst.
+    """
+
+
+def _s3_file_name_factory(public_ip: str, flow_run_id: str):
+    def s3_file_name(chunk_seq: int | None) -> str:
+        suffix = "" if chunk_seq is None else f"_{chunk_seq:05d}"
+        return f"{dt_to_fs_compatible_str(datetime.now(timezone.utc))}_{public_ip}_{flow_run_id}{suffix}.jsonl.zst"
+
+    return s3_file_name
+
+
+def _run_file_s3_key(
+    s3_prefix: str,
+    public_ip: str,
+    flow_run_id: str,
+    partitioning: PartitionGranularity | None,
+) -> str:
+    now = datetime.now(timezone.utc)
+    if partitioning is not None:
+        s3_prefix = f"{s3_prefix}/{hive_partition_path(now, partitioning)}"
+    return f"{s3_prefix}/{dt_to_fs_compatible_str(now)}_{public_ip}_{flow_run_id}.jsonl.zst"
+
+
+def _compression_dictionaries(
+    bucket: S3Bucket, flow_run_data_dir: str, s3_prefixes: dict[str, str | None]
+) -> dict[str, Any]:
+    """
+    Returns the zstd dictionary to compress each file with: the latest one trained for the S3 prefix it is uploaded to,
+    unless the file already contains data (written by a previous attempt of the run) that was compressed with another one.
+    """
+    store = ZstdDictionaryStore(bucket)
+    dictionaries = {}
+    for file_name, s3_prefix in s3_prefixes.items():
+        if s3_prefix is None:
+            continue
+        file_path = os.path.join(flow_run_data_dir, file_name)
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            dict_id = file_dictionary_id(file_path)
+            dictionary = store.get(dict_id) if dict_id else None
+        else:
+            dictionary = store.latest(s3_prefix)
+        if dictionary is not None:
+            print(
+                f"Compressing {file_name} with zstd dictionary {dictionary.dict_id()} (trained for {s3_prefix})"
+            )
+        dictionaries[file_name] = dictionary
+    return dictionaries
+
+
+def _iter_queue_inputs(
+    queue: WorkQueue,
+    owner: str,
+    processed_inputs: CheckpointIndex,
+    metrics: RunMetrics,
+    batch_size: int,
+):
+    for key, input_el in queue.iter_leased(owner, batch_size=batch_size):
+        if key in processed_inputs:
+            # processed by a previous attempt of this flow run that crashed before acknowledging it
+            queue.ack([key])
+            metrics.increment("already_processed")
+            continue
+        yield input_el
+
+
+def _iter_unprocessed_inputs[T](
+    inputs: Iterable[T], processed_inputs: CheckpointIndex, metrics: RunMetrics
+):
+    for input_el in inputs:
+        if checkpoint_key(input_el) in processed_inputs:
+            metrics.increment("already_processed")
+            continue
+        yield input_el
 
 
-@task(name="Process data and write results to file")
+# inputs may be large (or iterators), so they must not be hashed for computing cache keys
+@task(name="Process data and upload results to S3", cache_policy=NO_CACHE)
 def _process_inputs_and_write_outputs[T](
-    inputs: list[T],
+    inputs: list[T] | Iterable[T] | WorkQueue,
     processing_fn: Callable[[T], Any],
     flow_run_data_dir: str,
+    bucket: S3Bucket,
+    outputs_s3_prefix: str | None,
+    failures_s3_prefix: str | None,
+    public_ip: str,
+    flow_run_id: str,
     timestamp_key: str = "observed_at",
+    max_in_flight: int = 1,
+    concurrency: ConcurrencyMode = "threads",
+    durability: DurabilityConfig | None = None,
+    chunking: ChunkingConfig | None = None,
+    encoder: RecordEncoderName | RecordEncoder = "json",
+    retry: RetryConfig | None = None,
+    response_cache: ResponseCache | None = None,
+    change_capture: ChangeCaptureConfig | None = None,
+    parquet: ParquetConfig | None = None,
+    partitioning: PartitionGranularity | None = None,
+    item_execution: ItemExecutionMode = "plain",
+    progress_interval_seconds: float = 30.0,
+    clickhouse_sink: ClickHouseSinkConfig | None = None,
+    tail_latency: TailLatencyConfig | None = None,
+    circuit_breaker: CircuitBreakerConfig | None = None,
+    zstd_dictionaries: bool = False,
 ):
-    processed_inputs_fp = os.path.join(flow_run_data_dir, "processed_inputs.txt")
-    inputs_len_initial = len(inputs)
-    print(f"Got {inputs_len_initial} inputs")
-    if os.path.exists(processed_inputs_fp):
-        with open(processed_inputs_fp, "r") as f_out:
-            processed_inputs = set([line for line in f_out.readlines()])
-            inputs = [el for el in inputs if str(el) not in processed_inputs]
-            inputs_len_after_filtering = len(inputs)
-            already_processed = inputs_len_initial - inputs_len_after_filtering
-            if already_processed:
-                print(
-                    f"Data already processed for {already_processed} inputs, skipping"
-                )
-
-    processed_data_fp = os.path.join(flow_run_data_dir, "processed_outputs.jsonl")
-    failed_inputs_fp = os.path.join(flow_run_data_dir, "failed_inputs.jsonl")
-
-    with ExitStack() as stack:
-        f_in = stack.enter_context(open(processed_inputs_fp, "a"))
-        f_out = stack.enter_context(open(processed_data_fp, "a"))
-        f_in_failed = stack.enter_context(open(failed_inputs_fp, "a"))
-        for input_el in inputs:
-            try:
-                processed_data = processing_fn(input_el)
-                if processed_data is None:
-                    print(f"No data for input {input_el}")
-                    f_in.write(str(input_el) + "\n")
-                    f_in.flush()
-                    continue
-                data_to_write = _preprocess_for_write(processed_data, timestamp_key)
-                if isinstance(data_to_write, list):
-                    for item in data_to_write:
-                        f_out.write(json.dumps(item) + "\n")
-                else:
-                    f_out.write(json.dumps(data_to_write) + "\n")
-                f_out.flush()
-                f_in.write(str(input_el) + "\n")
-                f_in.flush()
-            except Exception as e:
-                print(f"Error processing input {input_el}: {e}")
-                if isinstance(input_el, dict) or isinstance(input_el, list):
-                    try:
-                        input_el = json.dumps(input_el)
-                    except Exception as e:
-                        print(f"Error dumping input {input_el}: {e}")
-                        input_el = str(input_el)
-                else:
-                    input_el = {"input": str(input_el)}
-
-                f_in_failed.write(str(input_el) + "\n")
-                f_in_failed.flush()
-
-    return processed_data_fp, failed_inputs_fp
+    retry = retry or RetryConfig()
+    metrics = RunMetrics()
+    if item_execution == "plain":
+        processing_fn = as_plain_callable(processing_fn)
+    if tail_latency is not None:
+        processing_fn = with_tail_latency_limits(processing_fn, tail_latency, metrics)
+    if circuit_breaker is not None:
+        # guards every attempt, so that retries also wait while the circuit is open
+        processing_fn = CircuitBreaker(
+            circuit_breaker,
+            is_failure=lambda e: is_transient_error(e, retry),
+            metrics=metrics,
+        ).guarded(processing_fn)
+    processing_fn = with_retries(processing_fn, retry)
+    if response_cache is not None:
+        processing_fn = response_cache.cached(processing_fn, metrics)
+    record_encoder = TimestampedRecordEncoder(encoder, timestamp_key=timestamp_key)
+    file_names = [PROCESSED_OUTPUTS_FILE, FAILED_INPUTS_FILE, PROCESSED_INPUTS_FILE]
+    compressed_files = [PROCESSED_OUTPUTS_FILE, FAILED_INPUTS_FILE]
+    if change_capture is not None:
+        file_names += [UNCHANGED_INPUTS_FILE, FINGERPRINT_UPDATES_FILE]
+        compressed_files.append(UNCHANGED_INPUTS_FILE)
+    s3_prefixes: dict[str, str | None] = {PROCESSED_OUTPUTS_FILE: outputs_s3_prefix}
+    if failures_s3_prefix:
+        s3_prefixes[FAILED_INPUTS_FILE] = failures_s3_prefix
+    if change_capture is not None and change_capture.unchanged_s3_prefix:
+        s3_prefixes[UNCHANGED_INPUTS_FILE] = change_capture.unchanged_s3_prefix
+    # opening the writer discards anything written after the last commit, so it needs to happen before reading the checkpoints
+    writer = GroupCommitWriter(
+        flow_run_data_dir,
+        file_names,
+        config=durability,
+        compressed_files=compressed_files,
+        dictionaries=(
+            _compression_dictionaries(bucket, flow_run_data_dir, s3_prefixes)
+            if zstd_dictionaries
+            else None
+        ),
+    )
+    fingerprints = None
+    volatile_keys: set[str] = set()
+    if change_capture is not None:
+        volatile_keys = change_capture.volatile_keys
+        fingerprint_index_path = os.path.join(flow_run_data_dir, FINGERPRINT_INDEX_FILE)
+        # a retried run continues with the index it downloaded initially (plus the fingerprints it has committed since)
+        if not os.path.exists(fingerprint_index_path):
+            download_fingerprint_index(
+                bucket, change_capture.index_s3_key, fingerprint_index_path
+            )
+        fingerprints = FingerprintIndex.from_files(
+            [fingerprint_index_path, writer.path(FINGERPRINT_UPDATES_FILE)]
+        )
+        print(f"Loaded fingerprints of {len(fingerprints)} inputs")
+    processed_inputs = CheckpointIndex.from_file(writer.path(PROCESSED_INPUTS_FILE))
+    work_queue = inputs if isinstance(inputs, WorkQueue) else None
+    # checkpoint keys of items taken from the work queue that haven't been committed yet
+    unacked_keys: list[int] = []
+    if work_queue is not None:
+        print(f"Consuming work queue {work_queue.name}: {work_queue.counts()}")
+        inputs = _iter_queue_inputs(
+            work_queue,
+            flow_run_id,
+            processed_inputs,
+            metrics,
+            # lease only a few items ahead, so that the rest stays available to other workers
+            batch_size=2 * max_in_flight,
+        )
+
+        def ack_committed():
+            work_queue.ack(unacked_keys)
+            unacked_keys.clear()
+
+        writer.on_commit.append(ack_committed)
+    elif not isinstance(inputs, list):
+        print(f"Streaming inputs from {inputs}")
+        # inputs processed by a previous attempt are skipped while streaming, as they can't be filtered upfront
+        inputs = _iter_unprocessed_inputs(inputs, processed_inputs, metrics)
+    elif len(processed_inputs):
+        inputs_len_initial = len(inputs)
+        print(f"Got {inputs_len_initial} inputs")
+        inputs = [el for el in inputs if checkpoint_key(el) not in processed_inputs]
+        already_processed = inputs_len_initial - len(inputs)
+        if already_processed:
+            print(f"Data already processed for {already_processed} inputs, skipping")
+            metrics.increment("already_processed", already_processed)
+    else:
+        print(f"Got {len(inputs)} inputs")
+    if isinstance(inputs, list):
+        # not needed anymore once inputs are filtered
+        del processed_inputs
+
+    sink = ClickHouseSink(clickhouse_sink) if clickhouse_sink else None
+    chunks = RollingChunks(
+        writer,
+        ChunkUploader(
+            bucket, upload_attempts=chunking.upload_attempts if chunking else 3
+        ),
+        s3_prefixes=s3_prefixes,
+        s3_file_name=_s3_file_name_factory(public_ip, flow_run_id),
+        config=chunking,
+        converters=(
+            {PROCESSED_OUTPUTS_FILE: ParquetConverter(parquet)} if parquet else None
+        ),
+        partitioning=partitioning,
+        sinks={PROCESSED_OUTPUTS_FILE: [sink]} if sink else None,
+    )
+    chunks.upload_leftover_chunks()
+    progress = ProgressReporter(
+        metrics,
+        total=len(inputs) if isinstance(inputs, list) else None,
+        interval_seconds=progress_interval_seconds,
+    )
+
+    # keeps leases of items taken from the work queue alive until they are committed (even if that takes longer than the visibility timeout)
+    lease_heartbeat = (
+        LeaseHeartbeat(work_queue, flow_run_id)
+        if work_queue is not None
+        else contextlib.nullcontext()
+    )
+    try:
+        with lease_heartbeat, writer:
+            # processing_fn may run concurrently, but results are only ever written from this thread
+            for input_el, processed_data, error in iter_results(
+                inputs,
+                # measure latency including retries (and cache lookups)
+                metrics.timed(processing_fn),
+                max_in_flight=max_in_flight,
+                concurrency=concurrency,
+            ):
+                if isinstance(error, CircuitOpenError):
+                    # neither a failure nor checkpointed (or acknowledged), so the input is processed again by a retry of the run
+                    print(
+                        f"{error}. Inputs that haven't been processed yet are skipped"
+                    )
+                    metrics.record_result("skipped", error=error)
+                    break
+                input_key = checkpoint_key(input_el)
+                processed_input_checkpoint = encode_checkpoint_key(input_key)
+                try:
+                    if error is not None:
+                        raise error
+                    if processed_data is None:
+                        print(f"No data for input {input_el}")
+                        writer.write(PROCESSED_INPUTS_FILE, processed_input_checkpoint)
+                        metrics.record_result("empty")
+                        continue
+                    timestamp = datetime.now(timezone.utc).isoformat()
+                    result_fingerprint = None
+                    if fingerprints is not None:
+                        result_fingerprint = fingerprint(processed_data, volatile_keys)
+                        if fingerprints.get(input_key) == result_fingerprint:
+                            if UNCHANGED_INPUTS_FILE in s3_prefixes:
+                                writer.write(
+                                    UNCHANGED_INPUTS_FILE,
+                                    record_encoder.encode_lines(
+                                        {
+                                            "input": input_el,
+                                            "fingerprint": f"{result_fingerprint:016x}",
+                                        },
+                                        timestamp,
+                                    ),
+                                )
+                            writer.write(
+                                PROCESSED_INPUTS_FILE, processed_input_checkpoint
+                            )
+                            metrics.record_result("unchanged")
+                            continue
+                    encoded = record_encoder.encode_lines(processed_data, timestamp)
+                    # only recorded once the result could be encoded, as the input would be considered unchanged by later runs otherwise
+                    if fingerprints is not None and result_fingerprint is not None:
+                        fingerprints.set(input_key, result_fingerprint)
+                        writer.write(
+                            FINGERPRINT_UPDATES_FILE,
+                            encode_fingerprint_entry(input_key, result_fingerprint),
+                        )
+                    writer.write(PROCESSED_OUTPUTS_FILE, encoded)
+                    writer.write(PROCESSED_INPUTS_FILE, processed_input_checkpoint)
+                    metrics.record_result("succeeded", bytes_out=len(encoded))
+                except Exception as e:
+                    print(f"Error processing input {input_el}: {e}")
+                    metrics.record_result("failed", error=e)
+                    writer.write(
+                        FAILED_INPUTS_FILE,
+                        encode_failure_record(
+                            input_el, e, transient=is_replayable_error(e, retry)
+                        ),
+                    )
+                finally:
+                    if work_queue is not None:
+                        # failed inputs are acknowledged too (they can be reprocessed with replay_failed_inputs)
+                        unacked_keys.append(input_key)
+                    if writer.end_item():
+                        chunks.rotate_if_due()
+                    progress.maybe_report()
+
+            chunks.finish()
+            progress.report()
+
+        if change_capture is not None and fingerprints is not None:
+            # only upload the updated index once all outputs are in S3, so changed records can never get lost
+            fingerprints.write(fingerprint_index_path)
+            bucket.upload_from_path(
+                fingerprint_index_path, to_path=change_capture.index_s3_key
+            )
+            print(
+                f"Uploaded fingerprints of {len(fingerprints)} inputs to {change_capture.index_s3_key}"
+            )
+    finally:
+        if work_queue is not None:
+            # make items that haven't been processed (or committed) available to other workers again
+            work_queue.release(flow_run_id)
+
+    if not chunks.uploaded_chunks[PROCESSED_OUTPUTS_FILE]:
+        print("No data processed successfully :(")
+    if failures_s3_prefix and not chunks.uploaded_chunks[FAILED_INPUTS_FILE]:
+        print("No failures occurred, so nothing to upload :)")
+
+    metrics.counters["uploaded_output_chunks"] = chunks.uploaded_chunks[
+        PROCESSED_OUTPUTS_FILE
+    ]
+    if sink is not None:
+        metrics.counters["clickhouse_inserted_rows"] = sink.inserted_rows
+    return metrics.summary()
 
 
 @task(name="Compress with zstd and upload to S3")
@@ -122,17 +445,105 @@ def _compress_and_upload_file(file_path: str, bucket: S3Bucket, s3_key: str):
 
 
 def process_and_upload_data[T](
-    inputs: list[T],
+    inputs: list[T] | Iterable[T] | WorkQueue,
     processing_fn: Callable[[T], Any],
-    outputs_s3_prefix: str,
+    outputs_s3_prefix: str | None,
     failures_s3_prefix: str | None = None,
     timestamp_key: str = "observed_at",
     run_meta_config: RunMetaConfig | None = None,
+    flow_run_id: str | None = None,
+    max_in_flight: int = 1,
+    concurrency: ConcurrencyMode = "threads",
+    durability: DurabilityConfig | None = None,
+    chunking: ChunkingConfig | None = None,
+    encoder: RecordEncoderName | RecordEncoder = "json",
+    retry: RetryConfig | None = None,
+    response_cache: ResponseCache | None = None,
+    change_capture: ChangeCaptureConfig | None = None,
+    parquet: ParquetConfig | None = None,
+    partitioning: PartitionGranularity | None = None,
+    item_execution: ItemExecutionMode = "plain",
+    progress_interval_seconds: float = 30.0,
+    clickhouse_sink: ClickHouseSinkConfig | None = None,
+    tail_latency: TailLatencyConfig | None = None,
+    circuit_breaker: CircuitBreakerConfig | None = None,
+    telemetry: TelemetryConfig | None = None,
+    zstd_dictionaries: bool = False,
 ):
-    public_ip = get_public_ip()
-    bucket = S3Bucket.load("s3-bucket")
+    """
+    Processes `inputs` with `processing_fn`, writing results (and failures) to local zstd-compressed files which are uploaded to S3.
+
+    Progress is checkpointed locally, so a flow run that is retried only processes inputs that haven't been processed yet.
+
+    Args:
+        inputs: The inputs to process, or a `WorkQueue` to consume inputs from (which can be shared by multiple concurrent flow runs).
+            Items taken from a work queue are acknowledged once their results (or failures) have been committed to disk.
+            Any other iterable (e.g. a generator or a source from `utils.input_sources`) is consumed lazily, only as fast as inputs are processed.
+            Use a source (which can be iterated again) rather than a generator if the flow may be retried.
+        outputs_s3_prefix: The prefix under which outputs are uploaded. May only be None if outputs are written to `clickhouse_sink` instead.
+        flow_run_id: ID of the current flow run (used for local file paths and S3 keys). Defaults to the ID of the flow run this is called from.
+        max_in_flight: Maximum number of inputs processed concurrently. With the default of 1, inputs are processed one after another.
+        concurrency: Whether concurrent calls of `processing_fn` run on a thread pool ("threads") or an event loop ("asyncio").
+            Async processing functions always run on an event loop.
+        durability: How often outputs, failures and checkpoints are committed to disk (together). A crash loses at most one commit window.
+        chunking: If provided, outputs and failures are split into chunks (by size and age) which are uploaded in the background
+            while processing continues, keeping local disk usage bounded. Otherwise, they are uploaded once all inputs have been processed.
+        encoder: The JSON encoder used for serializing outputs ("json", "orjson", "msgspec" or a custom function returning bytes).
+        retry: How often (and with which backoff) `processing_fn` is retried for transient errors before an input counts as failed.
+            Failed inputs are written to `failures_s3_prefix` (if provided) and can be reprocessed with `replay_failed_inputs`.
+        response_cache: If provided, results of `processing_fn` are served from (and stored in) this cache.
+            Hits and misses are counted in the run summary.
+        change_capture: If provided, results are only written if they changed since the last run (see `ChangeCaptureConfig`).
+        parquet: If provided, outputs are uploaded as Parquet instead of JSONL files (converted from the JSONL files written locally,
+            chunk by chunk, right before uploading them). Failures and other files are still uploaded as JSONL.
+        partitioning: If provided, all files are uploaded to Hive-style partitions by (UTC) upload time under their prefixes,
+            e.g. `<prefix>/dt=YYYY-MM-DD/<file name>` for "day" or `<prefix>/dt=YYYY-MM-DD/hour=HH/<file name>` for "hour"
+            (see the helpers in `utils.date` for working with them).
+        item_execution: With "plain" (the default), Prefect tasks passed as `processing_fn` (also wrapped in `functools.partial`)
+            are called as plain functions, avoiding the overhead of creating a task run per input. Progress and failure counts
+            are reported every `progress_interval_seconds` instead. With "task", a task run is created for every input.
+        clickhouse_sink: If provided, outputs are inserted into a ClickHouse table, chunk by chunk (see `ClickHouseSinkConfig`).
+            Use chunking with a short `max_chunk_age_seconds` to make data queryable while the run is still going on.
+        tail_latency: If provided, every call of `processing_fn` gets a deadline (after which it fails with a transient error
+            and is retried) and/or slow calls are hedged (see `TailLatencyConfig`). Latency percentiles and hedging counters
+            are included in the run summary.
+        circuit_breaker: If provided, calls of `processing_fn` are paused while most of them fail with transient errors
+            (see `CircuitBreakerConfig`). If the upstream service doesn't recover in time (or its API quota is exhausted),
+            the remaining inputs are left unprocessed (and not written to the failures): the run fails after uploading its results,
+            so a retry continues where it stopped.
+        telemetry: If provided, the resource usage of the process (CPU, RSS, network and disk throughput, open file descriptors
+            and optionally the largest memory allocations) is sampled while inputs are processed and included in the run summary
+            under "telemetry" (see `utils.telemetry.ResourceSampler`).
+        zstd_dictionaries: If True, every file is compressed with the latest zstd dictionary trained for the S3 prefix it is
+            uploaded to, if there is one (see `utils.zstd.ZstdDictionaryStore` and the `train_zstd_dictionaries` flow).
+            Readers in `utils` find the dictionary by the ID recorded in the files. Parquet outputs aren't affected.
+            NOTE: files compressed with a dictionary can't be read by tools that don't have it, in particular ClickHouse's
+            `s3()` table function (and imports based on it), so only enable this for prefixes that aren't imported that way.
+
+    Returns:
+        A summary of the run's metrics (see `RunMetrics.summary`), which is also uploaded next to the run metadata if `run_meta_config` is provided.
+    """
+    if outputs_s3_prefix is None and clickhouse_sink is None:
+        raise ValueError("Outputs need to be uploaded to S3 or written to ClickHouse")
+
+    setup: list[Callable[[], Any]] = [
+        get_public_ip,
+        functools.partial(load_block, S3Bucket, "s3-bucket"),
+    ]
+    if clickhouse_sink is not None:
+        # cached for the lifetime of the process, so the sink doesn't need to load it again
+        setup.append(
+            functools.partial(
+                load_block, ClickHouseCredentials, clickhouse_sink.credentials_block
+            )
+        )
+    public_ip, bucket, *_ = run_concurrently(*setup)
 
-    flow_run_id = get_id()
+    flow_run_id = flow_run_id or get_id()
+    if not flow_run_id:
+        raise ValueError(
+            "Could not get flow run ID (required for storing data locally before uploading to S3)"
+        )
     flow_run_data_dir = os.path.join(DATA_DIR, flow_run_id)
     if not os.path.exists(flow_run_data_dir):
         os.makedirs(flow_run_data_dir)
@@ -141,30 +552,110 @@ def process_and_upload_data[T](
         raw_meta_path = os.path.join(flow_run_data_dir, "run_meta_config.json")
         with open(raw_meta_path, "w") as f:
             json.dump(run_meta_config.model_dump(), f)
-        run_meta_s3_key = f"{run_meta_config.s3_prefix}/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{public_ip}_{flow_run_id}.jsonl.zst"
+        run_meta_s3_key = _run_file_s3_key(
+            run_meta_config.s3_prefix, public_ip, flow_run_id, partitioning
+        )
         _compress_and_upload_file(raw_meta_path, bucket, s3_key=run_meta_s3_key)
 
-    output_file, failed_inputs_file = _process_inputs_and_write_outputs(
-        inputs, processing_fn, flow_run_data_dir, timestamp_key=timestamp_key
-    )
+    sampler = ResourceSampler(telemetry) if telemetry else contextlib.nullcontext()
+    with sampler:
+        summary = _process_inputs_and_write_outputs(
+            inputs,
+            processing_fn,
+            flow_run_data_dir,
+            bucket=bucket,
+            outputs_s3_prefix=outputs_s3_prefix,
+            failures_s3_prefix=failures_s3_prefix,
+            public_ip=public_ip,
+            flow_run_id=flow_run_id,
+            timestamp_key=timestamp_key,
+            max_in_flight=max_in_flight,
+            concurrency=concurrency,
+            durability=durability,
+            chunking=chunking,
+            encoder=encoder,
+            retry=retry,
+            response_cache=response_cache,
+            change_capture=change_capture,
+            parquet=parquet,
+            partitioning=partitioning,
+            item_execution=item_execution,
+            progress_interval_seconds=progress_interval_seconds,
+            clickhouse_sink=clickhouse_sink,
+            tail_latency=tail_latency,
+            circuit_breaker=circuit_breaker,
+            zstd_dictionaries=zstd_dictionaries,
+        )
+    if isinstance(sampler, ResourceSampler):
+        summary["telemetry"] = sampler.summary()
+    print(f"Run summary: {json.dumps(summary)}")
 
-    if os.path.getsize(output_file) == 0:
-        print("No data processed successfully :(")
-    else:
-        output_last_modified = datetime.fromtimestamp(
-            os.path.getmtime(output_file), tz=timezone.utc
+    if run_meta_config:
+        # metrics only cover this attempt of the flow run (inputs processed by previous attempts are counted as "already_processed")
+        summary_path = os.path.join(flow_run_data_dir, "run_summary.json")
+        with open(summary_path, "w") as f:
+            json.dump({"flow_run_id": flow_run_id, **summary}, f)
+        summary_s3_prefix = (
+            run_meta_config.summary_s3_prefix
+            or f"{run_meta_config.s3_prefix}-summaries"
+        )
+        summary_s3_key = _run_file_s3_key(
+            summary_s3_prefix, public_ip, flow_run_id, partitioning
         )
-        output_s3_key = f"{outputs_s3_prefix}/{output_last_modified.strftime('%Y-%m-%d_%H-%M-%S')}_{public_ip}_{flow_run_id}.jsonl.zst"
-        _compress_and_upload_file(output_file, bucket, s3_key=output_s3_key)
+        _compress_and_upload_file(summary_path, bucket, s3_key=summary_s3_key)
 
-    if failures_s3_prefix:
-        if os.path.getsize(failed_inputs_file) == 0:
-            print("No failures occurred, so nothing to upload :)")
-        else:
-            failed_inputs_s3_key = f"{failures_s3_prefix}/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{public_ip}_{flow_run_id}.jsonl.zst"
-            _compress_and_upload_file(
-                failed_inputs_file, bucket, s3_key=failed_inputs_s3_key
-            )
+    if summary["outcomes"].get("skipped"):
+        # keep the checkpoints, so that a retry of the flow run only processes the skipped inputs
+        raise CircuitOpenError(
+            "Processing stopped early as the circuit breaker gave up, retry the flow run to process the remaining inputs"
+        )
 
     # if this is reached, we know that everything has gone well and we can delete any remaining files
     shutil.rmtree(flow_run_data_dir)
+    return summary
+
+
+def replay_failed_inputs[T](
+    processing_fn: Callable[[T], Any],
+    outputs_s3_prefix: str,
+    failures_s3_prefix: str,
+    replayed_s3_prefix: str | None = None,
+    only_transient: bool = True,
+    **kwargs,
+):
+    """
+    Reprocesses the inputs of all failure files stored under `failures_s3_prefix` with `processing_fn`.
+
+    Inputs are streamed from the failure files (one file at a time), so memory usage doesn't depend on the number of failures.
+    Inputs that fail again are written to new failure files under `failures_s3_prefix`. Once the run has finished, the failure files
+    whose inputs have all been replayed are moved to `replayed_s3_prefix` (defaults to `<failures_s3_prefix>-replayed`), so they aren't replayed again.
+
+    Args:
+        only_transient: Skip inputs that failed with a permanent error (e.g. HTTP 404). Inputs from files in the legacy format
+            (which don't record the error) are always replayed.
+        kwargs: Passed on to `process_and_upload_data`.
+    """
+    bucket = load_block(S3Bucket, "s3-bucket")
+    replayed_s3_prefix = (
+        replayed_s3_prefix or f"{failures_s3_prefix.rstrip('/')}-replayed"
+    )
+
+    inputs = FailedInputSource(bucket, failures_s3_prefix, only_transient)
+    summary = process_and_upload_data(
+        inputs,
+        processing_fn,
+        outputs_s3_prefix=outputs_s3_prefix,
+        failures_s3_prefix=failures_s3_prefix,
+        **kwargs,
+    )
+    print(
+        f"Replayed {summary['items']} failed inputs from {len(inputs.completed_keys)} files (skipped {inputs.skipped} permanent failures)"
+    )
+
+    # only reached if the run succeeded, so every input of these files has been processed (or written to a new failure file)
+    for key in inputs.completed_keys:
+        file_name = key.rsplit("/", 1)[-1]
+        bucket.move_object(key, f"{replayed_s3_prefix}/{file_name}")
+    print(
+        f"Moved {len(inputs.completed_keys)} replayed failure files to {replayed_s3_prefix}"
+    )
@@ -0,0 +1,83 @@
+import json
+from typing import Any, Callable, Literal
+
+type RecordEncoder = Callable[[Any], bytes]
+"""
+Serializes a record to (a single line of) JSON.
+"""
+
+type RecordEncoderName = Literal["json", "orjson", "msgspec"]
+
+
+def json_encoder(record: Any) -> bytes:
+    return json.dumps(record, separators=(",", ":")).encode("utf-8")
+
+
+def get_record_encoder(encoder: RecordEncoderName | RecordEncoder) -> RecordEncoder:
+    """
+    Returns the encoder with the given name (or `encoder` itself, if it is a custom encoder already).
+
+    "orjson" and "msgspec" are considerably faster than the standard library's json module for large records.
+    orjson is a dependency of the project (and of Prefect), msgspec is optional and only imported when it is used.
+    """
+    if callable(encoder):
+        return encoder
+    if encoder == "json":
+        return json_encoder
+    if encoder == "orjson":
+        try:
+            import orjson
+        except ImportError as e:
+            raise ImportError(
+                "orjson must be installed to use the 'orjson' encoder"
+            ) from e
+        # serialize non-string dict keys (e.g. ints) like the json module does
+        return lambda record: orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS)
+    if encoder == "msgspec":
+        try:
+            import msgspec
+        except ImportError as e:
+            raise ImportError(
+                "msgspec must be installed to use the 'msgspec' encoder"
+            ) from e
+        return msgspec.json.Encoder().encode
+    raise ValueError(f"Unknown record encoder: {encoder}")
+
+
+class TimestampedRecordEncoder:
+    """
+    Encodes records for writing them to JSONL files, adding a timestamp field to each of them.
+
+    The timestamp is spliced into the encoded bytes instead of being added to the record, so records are neither copied nor modified.
+    Dicts get the timestamp as an additional field (unless they already have a field with the same name),
+    anything else is wrapped as `{"data": <record>, <timestamp_key>: <timestamp>}`.
+    """
+
+    def __init__(
+        self,
+        encoder: RecordEncoderName | RecordEncoder = "json",
+        timestamp_key: str = "observed_at",
+    ):
+        self.encode = get_record_encoder(encoder)
+        self.timestamp_key = timestamp_key
+        self._timestamp_key_bytes = json.dumps(timestamp_key).encode("utf-8")
+
+    def encode_lines(self, data: Any, timestamp: str) -> bytes:
+        """
+        Encodes processing results as JSONL. If `data` is a list, each item is written as a separate line.
+        """
+        timestamp_field = (
+            self._timestamp_key_bytes + b":" + json.dumps(timestamp).encode("utf-8")
+        )
+        if isinstance(data, list):
+            return b"".join(self._encode_line(item, timestamp_field) for item in data)
+        return self._encode_line(data, timestamp_field)
+
+    def _encode_line(self, record: Any, timestamp_field: bytes) -> bytes:
+        if isinstance(record, dict) and self.timestamp_key not in record:
+            encoded = self.encode(record)
+            if encoded == b"{}":
+                return b"{" + timestamp_field + b"}\n"
+            # strip the closing brace, then append the timestamp field as the last one
+            return encoded[:-1] + b"," + timestamp_field + b"}\n"
+        return b'{"data":' + self.encode(record) + b"," + timestamp_field + b"}\n"
@@ -0,0 +1,141 @@
+import time
+from collections import Counter
+from typing import Any, Literal
+from prefect.client.orchestration import get_client
+from prefect.client.schemas.objects import FlowRun
+from prefect.deployments import run_deployment
+from prefect.runtime.flow_run import get_id
+
+from utils.checkpoint_index import checkpoint_key
+
+type ShardingStrategy = Literal["hash", "contiguous"]
+
+
+def shard_inputs[T](
+    inputs: list[T], num_shards: int, strategy: ShardingStrategy = "hash"
+) -> list[list[T]]:
+    """
+    Partitions `inputs` into (at most) `num_shards` non-empty shards.
+
+    Args:
+        strategy: "hash" assigns inputs by the hash of their checkpoint key, so an input always ends up in the same shard
+            (a retried fan-out resubmits each shard with the same inputs). "contiguous" splits the list into consecutive
+            slices of (almost) equal size, keeping the input order.
+    """
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+    if strategy == "hash":
+        shards: list[list[T]] = [[] for _ in range(num_shards)]
+        for input_el in inputs:
+            shards[checkpoint_key(input_el) % num_shards].append(input_el)
+    else:
+        shard_size, remainder = divmod(len(inputs), num_shards)
+        shards = []
+        start = 0
+        for i in range(num_shards):
+            end = start + shard_size + (1 if i < remainder else 0)
+            shards.append(inputs[start:end])
+            start = end
+    return [shard for shard in shards if shard]
+
+
+def fan_out[T](
+    deployment_name: str,
+    inputs: list[T],
+    inputs_parameter: str,
+    num_shards: int,
+    parameters: dict[str, Any] | None = None,
+    strategy: ShardingStrategy = "hash",
+    poll_interval_seconds: float = 10.0,
+    timeout_seconds: float | None = None,
+) -> dict:
+    """
+    Splits `inputs` into shards and processes each of them in a separate run of a deployment, so that the work
+    is spread across all workers of the deployment's work pool. Waits until all runs have finished.
+
+    Flows built on `process_and_upload_data` can be fanned out like this as they are: every run writes its own
+    files (named after its flow run ID) under the same S3 prefixes.
+
+    Args:
+        deployment_name: The deployment to run, in the format "<flow name>/<deployment name>" (e.g. "sc-artists/api").
+        inputs: The inputs to split into shards.
+        inputs_parameter: Name of the flow parameter each shard is passed to (e.g. "artist_uuids").
+        num_shards: Number of shards (i.e. flow runs).
+        parameters: Further parameters passed to every run.
+        strategy: How to split inputs into shards (see `shard_inputs`).
+        poll_interval_seconds: How often the states of the runs are checked.
+        timeout_seconds: Maximum time to wait for all runs to finish. Runs still going after that are left running.
+
+    Returns:
+        A summary of the fan-out: the number of runs per final state, plus the ID, state and number of inputs of every run.
+    """
+    shards = shard_inputs(inputs, num_shards, strategy)
+    print(
+        f"Submitting {len(shards)} runs of {deployment_name} for {len(inputs)} inputs"
+    )
+    parent_flow_run_id = get_id()
+    flow_runs: list[tuple[FlowRun, int]] = []
+    for i, shard in enumerate(shards):
+        shard_name = f"shard-{i + 1}-of-{len(shards)}"
+        # timeout=0 returns right away, so that all shards are scheduled before waiting for any of them
+        flow_run = run_deployment(
+            deployment_name,
+            parameters={**(parameters or {}), inputs_parameter: shard},
+            timeout=0,
+            tags=[shard_name],
+            # if the calling flow run is retried, the existing run of each shard is picked up instead of submitting a new one
+            idempotency_key=(
+                f"{parent_flow_run_id}-{deployment_name}-{shard_name}"
+                if parent_flow_run_id
+                else None
+            ),
+        )
+        flow_runs.append((flow_run, len(shard)))  # type: ignore
+
+    started = time.monotonic()
+    with get_client(sync_client=True) as client:
+        while True:
+            flow_runs = [
+                (client.read_flow_run(flow_run.id), shard_size)
+                for flow_run, shard_size in flow_runs
+            ]
+            unfinished = [
+                flow_run
+                for flow_run, _ in flow_runs
+                if not (flow_run.state and flow_run.state.is_final())
+            ]
+            if not unfinished:
+                break
+            if (
+                timeout_seconds is not None
+                and time.monotonic() - started > timeout_seconds
+            ):
+                print(
+                    f"Timed out waiting for {len(unfinished)} runs, leaving them running"
+                )
+                break
+            time.sleep(poll_interval_seconds)
+
+    runs = [
+        {
+            "flow_run_id": str(flow_run.id),
+            "flow_run_name": flow_run.name,
+            "state": flow_run.state.type.value if flow_run.state else None,
+            "inputs": shard_size,
+        }
+        for flow_run, shard_size in flow_runs
+    ]
+    inputs_by_state: Counter[str | None] = Counter()
+    for run in runs:
+        inputs_by_state[run["state"]] += run["inputs"]
+    summary = {
+        "deployment": deployment_name,
+        "inputs": len(inputs),
+        "runs_by_state": dict(Counter(run["state"] for run in runs)),
+        "inputs_by_state": dict(inputs_by_state),
+        "runs": runs,
+    }
+    print(
+        f"Fan-out finished: {summary['runs_by_state']} (inputs: {summary['inputs_by_state']})"
+    )
+    return summary
@@ -0,0 +1,210 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable
+from pydantic import BaseModel
+
+from utils.execution import wrap_sync_or_async
+from utils.metrics import LatencyHistogram, RunMetrics
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised if a call (including its hedges) didn't finish within its deadline. Counts as a transient error, so it is retried.
+    """
+
+
+class TailLatencyConfig(BaseModel):
+    """
+    Limits the impact of slow calls of a processing function (e.g. hung HTTP requests) on the duration of a run.
+
+    NOTE: calls that exceed their deadline (and hedges that lose) can't be interrupted, they keep running in the background
+    until they return. Deadlines should therefore be combined with timeouts of the underlying client where possible.
+    """
+
+    deadline_seconds: float | None = None
+    """
+    Maximum time a call (including its hedges) may take before it fails with a `DeadlineExceededError`.
+    Applies to every attempt separately if calls are retried.
+    """
+
+    hedge_percentile: float | None = None
+    """
+    If set, a duplicate (hedged) call is started if a call takes longer than this percentile (e.g. 95) of the latencies
+    observed so far. Whichever call finishes first wins. Only suitable for idempotent calls, as hedges may double their side effects
+    (including API quota usage) for the slowest calls.
+    """
+
+    min_samples: int = 20
+    """
+    Number of calls that need to have finished before calls are hedged (as the percentile isn't meaningful before).
+    """
+
+    min_hedge_delay_seconds: float = 0.0
+    """
+    Lower bound for the delay before hedging a call, to avoid hedging calls that are consistently fast anyway.
+    """
+
+    max_hedges: int = 1
+    """
+    Maximum number of hedges started per call (each after another hedge delay has passed).
+    """
+
+
+class _Hedger:
+    def __init__(self, config: TailLatencyConfig, metrics: RunMetrics | None):
+        self.config = config
+        self.metrics = metrics
+        self._latency = LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def record_latency(self, latency: float):
+        with self._lock:
+            self._latency.record(latency)
+
+    def hedge_delay(self) -> float | None:
+        """
+        Returns the time after which a call (or the last hedge) should be hedged, or None if calls shouldn't be hedged (yet).
+        """
+        if self.config.hedge_percentile is None:
+            return None
+        with self._lock:
+            if self._latency.count < self.config.min_samples:
+                return None
+            delay = self._latency.percentile(self.config.hedge_percentile)
+        return max(delay or 0.0, self.config.min_hedge_delay_seconds)
+
+    def next_timeout(
+        self, start: float, last_launch: float, launched: int
+    ) -> tuple[float | None, bool]:
+        """
+        Returns how long to wait for the next result and whether a hedge is due once that time has passed without a result.
+        """
+        now = time.monotonic()
+        timeout = None
+        hedge_due = False
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None and launched <= self.config.max_hedges:
+            timeout = max(0.0, last_launch + hedge_delay - now)
+            hedge_due = True
+        if self.config.deadline_seconds is not None:
+            until_deadline = max(0.0, start + self.config.deadline_seconds - now)
+            if timeout is None or until_deadline <= timeout:
+                timeout = until_deadline
+                hedge_due = False
+        return timeout, hedge_due
+
+    def increment(self, counter: str):
+        if self.metrics is not None:
+            self.metrics.increment(counter)
+
+    def deadline_exceeded(self) -> DeadlineExceededError:
+        self.increment("deadline_exceeded")
+        return DeadlineExceededError(
+            f"Call didn't finish within {self.config.deadline_seconds} seconds"
+        )
+
+
+def with_tail_latency_limits[T](
+    processing_fn: Callable[[T], Any],
+    config: TailLatencyConfig,
+    metrics: RunMetrics | None = None,
+) -> Callable[[T], Any]:
+    """
+    Wraps a (sync or async) processing function so that calls are subject to the deadline and hedging configured in `config`.
+
+    Sync calls run on separate (daemon) threads, so the calling thread can stop waiting for them.
+    Hedges, hedges that won and exceeded deadlines are counted in `metrics` (as "hedged_calls", "hedge_wins" and "deadline_exceeded").
+    """
+    if config.deadline_seconds is None and config.hedge_percentile is None:
+        return processing_fn
+    hedger = _Hedger(config, metrics)
+
+    async def timed_call(input_el: T):
+        start = time.perf_counter()
+        result = await processing_fn(input_el)
+        hedger.record_latency(time.perf_counter() - start)
+        return result
+
+    async def async_wrapper(input_el: T):
+        start = last_launch = time.monotonic()
+        pending = {asyncio.ensure_future(timed_call(input_el)): 0}
+        launched = 1
+        error: BaseException | None = None
+        try:
+            while pending:
+                timeout, hedge_due = hedger.next_timeout(start, last_launch, launched)
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if not hedge_due:
+                        raise hedger.deadline_exceeded()
+                    hedger.increment("hedged_calls")
+                    pending[asyncio.ensure_future(timed_call(input_el))] = launched
+                    launched += 1
+                    last_launch = time.monotonic()
+                    continue
+                for task in done:
+                    attempt = pending.pop(task)
+                    if task.exception() is None:
+                        if attempt > 0:
+                            hedger.increment("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def wrapper(input_el: T):
+        results: queue.SimpleQueue[tuple[int, Any, Exception | None]] = (
+            queue.SimpleQueue()
+        )
+
+        def call(attempt: int):
+            start = time.perf_counter()
+            try:
+                result = processing_fn(input_el)
+            except Exception as e:
+                results.put((attempt, None, e))
+                return
+            hedger.record_latency(time.perf_counter() - start)
+            results.put((attempt, result, None))
+
+        def launch(attempt: int):
+            # copy the context so that Prefect's run context (required for calling tasks) is available in the thread
+            ctx = contextvars.copy_context()
+            threading.Thread(
+                target=ctx.run, args=(call, attempt), name="hedged-call", daemon=True
+            ).start()
+
+        start = last_launch = time.monotonic()
+        launch(0)
+        launched = 1
+        in_flight = 1
+        while True:
+            timeout, hedge_due = hedger.next_timeout(start, last_launch, launched)
+            try:
+                attempt, result, error = results.get(timeout=timeout)
+            except queue.Empty:
+                if not hedge_due:
+                    raise hedger.deadline_exceeded() from None
+                hedger.increment("hedged_calls")
+                launch(launched)
+                launched += 1
+                in_flight += 1
+                last_launch = time.monotonic()
+                continue
+            in_flight -= 1
+            if error is None:
+                if attempt > 0:
+                    hedger.increment("hedge_wins")
+                return result
+            if not in_flight:
+                raise error
+
+    return wrap_sync_or_async(processing_fn, wrapper, async_wrapper)
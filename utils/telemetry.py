@@ -0,0 +1,231 @@
+import contextvars
+import os
+import threading
+import time
+import tracemalloc
+from typing import Any, Protocol
+from pydantic import BaseModel
+
+
+class TelemetryConfig(BaseModel):
+    """
+    Enables sampling the resource usage of the current process in the background while a scraping run processes its inputs.
+
+    Uses psutil if it is installed. Otherwise, usage is read from `/proc` (Linux only, as in our containers).
+    """
+
+    interval_seconds: float = 10.0
+
+    tracemalloc_top: int | None = None
+    """
+    If set, memory allocations are traced (with tracemalloc) and the source lines with the largest allocations
+    are recorded every `tracemalloc_interval_seconds`. NOTE: tracing slows down allocation-heavy code considerably.
+    """
+
+    tracemalloc_interval_seconds: float = 5 * 60
+
+
+class _UsageReader(Protocol):
+    def read(self) -> dict[str, float | int | None]:
+        """
+        Returns cumulative CPU time (seconds), current RSS, cumulative network and disk bytes and the number of open file descriptors.
+        """
+        ...
+
+
+class _PsutilUsageReader:
+    def __init__(self):
+        import psutil
+
+        self._psutil = psutil
+        self._process = psutil.Process()
+
+    def read(self) -> dict[str, float | int | None]:
+        cpu = self._process.cpu_times()
+        net = self._psutil.net_io_counters()
+        try:
+            # not available on macOS
+            io = self._process.io_counters()  # type: ignore
+            disk_read, disk_write = io.read_bytes, io.write_bytes
+        except (AttributeError, self._psutil.AccessDenied):
+            disk_read = disk_write = None
+        return {
+            "cpu_seconds": cpu.user + cpu.system,
+            "rss_bytes": self._process.memory_info().rss,
+            "net_sent_bytes": net.bytes_sent if net else None,
+            "net_recv_bytes": net.bytes_recv if net else None,
+            "disk_read_bytes": disk_read,
+            "disk_write_bytes": disk_write,
+            # not available on Windows
+            "open_fds": getattr(self._process, "num_fds", lambda: None)(),
+        }
+
+
+class _ProcUsageReader:
+    def __init__(self):
+        self._ticks_per_second = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def read(self) -> dict[str, float | int | None]:
+        with open("/proc/self/stat") as f:
+            # the command name (2nd field) may contain spaces, fields after it are split by spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are the 14th and 15th fields of /proc/<pid>/stat
+        cpu_ticks = int(fields[11]) + int(fields[12])
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        io = _read_key_values("/proc/self/io")
+        net_sent = net_recv = 0
+        with open("/proc/self/net/dev") as f:
+            for line in f.readlines()[2:]:
+                interface, counters = line.split(":", 1)
+                if interface.strip() == "lo":
+                    continue
+                values = counters.split()
+                net_recv += int(values[0])
+                net_sent += int(values[8])
+        return {
+            "cpu_seconds": cpu_ticks / self._ticks_per_second,
+            "rss_bytes": rss_pages * self._page_size,
+            "net_sent_bytes": net_sent,
+            "net_recv_bytes": net_recv,
+            "disk_read_bytes": io.get("read_bytes"),
+            "disk_write_bytes": io.get("write_bytes"),
+            "open_fds": len(os.listdir("/proc/self/fd")),
+        }
+
+
+def _read_key_values(path: str) -> dict[str, int]:
+    try:
+        with open(path) as f:
+            return {
+                key: int(value)
+                for key, value in (line.split(":", 1) for line in f if ":" in line)
+            }
+    except OSError:
+        # e.g. /proc/self/io isn't readable in some sandboxes
+        return {}
+
+
+def _create_usage_reader() -> _UsageReader:
+    try:
+        return _PsutilUsageReader()
+    except ImportError:
+        return _ProcUsageReader()
+
+
+class ResourceSampler:
+    """
+    Samples resource usage of the current process on a background thread (use as a context manager).
+
+    Each sample holds the CPU usage (in % of one core) and the network and disk throughput since the previous sample,
+    plus the current RSS and number of open file descriptors.
+    """
+
+    def __init__(self, config: TelemetryConfig | None = None):
+        self.config = config or TelemetryConfig()
+        self.samples: list[dict[str, Any]] = []
+        self.allocation_snapshots: list[dict[str, Any]] = []
+        self._reader = _create_usage_reader()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if self.config.tracemalloc_top and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._start = time.monotonic()
+        self._previous = self._reader.read()
+        self._previous_time = self._start
+        self._last_snapshot = self._start
+        # run with a copy of the current context so that prints end up in the logs of the Prefect run
+        ctx = contextvars.copy_context()
+        self._thread = threading.Thread(
+            target=ctx.run, args=(self._run,), name="resource-sampler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        if self.config.tracemalloc_top:
+            self._snapshot_allocations()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.config.interval_seconds):
+            try:
+                self._sample()
+                if (
+                    self.config.tracemalloc_top
+                    and time.monotonic() - self._last_snapshot
+                    >= self.config.tracemalloc_interval_seconds
+                ):
+                    self._snapshot_allocations()
+            except Exception as e:
+                print(f"Sampling resource usage failed, stopping: {e}")
+                return
+
+    def _sample(self):
+        now = time.monotonic()
+        current = self._reader.read()
+        elapsed = now - self._previous_time or 1e-9
+
+        def rate(key: str) -> float | None:
+            if current[key] is None or self._previous[key] is None:
+                return None
+            return (current[key] - self._previous[key]) / elapsed  # type: ignore
+
+        cpu_rate = rate("cpu_seconds")
+        self.samples.append(
+            {
+                "offset_seconds": round(now - self._start, 3),
+                "cpu_percent": None if cpu_rate is None else 100 * cpu_rate,
+                "rss_bytes": current["rss_bytes"],
+                "net_sent_bytes_per_second": rate("net_sent_bytes"),
+                "net_recv_bytes_per_second": rate("net_recv_bytes"),
+                "disk_read_bytes_per_second": rate("disk_read_bytes"),
+                "disk_write_bytes_per_second": rate("disk_write_bytes"),
+                "open_fds": current["open_fds"],
+            }
+        )
+        self._previous = current
+        self._previous_time = now
+
+    def _snapshot_allocations(self):
+        self._last_snapshot = time.monotonic()
+        stats = tracemalloc.take_snapshot().statistics("lineno")
+        self.allocation_snapshots.append(
+            {
+                "offset_seconds": round(self._last_snapshot - self._start, 3),
+                "traced_bytes": tracemalloc.get_traced_memory()[0],
+                "top_allocations": [
+                    {
+                        "location": str(stat.traceback),
+                        "bytes": stat.size,
+                        "count": stat.count,
+                    }
+                    for stat in stats[: self.config.tracemalloc_top]
+                ],
+            }
+        )
+
+    def summary(self) -> dict:
+        """
+        Returns a JSON-serializable summary with all samples (and allocation snapshots, if enabled).
+        """
+        cpu = [s["cpu_percent"] for s in self.samples if s["cpu_percent"] is not None]
+        rss = [s["rss_bytes"] for s in self.samples if s["rss_bytes"] is not None]
+        return {
+            "interval_seconds": self.config.interval_seconds,
+            "mean_cpu_percent": sum(cpu) / len(cpu) if cpu else None,
+            "max_cpu_percent": max(cpu, default=None),
+            "max_rss_bytes": max(rss, default=None),
+            "samples": self.samples,
+            "allocation_snapshots": self.allocation_snapshots,
+        }
@@ -0,0 +1,219 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Iterable, Iterator
+
+from utils.checkpoint_index import checkpoint_key
+from utils.sqlite import ThreadLocalConnections
+
+WORK_QUEUE_DB_PATH = os.environ.get("WORK_QUEUE_DB_PATH", "./tmp/work_queues.sqlite3")
+"""
+Default location of the SQLite database holding work queues.
+Flow runs in different containers only share a queue if this path points to the same (mounted) host directory for all of them.
+"""
+
+_ENQUEUE_BATCH_SIZE = 10_000
+
+
+def _to_sqlite_int(key: int) -> int:
+    # checkpoint keys are unsigned 64-bit integers, SQLite integers are signed
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def _from_sqlite_int(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class WorkQueue:
+    """
+    A durable queue of inputs, stored in a SQLite database, that multiple flow runs (i.e. workers) can consume concurrently.
+
+    Workers lease small batches of items, which are invisible to other workers until they are acknowledged or the lease expires
+    (after `visibility_timeout_seconds`, e.g. because the worker crashed). Items are identified by their checkpoint key
+    (see `utils.checkpoint_index`), so enqueueing an input that is already in the queue does nothing.
+    Inputs must be JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        visibility_timeout_seconds: float = 600.0,
+        db_path: str = WORK_QUEUE_DB_PATH,
+    ):
+        self.name = name
+        self.visibility_timeout_seconds = visibility_timeout_seconds
+        self.db_path = db_path
+        self._connections = ThreadLocalConnections(db_path)
+        with self._connections.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS work_items (
+                    queue TEXT NOT NULL,
+                    key INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    leases INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL,
+                    acked_at REAL,
+                    PRIMARY KEY (queue, key)
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS work_items_by_status ON work_items (queue, status, enqueued_at)"
+            )
+
+    def enqueue(self, inputs: Iterable[Any]) -> int:
+        """
+        Adds inputs to the queue (skipping inputs that are already in it). Returns the number of inputs added.
+        """
+        added = 0
+        batch = []
+        for input_el in inputs:
+            batch.append(input_el)
+            if len(batch) == _ENQUEUE_BATCH_SIZE:
+                added += self._enqueue_batch(batch)
+                batch = []
+        if batch:
+            added += self._enqueue_batch(batch)
+        return added
+
+    def lease(self, owner: str, max_items: int) -> list[tuple[int, Any]]:
+        """
+        Leases up to `max_items` items that are neither acknowledged nor leased by another worker (with a lease that hasn't expired yet).
+        Returns (checkpoint key, input) tuples.
+        """
+        with self._connections.transaction() as conn:
+            now = time.time()
+            rows = conn.execute(
+                """
+                SELECT key, payload FROM work_items
+                WHERE queue = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires_at < ?))
+                ORDER BY enqueued_at LIMIT ?
+                """,
+                (self.name, now, max_items),
+            ).fetchall()
+            conn.executemany(
+                """
+                UPDATE work_items SET status = 'leased', lease_owner = ?, lease_expires_at = ?, leases = leases + 1
+                WHERE queue = ? AND key = ?
+                """,
+                [
+                    (owner, now + self.visibility_timeout_seconds, self.name, key)
+                    for key, _ in rows
+                ],
+            )
+        return [(_from_sqlite_int(key), json.loads(payload)) for key, payload in rows]
+
+    def iter_leased(
+        self, owner: str, batch_size: int = 100
+    ) -> Iterator[tuple[int, Any]]:
+        """
+        Leases batches of items until the queue is drained, yielding (checkpoint key, input) tuples.
+
+        Leases held by `owner` from before (e.g. by a previous attempt of the same flow run) are released first.
+        """
+        self.release(owner)
+        while batch := self.lease(owner, batch_size):
+            yield from batch
+
+    def ack(self, keys: Iterable[int]):
+        """
+        Marks items as done, so they are never leased again.
+        """
+        with self._connections.transaction() as conn:
+            conn.executemany(
+                "UPDATE work_items SET status = 'acked', acked_at = ?, lease_owner = NULL, lease_expires_at = NULL WHERE queue = ? AND key = ?",
+                [(time.time(), self.name, _to_sqlite_int(key)) for key in keys],
+            )
+
+    def extend_leases(self, owner: str):
+        """
+        Extends all leases held by `owner` by `visibility_timeout_seconds` (from now).
+        """
+        with self._connections.transaction() as conn:
+            conn.execute(
+                "UPDATE work_items SET lease_expires_at = ? WHERE queue = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + self.visibility_timeout_seconds, self.name, owner),
+            )
+
+    def release(self, owner: str):
+        """
+        Makes all items leased by `owner` available to other workers again.
+        """
+        with self._connections.transaction() as conn:
+            conn.execute(
+                "UPDATE work_items SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL WHERE queue = ? AND status = 'leased' AND lease_owner = ?",
+                (self.name, owner),
+            )
+
+    def counts(self) -> dict[str, int]:
+        """
+        Returns the number of items per status ("pending", "leased", "acked").
+        """
+        with self._connections.transaction() as conn:
+            return dict(
+                conn.execute(
+                    "SELECT status, COUNT(*) FROM work_items WHERE queue = ? GROUP BY status",
+                    (self.name,),
+                ).fetchall()
+            )
+
+    def _enqueue_batch(self, inputs: list[Any]) -> int:
+        now = time.time()
+        with self._connections.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO work_items (queue, key, payload, status, enqueued_at) VALUES (?, ?, ?, 'pending', ?)",
+                [
+                    (
+                        self.name,
+                        _to_sqlite_int(checkpoint_key(input_el)),
+                        json.dumps(input_el),
+                        now,
+                    )
+                    for input_el in inputs
+                ],
+            )
+            return conn.total_changes - before
+
+
+class LeaseHeartbeat:
+    """
+    Extends all leases held by `owner` on a background thread every `visibility_timeout_seconds / 3` (use as a context manager),
+    so that items a worker is still busy with don't expire while nothing is committed for a while
+    (e.g. while the circuit breaker pauses calls or while waiting for uploads to catch up).
+
+    If the worker crashes, the heartbeat stops too and its leases expire as usual.
+    """
+
+    def __init__(self, queue: WorkQueue, owner: str):
+        self.queue = queue
+        self.owner = owner
+        self.interval_seconds = queue.visibility_timeout_seconds / 3
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        # run with a copy of the current context so that prints end up in the logs of the Prefect run
+        ctx = contextvars.copy_context()
+        self._thread = threading.Thread(
+            target=ctx.run, args=(self._run,), name="lease-heartbeat", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.queue.extend_leases(self.owner)
+            except Exception as e:
+                # a transient database error shouldn't stop the heartbeat, leases only expire after several missed beats
+                print(f"Extending leases of work queue {self.queue.name} failed: {e}")
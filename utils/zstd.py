@@ -1,5 +1,212 @@
 import zstandard as zstd
+import functools
+import io
+import json
 import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import BinaryIO, Callable, Literal
+from prefect_aws import S3Bucket
+
+from utils.bootstrap import load_block
+
+STREAM_CHUNK_SIZE = 4 * 1024**2
+"""
+Size of the chunks files are read (and written) in when streaming, which bounds memory usage regardless of the file size.
+"""
+
+ZSTD_DICTIONARIES_S3_PREFIX = os.environ.get(
+    "ZSTD_DICTIONARIES_S3_PREFIX", "zstd-dictionaries"
+)
+"""
+Prefix under which dictionaries are stored in the default S3 bucket (see `ZstdDictionaryStore`).
+"""
+
+ZSTD_DICTIONARIES_CACHE_DIR = os.environ.get(
+    "ZSTD_DICTIONARIES_CACHE_DIR", "./tmp/zstd_dictionaries"
+)
+"""
+Local directory dictionaries are cached in once downloaded (by ID, as the contents of a dictionary never change).
+"""
+
+DEFAULT_DICTIONARY_SIZE = 112 * 1024
+"""
+Default size of trained dictionaries (the same as the zstd CLI's).
+"""
+
+DictionaryResolver = Callable[[int], zstd.ZstdCompressionDict]
+"""
+Returns the dictionary with the given ID (as recorded in the header of each frame compressed with it).
+"""
+
+_ADAPTIVE_LEVELS = [1, 3, 6, 9, 12, 15, 19]
+_ADAPTIVE_SAMPLE_SIZE = 1024**2
+# the frame header (including the dictionary ID) is at most 18 bytes long
+_FRAME_HEADER_MAX_SIZE = 18
+# IDs below 32768 and above 2^31 - 1 are reserved by the zstd format
+_DICTIONARY_ID_RANGE = (32768, 2**31 - 1)
+
+
+def _compressor(
+    compression_level: int,
+    threads: int,
+    dictionary: zstd.ZstdCompressionDict | None = None,
+) -> zstd.ZstdCompressor:
+    # with threads != 0, zstd splits the input into jobs compressed by worker threads (-1 uses one thread per core)
+    # the ID of the dictionary (if any) is written to the header of every frame, so readers can find it
+    return zstd.ZstdCompressor(
+        level=compression_level, threads=threads, dict_data=dictionary
+    )
+
+
+def train_dictionary(
+    samples: list[bytes],
+    dict_size: int = DEFAULT_DICTIONARY_SIZE,
+    dict_id: int = 0,
+    compression_level: int = 3,
+) -> zstd.ZstdCompressionDict:
+    """
+    Trains a dictionary on `samples`, which should be representative of (and about as large as) the data compressed with it,
+    e.g. individual JSONL records written for an API endpoint. Dictionaries help most with many small, similar records.
+
+    Raises `zstd.ZstdError` if there are too few samples for a dictionary of the given size.
+    """
+    return zstd.train_dictionary(
+        dict_size, samples, dict_id=dict_id, level=compression_level, threads=-1
+    )
+
+
+def frame_dictionary_id(header: bytes) -> int:
+    """
+    Returns the ID of the dictionary the (first) frame starting with `header` was compressed with,
+    or 0 if it was compressed without a dictionary (or `header` is not a complete frame header).
+    """
+    try:
+        return zstd.get_frame_parameters(header[:_FRAME_HEADER_MAX_SIZE]).dict_id
+    except zstd.ZstdError:
+        return 0
+
+
+def file_dictionary_id(file_path: str) -> int:
+    """
+    Returns the ID of the dictionary the first frame of a file was compressed with (0 if none, or if the file is empty).
+    """
+    with open(file_path, "rb") as f:
+        return frame_dictionary_id(f.read(_FRAME_HEADER_MAX_SIZE))
+
+
+class _PeekedStream:
+    """
+    Puts bytes that have already been read from a (possibly unseekable) stream in front of it again.
+    """
+
+    def __init__(self, head: bytes, stream: BinaryIO):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._head:
+            return self._stream.read(size)
+        if size < 0:
+            data, self._head = self._head + self._stream.read(), b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+    def close(self):
+        self._stream.close()
+
+
+def open_stream_reader(
+    source: BinaryIO, dictionaries: DictionaryResolver | None = None
+) -> zstd.ZstdDecompressionReader:
+    """
+    Returns a file-like object decompressing everything read from `source` (across frames).
+
+    If the data was compressed with a dictionary, it is looked up by the ID in the first frame header with `dictionaries`
+    (by default, from the `ZstdDictionaryStore` in the default S3 bucket). All frames of a file use the same dictionary.
+    """
+    head = source.read(_FRAME_HEADER_MAX_SIZE)
+    dict_id = frame_dictionary_id(head)
+    dictionary = None
+    if dict_id:
+        dictionary = (dictionaries or default_dictionary_store().get)(dict_id)
+    return zstd.ZstdDecompressor(dict_data=dictionary).stream_reader(
+        _PeekedStream(head, source), read_across_frames=True
+    )
+
+
+def choose_compression_level(
+    sample: bytes, target_mb_per_second: float, threads: int = -1
+) -> int:
+    """
+    Returns the highest compression level at which `sample` (representative of the data to be compressed) is compressed
+    at least at `target_mb_per_second`, estimated from compressing (up to 1 MiB of) it on a single core.
+    Falls back to the fastest level if even that is too slow.
+    """
+    sample = sample[:_ADAPTIVE_SAMPLE_SIZE]
+    if not sample:
+        return _ADAPTIVE_LEVELS[0]
+    cores = (os.cpu_count() or 1) if threads < 0 else max(threads, 1)
+    chosen = _ADAPTIVE_LEVELS[0]
+    for level in _ADAPTIVE_LEVELS:
+        start = time.perf_counter()
+        zstd.ZstdCompressor(level=level).compress(sample)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        if len(sample) / 1024**2 / elapsed * cores < target_mb_per_second:
+            break
+        chosen = level
+    return chosen
+
+
+def open_writer(
+    file_path: str,
+    compression_level: int = 3,
+    threads: int = 0,
+    mode: Literal["wb", "ab"] = "wb",
+    dictionary: zstd.ZstdCompressionDict | None = None,
+) -> zstd.ZstdCompressionWriter:
+    """
+    Opens a file-like object compressing everything written to it into `file_path` (use as a context manager,
+    closing it ends the zstd frame and closes the file). Memory usage doesn't depend on the amount of data written.
+
+    NOTE: when appending to a file, use the dictionary it was started with (see `file_dictionary_id`).
+    """
+    return _compressor(compression_level, threads, dictionary).stream_writer(
+        open(file_path, mode), closefd=True
+    )
+
+
+def open_reader(
+    file_path: str, dictionaries: DictionaryResolver | None = None
+) -> zstd.ZstdDecompressionReader:
+    """
+    Opens a file-like object returning the decompressed contents of `file_path`, which may consist of multiple
+    concatenated frames (as written by the scraping utils, which end a frame on every commit).
+    Dictionaries are resolved as in `open_stream_reader`.
+    """
+    # closing the reader closes the file
+    return open_stream_reader(open(file_path, "rb"), dictionaries)
+
+
+def compress_stream(
+    source: BinaryIO,
+    target: BinaryIO,
+    compression_level: int = 3,
+    threads: int = -1,
+    dictionary: zstd.ZstdCompressionDict | None = None,
+) -> tuple[int, int]:
+    """
+    Compresses everything read from `source` into `target` in chunks, returning the number of bytes read and written.
+    """
+    return _compressor(compression_level, threads, dictionary).copy_stream(
+        source, target, read_size=STREAM_CHUNK_SIZE, write_size=STREAM_CHUNK_SIZE
+    )
 
 
 def compress_file(
@@ -7,39 +214,260 @@ def compress_file(
     output_file_path: str | None = None,
     compression_level=3,
     remove_input_file=False,
+    threads: int = -1,
+    target_mb_per_second: float | None = None,
+    dictionary: zstd.ZstdCompressionDict | None = None,
 ):
+    """
+    Compresses a file in chunks (with bounded memory usage), using `threads` worker threads (-1: one per core, 0: compress
+    on the calling thread). If `target_mb_per_second` is set, the compression level is chosen based on a sample of the file
+    (see `choose_compression_level`) instead of using `compression_level`. If `dictionary` is set, the file is compressed
+    with it (and its ID is recorded in the file, so `decompress_file` can find it).
+    """
     if output_file_path is None:
         output_file_path = input_file_path + ".zst"
 
     with open(input_file_path, "rb") as input_file:
-        data = input_file.read()
-
-    cctx = zstd.ZstdCompressor(level=compression_level)
-    compressed_data = cctx.compress(data)
-
-    with open(output_file_path, "wb") as output_file:
-        output_file.write(compressed_data)
+        if target_mb_per_second is not None:
+            compression_level = choose_compression_level(
+                input_file.read(_ADAPTIVE_SAMPLE_SIZE), target_mb_per_second, threads
+            )
+            input_file.seek(0)
+        # written to a temporary file first, so that an interrupted compression never leaves a truncated output behind
+        tmp_path = output_file_path + ".tmp"
+        with open(tmp_path, "wb") as output_file:
+            compress_stream(
+                input_file, output_file, compression_level, threads, dictionary
+            )
+    os.replace(tmp_path, output_file_path)
     if remove_input_file:
         os.remove(input_file_path)
 
     return output_file_path
 
 
-def decompress_file(input_file_path, output_file_path=None):
+def decompress_file(
+    input_file_path,
+    output_file_path=None,
+    dictionaries: DictionaryResolver | None = None,
+):
+    """
+    Decompresses a file (which may consist of multiple frames) in chunks, so memory usage doesn't depend on its size.
+    Dictionaries are resolved as in `open_stream_reader`.
+    """
     if output_file_path is None:
         output_file_path = input_file_path.replace(".zst", "").replace(".zstd", "")
 
-    # Read the compressed data from the input file
-    with open(input_file_path, "rb") as input_file:
-        compressed_data = input_file.read()
+    tmp_path = output_file_path + ".tmp"
+    with (
+        open_reader(input_file_path, dictionaries) as reader,
+        open(tmp_path, "wb") as output_file,
+    ):
+        while chunk := reader.read(STREAM_CHUNK_SIZE):
+            output_file.write(chunk)
+    os.replace(tmp_path, output_file_path)
+    return output_file_path
+
+
+def decompress_bytes(
+    data: bytes, dictionaries: DictionaryResolver | None = None
+) -> bytes:
+    """
+    Decompresses zstd-compressed data, which may consist of multiple concatenated frames
+    (as written by the scraping utils, which end a frame on every commit).
+    Dictionaries are resolved as in `open_stream_reader`.
+    """
+    with open_stream_reader(io.BytesIO(data), dictionaries) as reader:
+        return reader.read()
+
+
+class ZstdDictionaryStore:
+    """
+    Stores versioned dictionaries in S3, trained per name (usually the S3 prefix of an API endpoint the data is written to).
+
+    Layout under `s3_prefix`:
+    - `ids/<dict ID>.zdict`: the contents of a dictionary (never changed once written)
+    - `names/<name>/v<version>_<dict ID>.json`: metadata of each version of the dictionary for a name
+
+    Every frame compressed with a dictionary records its ID, so readers only need the ID to find the dictionary
+    (see `get`), even once newer versions have been trained. Dictionaries are cached in memory and on disk.
+    """
+
+    _VERSION_FILE_PATTERN = re.compile(r"v(\d+)_(\d+)\.json")
+
+    def __init__(
+        self,
+        bucket: S3Bucket,
+        s3_prefix: str = ZSTD_DICTIONARIES_S3_PREFIX,
+        cache_dir: str = ZSTD_DICTIONARIES_CACHE_DIR,
+    ):
+        self.bucket = bucket
+        self.s3_prefix = s3_prefix.rstrip("/")
+        self.cache_dir = cache_dir
+        self._dictionaries: dict[int, zstd.ZstdCompressionDict] = {}
+        self._lock = threading.Lock()
+
+    def _dictionary_key(self, dict_id: int) -> str:
+        return f"{self.s3_prefix}/ids/{dict_id}.zdict"
+
+    def _versions_prefix(self, name: str) -> str:
+        return f"{self.s3_prefix}/names/{name.strip('/')}/"
+
+    def get(self, dict_id: int) -> zstd.ZstdCompressionDict:
+        """
+        Returns the dictionary with the given ID.
+        """
+        with self._lock:
+            dictionary = self._dictionaries.get(dict_id)
+        if dictionary is not None:
+            return dictionary
+        cache_path = os.path.join(self.cache_dir, f"{dict_id}.zdict")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                data = f.read()
+        else:
+            data = self.bucket.read_path(self._dictionary_key(dict_id))
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # written atomically, so that concurrent processes never read a partial dictionary
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        dictionary = zstd.ZstdCompressionDict(data)
+        if dictionary.dict_id() != dict_id:
+            raise ValueError(
+                f"Dictionary stored under ID {dict_id} has ID {dictionary.dict_id()}"
+            )
+        with self._lock:
+            self._dictionaries[dict_id] = dictionary
+        return dictionary
+
+    def versions(self, name: str) -> list[dict]:
+        """
+        Returns the metadata of all versions of the dictionary for `name` (oldest first).
+        """
+        prefix = self._versions_prefix(name)
+        versions = []
+        for obj in self.bucket.list_objects(prefix):
+            # listing is by prefix, so it may include names nested under this one
+            match = self._VERSION_FILE_PATTERN.fullmatch(
+                obj["Key"].removeprefix(prefix)
+            )
+            if match:
+                versions.append(
+                    {
+                        "version": int(match.group(1)),
+                        "dict_id": int(match.group(2)),
+                        "key": obj["Key"],
+                    }
+                )
+        return sorted(versions, key=lambda v: v["version"])
+
+    def latest(self, name: str) -> zstd.ZstdCompressionDict | None:
+        """
+        Returns the latest version of the dictionary for `name` (None if none has been trained yet).
+        """
+        versions = self.versions(name)
+        return self.get(versions[-1]["dict_id"]) if versions else None
+
+    def publish(
+        self,
+        name: str,
+        dictionary: zstd.ZstdCompressionDict,
+        metadata: dict | None = None,
+    ) -> int:
+        """
+        Stores `dictionary` as the new latest version of the dictionary for `name`, returning its version number.
+        """
+        dict_id = dictionary.dict_id()
+        if not dict_id:
+            raise ValueError("Dictionaries need an ID to be stored")
+        versions = self.versions(name)
+        version = versions[-1]["version"] + 1 if versions else 1
+        # the dictionary itself is written first, so that no version ever refers to a missing dictionary
+        self.bucket.write_path(self._dictionary_key(dict_id), dictionary.as_bytes())
+        self.bucket.write_path(
+            f"{self._versions_prefix(name)}v{version:05d}_{dict_id}.json",
+            json.dumps(
+                {
+                    "name": name,
+                    "version": version,
+                    "dict_id": dict_id,
+                    "dict_size": len(dictionary.as_bytes()),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    **(metadata or {}),
+                }
+            ).encode(),
+        )
+        with self._lock:
+            self._dictionaries[dict_id] = dictionary
+        print(f"Published version {version} of zstd dictionary {name} (ID {dict_id})")
+        return version
+
+    def _unused_dictionary_id(self) -> int:
+        while True:
+            dict_id = random.randint(*_DICTIONARY_ID_RANGE)
+            if not self.bucket.list_objects(self._dictionary_key(dict_id)):
+                return dict_id
 
-    decompressed_data = decompress_bytes(compressed_data)
+    def train(
+        self,
+        name: str,
+        samples: list[bytes],
+        dict_size: int = DEFAULT_DICTIONARY_SIZE,
+        compression_level: int = 3,
+        metadata: dict | None = None,
+    ) -> zstd.ZstdCompressionDict:
+        """
+        Trains a new version of the dictionary for `name` on `samples` (see `train_dictionary`) and publishes it.
+        """
+        dictionary = train_dictionary(
+            samples, dict_size, self._unused_dictionary_id(), compression_level
+        )
+        self.publish(
+            name,
+            dictionary,
+            {
+                "samples": len(samples),
+                "samples_bytes": sum(len(s) for s in samples),
+                **(metadata or {}),
+            },
+        )
+        return dictionary
 
-    # Write the decompressed data to the output file
-    with open(output_file_path, "wb") as output_file:
-        output_file.write(decompressed_data)
+    def sample_records(
+        self, s3_prefix: str, max_files: int = 20, max_samples: int = 20_000
+    ) -> list[bytes]:
+        """
+        Returns up to `max_samples` records (JSONL lines) from the latest `max_files` zstd-compressed JSONL files under `s3_prefix`,
+        e.g. for training a dictionary with `train`. Files are streamed, so only the sampled records are held in memory.
+        """
+        prefix = s3_prefix.rstrip("/") + "/"
+        # file names start with timestamps (also within Hive-style partitions), so the latest files come last
+        keys = sorted(
+            obj["Key"]
+            for obj in self.bucket.list_objects(prefix)
+            if obj["Key"].startswith(prefix) and obj["Key"].endswith(".jsonl.zst")
+        )[-max_files:]
+        client = self.bucket.credentials.get_s3_client()
+        samples: list[bytes] = []
+        for i, key in enumerate(keys):
+            # spread samples evenly across files
+            limit = len(samples) + (max_samples - len(samples)) // (len(keys) - i)
+            body = client.get_object(Bucket=self.bucket.bucket_name, Key=key)["Body"]
+            with open_stream_reader(body, self.get) as reader:
+                for line in io.BufferedReader(reader):  # type: ignore
+                    if len(samples) >= limit:
+                        break
+                    if line.strip():
+                        samples.append(line.rstrip(b"\n"))
+        print(f"Sampled {len(samples)} records from {len(keys)} files under {prefix}")
+        return samples
 
 
-def decompress_bytes(data: bytes) -> bytes:
-    dctx = zstd.ZstdDecompressor()
-    return dctx.decompress(data)
+@functools.cache
+def default_dictionary_store() -> ZstdDictionaryStore:
+    """
+    Returns the dictionary store in the default S3 bucket (shared by the whole process, so dictionaries are only loaded once).
+    """
+    return ZstdDictionaryStore(load_block(S3Bucket, "s3-bucket"))
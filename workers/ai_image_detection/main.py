@@ -17,7 +17,16 @@ from prefect_aws import S3Bucket
 from prefect import flow
 
 from utils.flow_deployment import create_image_config
+from utils.chunk_uploads import ChunkingConfig
+from utils.circuit_breaker import CircuitBreakerConfig
 from utils.scraping import RunMetaConfig, process_and_upload_data
+from utils.sharding import fan_out
+from utils.telemetry import TelemetryConfig
+
+IMAGE_REQUEST_TIMEOUT = (10, 60)
+"""
+Timeouts (in seconds) for connecting to image hosts and for receiving data from them.
+"""
 
 
 def extract_pipeline_metadata(pipe: Pipeline, seed_used: int):
@@ -173,7 +182,16 @@ def run_ai_image_detection_and_upload_results(
     image_urls: list[str],
     entity_type: Literal["artists", "albums"],
     store_images_in_s3: bool = True,
+    collect_telemetry: bool = False,
+    chunking: ChunkingConfig | None = None,
+    circuit_breaker: CircuitBreakerConfig | None = None,
 ):
+    """
+    Runs AI image detection for the given image URLs and uploads the results to S3.
+
+    If `chunking` is set, results are uploaded in chunks while the run progresses (instead of once at the end).
+    If `circuit_breaker` is set, downloading images is paused while most downloads fail (e.g. because the image host is down).
+    """
     s3_bucket = cast(S3Bucket, S3Bucket.load("s3-bucket"))
     model_name = "Organika/sdxl-detector"
 
@@ -187,7 +205,9 @@ def run_ai_image_detection_and_upload_results(
     metadata = extract_pipeline_metadata(pipe, seed_used)
 
     def run_inference(image_url: str):
-        img_bytes = requests.get(image_url).content
+        response = requests.get(image_url, timeout=IMAGE_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        img_bytes = response.content
         img = Image.open(BytesIO(img_bytes))
         sha256_hash = hashlib.sha256(img_bytes).hexdigest()
         avg_hash = str(imagehash.average_hash(img))
@@ -218,6 +238,38 @@ def run_ai_image_detection_and_upload_results(
             metadata=metadata,
             s3_prefix=f"spotify/ai-image-detection/run-metadata/{entity_type}",
         ),
+        chunking=chunking,
+        circuit_breaker=circuit_breaker,
+        # helps with sizing the containers (e.g. memory needed for the model)
+        telemetry=TelemetryConfig() if collect_telemetry else None,
+    )
+
+
+@flow(name="sp-ai-image-detection-fan-out", log_prints=True)
+def fan_out_ai_image_detection(
+    image_urls: list[str],
+    entity_type: Literal["artists", "albums"],
+    num_shards: int = 4,
+    store_images_in_s3: bool = True,
+    collect_telemetry: bool = False,
+    chunking: ChunkingConfig | None = None,
+    circuit_breaker: CircuitBreakerConfig | None = None,
+):
+    """
+    Splits `image_urls` into `num_shards` runs of the `sp-ai-image-detection` deployment, which can be picked up by different workers.
+    """
+    return fan_out(
+        "sp-ai-image-detection/api",
+        inputs=image_urls,
+        inputs_parameter="image_urls",
+        num_shards=num_shards,
+        parameters={
+            "entity_type": entity_type,
+            "store_images_in_s3": store_images_in_s3,
+            "collect_telemetry": collect_telemetry,
+            "chunking": chunking,
+            "circuit_breaker": circuit_breaker,
+        },
     )
 
 
@@ -232,3 +284,12 @@ if __name__ == "__main__":
             dockerfile_path="Dockerfile_ai_image_detection",
         ),
     )
+    fan_out_ai_image_detection.deploy(
+        "api",
+        work_pool_name="Docker",
+        image=create_image_config(
+            flow_identifier="sp-ai-image-detection",
+            version="v1.0",
+            dockerfile_path="Dockerfile_ai_image_detection",
+        ),
+    )